@@ -0,0 +1,72 @@
+"""Clock-in latency over a large ``time_entries`` history, with and without indexes.
+
+Seeds ``--entries`` completed entries (1M by default) for ``--employees``
+employees, then replays the clock-in/clock-out lookups of ``server.py`` for
+``--taps`` random employees, first on the bare collections and then after
+``ensure_indexes``::
+
+    python benchmarks/bench_clock_in_indexes.py --entries 1000000
+"""
+import argparse
+import asyncio
+import random
+import uuid
+from datetime import datetime
+
+from common import Timer, print_summary, scratch_db, seed
+
+from indexes import ensure_indexes
+from timesheet import OPEN_STATUSES, utc_now
+
+
+async def clock_in_out(db, employee_id: str) -> None:
+    employee = await db.employees.find_one({"id": employee_id, "isActive": True}, {"_id": 1})
+    assert employee
+    await db.time_entries.insert_one({
+        "id": str(uuid.uuid4()),
+        "employeeId": employee_id,
+        "startTime": utc_now(),
+        "endTime": None,
+        "breaks": [],
+        "status": "active",
+        "notes": None,
+        "createdAt": datetime.utcnow(),
+    })
+    active = await db.time_entries.find_one({
+        "employeeId": employee_id,
+        "status": {"$in": OPEN_STATUSES}
+    })
+    await db.time_entries.update_one(
+        {"id": active["id"]},
+        {"$set": {"endTime": utc_now(), "status": "completed"}}
+    )
+
+
+async def run(args) -> None:
+    async with scratch_db() as db:
+        print(f"Seeding {args.employees} employees and {args.entries} entries...")
+        roster = await seed(db, args.employees, args.entries)
+        rng = random.Random(42)
+
+        for label in ("without indexes", "with indexes"):
+            if label == "with indexes":
+                print("Building indexes...")
+                await ensure_indexes(db)
+            timer = Timer()
+            for _ in range(args.taps):
+                employee_id = rng.choice(roster)["id"]
+                with timer:
+                    await clock_in_out(db, employee_id)
+            print_summary(f"clock-in + clock-out {label}", timer.samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--employees", type=int, default=500)
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--taps", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Throughput and peak memory of the payroll export for a 1M-row month.
+
+By default rows come from an in-memory generator, isolating the formatting
+and writing cost; ``--source mongo`` seeds the scratch database and reads
+through a real Motor cursor as ``/api/exports/time-entries`` does::
+
+    python benchmarks/bench_export.py --rows 1000000 --format csv
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import resource
+import time
+
+from common import make_employees, make_entries, scratch_db, seed
+
+from exports import EMPLOYEE_PROJECTION, EXPORT_PROJECTION, csv_chunks, write_xlsx
+
+
+async def from_memory(entries):
+    for entry in entries:
+        yield entry
+
+
+async def export(entries, employees, fmt: str) -> int:
+    """Run one export and return the number of bytes produced."""
+    if fmt == "csv":
+        size = 0
+        async for chunk in csv_chunks(entries, employees):
+            size += len(chunk.encode("utf-8"))
+        return size
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        await write_xlsx(entries, employees, path)
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+async def measure(label: str, entries, employees, fmt: str, rows: int) -> None:
+    started = time.perf_counter()
+    size = await export(entries, employees, fmt)
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{label}: {rows} rows, {size / 1e6:.1f} MB {fmt} in {elapsed:.2f}s "
+          f"({rows / elapsed:,.0f} rows/s), peak RSS {peak_rss:.0f} MB")
+
+
+async def run(args) -> None:
+    if args.source == "memory":
+        roster = make_employees(args.employees)
+        employees = {employee["id"]: employee for employee in roster}
+        entries = from_memory(make_entries(roster, args.rows, days=30))
+        await measure("memory", entries, employees, args.format, args.rows)
+        return
+
+    async with scratch_db() as db:
+        print(f"Seeding {args.rows} entries...")
+        await seed(db, args.employees, args.rows)
+        employees = {
+            employee["id"]: employee
+            for employee in await db.employees.find({}, EMPLOYEE_PROJECTION).to_list(None)
+        }
+        cursor = db.time_entries.find({}, EXPORT_PROJECTION).sort([("startTime", 1), ("id", 1)])
+        await measure("mongo", cursor, employees, args.format, args.rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--employees", type=int, default=500)
+    parser.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+    parser.add_argument("--source", choices=["memory", "mongo"], default="memory")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Per-request cost of ``MetricsMiddleware``.
+
+Builds an app with the same route table as ``server.py`` (every route
+answering ``{}`` straight away, so the framework is all that's measured) and
+sends ``--requests`` requests through ``httpx.ASGITransport`` to
+``/api/clock-in/{employee_id}`` with a fresh id each time, which defeats the
+per-path memo, with and without the middleware::
+
+    python benchmarks/bench_metrics.py --requests 20000
+"""
+import argparse
+import asyncio
+import logging
+import uuid
+
+import httpx
+from fastapi import APIRouter, FastAPI
+from fastapi.routing import APIRoute
+
+from common import Timer, print_summary, summarize
+
+from metrics import REGISTRY, MetricsMiddleware, leaf_routes
+from server import app as server_app
+
+# server.py logs at INFO, which would log every request
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+async def empty_response():
+    return {}
+
+
+def make_app(with_metrics: bool) -> FastAPI:
+    app = FastAPI()
+    router = APIRouter()
+    for route in leaf_routes(server_app.routes):
+        if isinstance(route, APIRoute):
+            router.add_api_route(route.path, empty_response, methods=list(route.methods))
+    app.include_router(router)
+    if with_metrics:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def run(apps, requests: int, block: int = 1000):
+    """Alternate blocks of requests between the apps, so drift hits both alike."""
+    timers = [Timer() for _ in apps]
+    clients = [
+        httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") for app in apps
+    ]
+    for client in clients:
+        for _ in range(200):  # warm-up
+            await client.post(f"/api/clock-in/{uuid.uuid4()}")
+    for _ in range(0, requests, block):
+        for client, timer in zip(clients, timers):
+            for _ in range(block):
+                path = f"/api/clock-in/{uuid.uuid4()}"
+                with timer:
+                    response = await client.post(path)
+                assert response.status_code == 200
+    for client in clients:
+        await client.aclose()
+    return timers
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+
+    baseline, instrumented = await run(
+        [make_app(with_metrics=False), make_app(with_metrics=True)], args.requests
+    )
+    print_summary("without metrics", baseline.samples)
+    print_summary("with MetricsMiddleware", instrumented.samples)
+    overhead = summarize(instrumented.samples)["mean_ms"] - summarize(baseline.samples)["mean_ms"]
+    print(f"mean overhead per request: {overhead * 1000:.1f}us")
+
+    timer = Timer()
+    for _ in range(20):
+        with timer:
+            REGISTRY.render()
+    print_summary("render /metrics", timer.samples)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""Per-entry Python loop versus the NumPy timesheet report at 1M entries.
+
+Both sides compute the same per-employee worked, break and overtime hours
+and cost from the same in-memory entries (about 1 GB of dicts at 1M rows)::
+
+    python benchmarks/bench_reporting.py --rows 1000000
+"""
+import argparse
+import gc
+import math
+import time
+from typing import Any, Dict, Iterable
+
+from common import make_employees, make_entries
+
+from reporting import ColumnBuilder, compute_report, scheduled_seconds
+from timesheet import entry_day, entry_seconds
+
+
+def loop_report(entries: Iterable[Dict[str, Any]], employees: Dict[str, Dict[str, Any]]) -> Dict[str, float]:
+    """The same totals computed one entry at a time."""
+    worked_by_day: Dict[tuple, float] = {}
+    breaks_total = 0.0
+    for entry in entries:
+        worked, breaks = entry_seconds(entry)
+        breaks_total += breaks
+        key = (entry["employeeId"], entry_day(entry))
+        worked_by_day[key] = worked_by_day.get(key, 0.0) + worked
+    worked_total = overtime_total = cost_total = 0.0
+    for (employee_id, _), worked in worked_by_day.items():
+        employee = employees.get(employee_id, {})
+        schedule = scheduled_seconds(employee)
+        worked_total += worked
+        if not math.isnan(schedule):
+            overtime_total += max(0.0, worked - schedule)
+        cost_total += worked / 3600 * (employee.get("hourlyRate") or 0.0)
+    return {
+        "workedHours": round(worked_total / 3600, 2),
+        "breakHours": round(breaks_total / 3600, 2),
+        "overtimeHours": round(overtime_total / 3600, 2),
+        "cost": round(cost_total, 2),
+    }
+
+
+def timed(label: str, rows: int, work):
+    started = time.perf_counter()
+    result = work()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed:8.2f}s ({rows / elapsed:>12,.0f} rows/s)")
+    return result, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--employees", type=int, default=500)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    roster = make_employees(args.employees)
+    employees = {employee["id"]: employee for employee in roster}
+    print(f"Generating {args.rows} entries...")
+    entries = list(make_entries(roster, args.rows, days=args.days))
+    # Keep the collector from rescanning the generated entries during the passes
+    gc.freeze()
+
+    def load():
+        builder = ColumnBuilder()
+        for entry in entries:
+            builder.add(entry)
+        return builder.build()
+
+    expected, loop_time = timed("python loop", args.rows, lambda: loop_report(entries, employees))
+    columns, load_time = timed("numpy load (to columns)", args.rows, load)
+    report, compute_time = timed("numpy compute", args.rows, lambda: compute_report(columns, employees))
+    print(f"speed-up: {loop_time / (load_time + compute_time):.1f}x end to end, "
+          f"{loop_time / compute_time:.1f}x once loaded")
+
+    totals = {name: report["totals"][name] for name in expected}
+    mismatched = {
+        name: (expected[name], totals[name])
+        for name in expected
+        if abs(expected[name] - totals[name]) > max(0.01, abs(expected[name]) * 1e-6)
+    }
+    if mismatched:
+        raise SystemExit(f"loop and numpy totals differ: {mismatched}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Cost of turning 10k time entry documents into a JSON response body.
+
+Compares the default path of ``/api/time-entries`` (a ``TimeEntry`` per
+document, re-validated against the response model and encoded by FastAPI
+with the stdlib encoder) with the ``FAST_RESPONSES`` path (projected
+documents encoded as they are, by orjson when installed, else stdlib)::
+
+    python benchmarks/bench_serialization.py --entries 10000
+"""
+import argparse
+import json
+
+from fastapi.encoders import jsonable_encoder
+
+from common import Timer, make_employees, make_entries, print_summary
+
+from serialization import ORJSON_AVAILABLE, dumps, json_default
+from server import TIME_ENTRY_PROJECTION, TimeEntry
+
+
+def pydantic_path(documents):
+    entries = [TimeEntry(**document) for document in documents]
+    # What FastAPI does with a response_model: validate, encode, dump
+    validated = [TimeEntry(**entry.dict()) for entry in entries]
+    return json.dumps(jsonable_encoder(validated)).encode('utf-8')
+
+
+def stdlib_path(documents):
+    return json.dumps(documents, default=json_default).encode('utf-8')
+
+
+def fast_path(documents):
+    return dumps(documents)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    fields = [name for name in TIME_ENTRY_PROJECTION if name != "_id"]
+    documents = [
+        {name: entry.get(name) for name in fields}
+        for entry in make_entries(make_employees(50), args.entries, days=30)
+    ]
+
+    paths = [("pydantic + jsonable_encoder", pydantic_path), ("projected, stdlib json", stdlib_path)]
+    if ORJSON_AVAILABLE:
+        paths.append(("projected, orjson", fast_path))
+    for label, path in paths:
+        timer = Timer()
+        size = len(path(documents))
+        for _ in range(args.repeat):
+            with timer:
+                path(documents)
+        print_summary(f"{label} ({size / 1e6:.1f} MB)", timer.samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Fan-out of clock deltas to 1k concurrent ``/api/events`` subscribers.
+
+The default mode drives ``EventBroker`` in-process and reports the cost of
+one ``publish`` and the publish-to-delivery latency across all subscribers.
+With ``--base-url`` it opens the subscribers as real SSE connections to a
+running API and measures tap-to-delivery latency for clock-in/clock-out taps::
+
+    python benchmarks/bench_sse_fanout.py --subscribers 1000
+    python benchmarks/bench_sse_fanout.py --subscribers 1000 --base-url http://localhost:8001/api
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import print_summary
+
+from events import EventBroker
+
+
+async def in_process(args) -> None:
+    broker = EventBroker(queue_size=args.queue_size)
+    latencies, publish_costs = [], []
+
+    async def subscriber():
+        subscription = broker.subscribe()
+        for _ in range(args.events):
+            event = await subscription.get()
+            if event["type"] != "resync":
+                latencies.append(time.perf_counter() - event["sent"])
+
+    tasks = [asyncio.create_task(subscriber()) for _ in range(args.subscribers)]
+    await asyncio.sleep(0)
+    for _ in range(args.events):
+        started = time.perf_counter()
+        broker.publish({"type": "clock_in", "employeeId": "bench", "sent": started})
+        publish_costs.append(time.perf_counter() - started)
+        await asyncio.sleep(args.interval)
+    await asyncio.wait_for(asyncio.gather(*tasks), timeout=60)
+
+    print_summary(f"publish to {args.subscribers} subscribers", publish_costs)
+    print_summary("publish -> delivery", latencies)
+
+
+async def over_http(args) -> None:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.subscribers + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=None, limits=limits) as client:
+        response = await client.post("/employees", json={"name": "SSE bench", "position": "Bench"})
+        response.raise_for_status()
+        employee_id = response.json()["id"]
+
+        sent = {}
+        latencies = []
+        connected = 0
+        all_connected = asyncio.Event()
+
+        async def subscriber():
+            nonlocal connected
+            async with client.stream("GET", "/events") as stream:
+                connected += 1
+                if connected == args.subscribers:
+                    all_connected.set()
+                received = 0
+                async for line in stream.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    delta = json.loads(line[6:])
+                    if delta.get("employeeId") == employee_id and delta["type"] in sent:
+                        latencies.append(time.perf_counter() - sent[delta["type"]])
+                        received += 1
+                        if received == 2 * args.events:
+                            return
+
+        tasks = [asyncio.create_task(subscriber()) for _ in range(args.subscribers)]
+        try:
+            await asyncio.wait_for(all_connected.wait(), timeout=60)
+            for _ in range(args.events):
+                for action in ("clock_in", "clock_out"):
+                    sent[action] = time.perf_counter()
+                    path = "clock-in" if action == "clock_in" else "clock-out"
+                    (await client.post(f"/{path}/{employee_id}")).raise_for_status()
+                    await asyncio.sleep(args.interval)
+            await asyncio.wait_for(asyncio.gather(*tasks), timeout=60)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await client.delete(f"/employees/{employee_id}")
+
+    print_summary(f"tap -> delivery ({args.subscribers} SSE clients)", latencies)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between published events")
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--base-url", help="benchmark a running API over HTTP instead")
+    args = parser.parse_args()
+    asyncio.run(over_http(args) if args.base_url else in_process(args))
+
+
+if __name__ == "__main__":
+    main()
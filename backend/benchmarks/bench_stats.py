@@ -0,0 +1,80 @@
+"""Bytes transferred and latency of the dashboard statistics queries.
+
+Compares the previous ``/api/stats`` reads (every rollup of the week fetched
+and summed in Python, then a second query for the top employee names) with
+the single ``$facet`` pipeline of ``rollups.read_week_stats``, and the Python
+rollup rebuild with the server-side ``$merge`` pipeline::
+
+    python benchmarks/bench_stats.py --employees 2000 --entries 200000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import bson
+
+from common import Timer, print_summary, scratch_db, seed
+
+from rollups import ROLLUP_COLLECTION, _rebuild_in_python, read_rollups, read_week_stats, rebuild_rollups
+
+
+def payload(documents) -> int:
+    return sum(len(bson.encode(document)) for document in documents)
+
+
+async def stats_in_python(db, week_start, week_end):
+    """What ``get_stats`` used to do; returns the documents it received."""
+    rollups = await read_rollups(db, week_start, week_end)
+    employee_hours = {}
+    for rollup in rollups:
+        hours = rollup["elapsedSeconds"] / 3600
+        employee_hours[rollup["employeeId"]] = employee_hours.get(rollup["employeeId"], 0) + hours
+    top_hours = sorted(employee_hours.items(), key=lambda x: x[1], reverse=True)[:5]
+    names = await db.employees.find(
+        {"id": {"$in": [emp_id for emp_id, _ in top_hours]}}, {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None)
+    return rollups + names
+
+
+async def stats_in_pipeline(db, week_start, week_end):
+    return [await read_week_stats(db, week_start, week_end)]
+
+
+async def run(args) -> None:
+    today = datetime.utcnow().date()
+    week_start = today - timedelta(days=today.weekday())
+    week_end = week_start + timedelta(days=6)
+
+    async with scratch_db() as db:
+        print(f"Seeding {args.employees} employees and {args.entries} entries over {args.days} days...")
+        await seed(db, args.employees, args.entries, days=args.days)
+
+        started = time.perf_counter()
+        await db[ROLLUP_COLLECTION].delete_many({})
+        written = await _rebuild_in_python(db, None, 1000)
+        print(f"rebuild in Python:   {written} rollups in {time.perf_counter() - started:.2f}s")
+        started = time.perf_counter()
+        written = await rebuild_rollups(db)
+        print(f"rebuild in pipeline: {written} rollups in {time.perf_counter() - started:.2f}s")
+
+        for label, read in (("find + Python", stats_in_python), ("$facet pipeline", stats_in_pipeline)):
+            timer = Timer()
+            size = payload(await read(db, week_start, week_end))
+            for _ in range(args.requests):
+                with timer:
+                    await read(db, week_start, week_end)
+            print_summary(f"{label} ({size / 1024:.1f} KiB)", timer.samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--employees", type=int, default=2000)
+    parser.add_argument("--entries", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--requests", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
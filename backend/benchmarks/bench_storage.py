@@ -0,0 +1,126 @@
+"""The same kiosk workload against the MongoDB and SQLite storage backends.
+
+Seeds ``--employees`` employees and ``--entries`` historical entries through
+each backend, then has ``--concurrency`` kiosks run full shifts (clock in,
+start and end a break, clock out) for random employees, each followed by
+the reads the admin screens make: the employee's latest entries and the
+first page of all entries. Mongo runs against a scratch database on
+``MONGO_URL``, SQLite against a file in a temporary directory::
+
+    python benchmarks/bench_storage.py --entries 100000 --shifts 2000
+    python benchmarks/bench_storage.py --backends sqlite
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Dict, List
+
+from common import Timer, make_employees, make_entries, print_summary, scratch_db
+
+from indexes import ensure_indexes
+from storage import MongoStorage, SQLiteStorage
+from timesheet import utc_now
+
+OPERATIONS = ["clock_in", "start_break", "end_break", "clock_out", "employee_entries", "entries_page"]
+
+
+@asynccontextmanager
+async def mongo_storage():
+    async with scratch_db() as db:
+        await ensure_indexes(db)
+        yield MongoStorage(db, legacy_strings=False)
+
+
+@asynccontextmanager
+async def sqlite_storage():
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SQLiteStorage(os.path.join(directory, "bench.sqlite3"))
+        await storage.start()
+        try:
+            yield storage
+        finally:
+            await storage.close()
+
+
+BACKENDS = {"mongo": mongo_storage, "sqlite": sqlite_storage}
+
+
+async def seed(storage, employees: int, entries: int) -> List[dict]:
+    roster = make_employees(employees)
+    for employee in roster:
+        await storage.insert_employee(employee)
+    for entry in make_entries(roster, entries, now=utc_now() - timedelta(days=1)):
+        await storage.insert_time_entry(entry)
+    return roster
+
+
+async def shift(storage, employee_id: str, timers: Dict[str, Timer]) -> None:
+    with timers["clock_in"]:
+        await storage.insert_time_entry({
+            "id": str(uuid.uuid4()),
+            "employeeId": employee_id,
+            "startTime": utc_now(),
+            "endTime": None,
+            "breaks": [],
+            "status": "active",
+            "notes": None,
+            "createdAt": utc_now(),
+        })
+    for operation in ("start_break", "end_break", "clock_out"):
+        with timers[operation]:
+            entry = await getattr(storage, operation)(employee_id, utc_now())
+        assert entry, operation
+    with timers["employee_entries"]:
+        await storage.find_time_entries(employee_id=employee_id, limit=100)
+    with timers["entries_page"]:
+        await storage.find_time_entries(limit=100)
+
+
+async def run(backend: str, args) -> None:
+    async with BACKENDS[backend]() as storage:
+        started = time.perf_counter()
+        roster = await seed(storage, args.employees, args.entries)
+        print(f"[{backend}] seeded {args.entries} entries in {time.perf_counter() - started:.1f}s")
+
+        timers = {operation: Timer() for operation in OPERATIONS}
+        # Each kiosk works through its own employees, so shifts never collide
+        employee_ids = [employee["id"] for employee in roster]
+        random.shuffle(employee_ids)
+        kiosks = [employee_ids[index::args.concurrency] for index in range(args.concurrency)]
+
+        async def kiosk(assigned: List[str]) -> None:
+            for _ in range(args.shifts // args.concurrency):
+                await shift(storage, random.choice(assigned), timers)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(kiosk(assigned) for assigned in kiosks))
+        elapsed = time.perf_counter() - started
+        shifts = args.shifts // args.concurrency * args.concurrency
+        print(f"[{backend}] {shifts} shifts in {elapsed:.1f}s ({shifts / elapsed:.0f} shifts/s)")
+        for operation in OPERATIONS:
+            print_summary(f"[{backend}] {operation}", timers[operation].samples)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=["mongo", "sqlite"])
+    parser.add_argument("--employees", type=int, default=200)
+    parser.add_argument("--entries", type=int, default=50_000)
+    parser.add_argument("--shifts", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    if args.concurrency > args.employees:
+        parser.error("--concurrency cannot exceed --employees")
+
+    for backend in args.backends:
+        await run(backend, args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+"""Helpers shared by the benchmark scripts in this directory.
+
+Benchmarks run against a scratch database (``BENCH_DB_NAME``, default
+``timetracker_bench``) on the server in ``MONGO_URL`` and drop it when done;
+they never touch ``DB_NAME``.
+"""
+import os
+import statistics
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv(BACKEND_DIR / '.env')
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds for samples given in seconds."""
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+def print_summary(label: str, samples: List[float]) -> None:
+    summary = summarize(samples)
+    print(f"{label:<40} n={summary['count']:<7} p50={summary['p50_ms']:>9.3f}ms "
+          f"p95={summary['p95_ms']:>9.3f}ms p99={summary['p99_ms']:>9.3f}ms")
+
+
+class Timer:
+    def __init__(self):
+        self.samples: List[float] = []
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self._start)
+
+
+@asynccontextmanager
+async def scratch_db():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    name = os.environ.get('BENCH_DB_NAME', 'timetracker_bench')
+    await client.drop_database(name)
+    try:
+        yield client[name]
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+def make_employees(count: int) -> List[dict]:
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Employee {i}",
+            "position": "Bench",
+            "email": None,
+            "startTime": "08:00",
+            "endTime": "17:00",
+            "breakDuration": 30,
+            "hourlyRate": 10.0 + i % 20,
+            "isActive": True,
+            "createdAt": datetime.utcnow(),
+        }
+        for i in range(count)
+    ]
+
+
+def make_entries(
+    employees: List[dict], count: int, days: int = 365, now: Optional[datetime] = None
+) -> Iterator[dict]:
+    """Completed historical entries spread over the ``days`` days before ``now``."""
+    now = now or datetime.utcnow().replace(microsecond=0)
+    for i in range(count):
+        start = now - timedelta(days=days * i / count, hours=9)
+        end = start + timedelta(hours=8)
+        yield {
+            "id": str(uuid.uuid4()),
+            "employeeId": employees[i % len(employees)]["id"],
+            "startTime": start,
+            "endTime": end,
+            "breaks": [{
+                "startTime": start + timedelta(hours=4),
+                "endTime": start + timedelta(hours=4, minutes=30),
+            }],
+            "status": "completed",
+            "notes": None,
+            "createdAt": start,
+        }
+
+
+async def seed(db, employees: int, entries: int, batch_size: int = 10000, days: int = 365) -> List[dict]:
+    """Insert ``employees`` employees and ``entries`` historical entries over ``days`` days."""
+    roster = make_employees(employees)
+    await db.employees.insert_many([dict(employee) for employee in roster])
+    batch = []
+    for entry in make_entries(roster, entries, days):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            await db.time_entries.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.time_entries.insert_many(batch, ordered=False)
+    return roster
@@ -0,0 +1,72 @@
+"""Clock-in latency while admin logins hammer bcrypt, against a running API.
+
+Creates ``--employees`` throwaway employees, then for ``--duration`` seconds
+runs ``--admins`` concurrent admin-login loops next to ``--kiosks``
+concurrent clock-in/clock-out loops and reports clock-in p50/p95/p99.
+Run it once with ``--admins 0`` for the baseline::
+
+    python benchmarks/load_admin_auth.py --base-url http://localhost:8001/api --admins 20
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from common import print_summary
+
+
+async def admin_loop(client: httpx.AsyncClient, password: str, deadline: float, timings: list) -> None:
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        await client.post("/auth/admin", json={"password": password})
+        timings.append(time.perf_counter() - started)
+
+
+async def kiosk_loop(client: httpx.AsyncClient, employee_id: str, deadline: float, timings: list) -> None:
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        response = await client.post(f"/clock-in/{employee_id}")
+        timings.append(time.perf_counter() - started)
+        response.raise_for_status()
+        (await client.post(f"/clock-out/{employee_id}")).raise_for_status()
+
+
+async def run(args) -> None:
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+        employee_ids = []
+        for i in range(args.kiosks):
+            response = await client.post("/employees", json={"name": f"Load test {i}", "position": "Bench"})
+            response.raise_for_status()
+            employee_ids.append(response.json()["id"])
+
+        clock_in_timings, auth_timings = [], []
+        deadline = time.monotonic() + args.duration
+        try:
+            await asyncio.gather(
+                *(admin_loop(client, args.password, deadline, auth_timings) for _ in range(args.admins)),
+                *(kiosk_loop(client, employee_id, deadline, clock_in_timings) for employee_id in employee_ids),
+            )
+        finally:
+            for employee_id in employee_ids:
+                await client.post(f"/clock-out/{employee_id}")
+                await client.delete(f"/employees/{employee_id}")
+
+    print_summary(f"clock-in ({args.admins} admin loops)", clock_in_timings)
+    if auth_timings:
+        print_summary("admin auth", auth_timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8001/api")
+    parser.add_argument("--admins", type=int, default=20)
+    parser.add_argument("--kiosks", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--password", default="admin123",
+                        help="use a wrong password to measure uncached bcrypt work")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Concurrent load on the API, served in-process, with results per route.
+
+Runs ``server.app`` through ``httpx.ASGITransport`` (no network, no
+uvicorn) against a scratch store, seeds ``--employees`` employees and
+``--entries`` historical entries, then for ``--duration`` seconds runs
+side by side:
+
+- shift changes: every ``--shift-interval`` seconds ``--burst`` employees
+  clock in at once, half of them take a break, then all clock out
+- kiosks polling the roster (with ``If-None-Match``) and the presence board
+- admins loading the dashboard and ranged statistics
+- payroll exports and timesheet reports over the last month
+
+and reports throughput, errors and p50/p95/p99 per route. ``--output``
+stores the results as JSON; ``--compare`` checks them against a previous
+file and exits with status 1 if a route's p95 regressed beyond
+``--tolerance``::
+
+    python benchmarks/load_api.py --storage mongo --output before.json
+    python benchmarks/load_api.py --storage mongo --compare before.json
+
+``--storage mongo`` uses ``BENCH_DB_NAME`` on ``MONGO_URL``; ``mongomock``
+needs the mongomock-motor package and no server (it lacks some aggregation
+stages, so ``/api/stats`` fails there); ``sqlite`` uses a temporary file
+(statistics are Mongo-only, see storage.py).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+from common import make_employees, make_entries, summarize
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, **kwargs):
+        # ``route`` is the template the results are grouped by
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - started
+        label = f"{method} {route}"
+        self.samples[label].append(elapsed)
+        if response.status_code >= 400 and response.status_code != 304:
+            self.errors[label] += 1
+        return response
+
+    def results(self, duration: float) -> Dict[str, Dict[str, Any]]:
+        return {
+            label: {
+                **summarize(samples),
+                "errors": self.errors.get(label, 0),
+                "rps": round(len(samples) / duration, 1),
+            }
+            for label, samples in sorted(self.samples.items())
+        }
+
+
+async def shift_changes(client, recorder: Recorder, employee_ids: List[str], args, deadline: float) -> None:
+    async def tap(route: str, employee_id: str):
+        return await recorder.request(client, f"/api/{route}/{{employee_id}}", "POST", f"/{route}/{employee_id}")
+
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        await asyncio.gather(*(tap("clock-in", employee_id) for employee_id in employee_ids))
+        on_break = employee_ids[::2]
+        await asyncio.gather(*(tap("start-break", employee_id) for employee_id in on_break))
+        await asyncio.gather(*(tap("end-break", employee_id) for employee_id in on_break))
+        await asyncio.gather(*(tap("clock-out", employee_id) for employee_id in employee_ids))
+        await asyncio.sleep(max(0.0, args.shift_interval - (time.monotonic() - started)))
+
+
+async def kiosk(client, recorder: Recorder, args, deadline: float) -> None:
+    etag = None
+    while time.monotonic() < deadline:
+        headers = {"If-None-Match": etag} if etag else {}
+        response = await recorder.request(client, "/api/employees", "GET", "/employees", headers=headers)
+        etag = response.headers.get("etag", etag)
+        await recorder.request(client, "/api/presence", "GET", "/presence")
+        await asyncio.sleep(args.poll_interval)
+
+
+async def admin(client, recorder: Recorder, args, deadline: float) -> None:
+    today = datetime.utcnow().date()
+    while time.monotonic() < deadline:
+        await recorder.request(client, "/api/stats", "GET", "/stats")
+        await recorder.request(
+            client, "/api/stats?from&groupBy", "GET", "/stats",
+            params={"from": (today - timedelta(days=90)).isoformat(), "groupBy": "week"}
+        )
+        await asyncio.sleep(args.admin_interval)
+
+
+async def payroll(client, recorder: Recorder, args, deadline: float) -> None:
+    month = {"start_date": (datetime.utcnow() - timedelta(days=30)).date().isoformat()}
+    while time.monotonic() < deadline:
+        await recorder.request(client, "/api/exports/time-entries", "GET", "/exports/time-entries", params=month)
+        await recorder.request(client, "/api/reports/timesheet", "GET", "/reports/timesheet", params=month)
+        await asyncio.sleep(args.export_interval)
+
+
+async def no_change_stream(db) -> None:
+    pass
+
+
+def configure(args) -> Tuple[Any, str]:
+    """Point server.py at a scratch store, then import it."""
+    name = os.environ.get('BENCH_DB_NAME', 'timetracker_bench')
+    path = None
+    if args.storage == "sqlite":
+        path = os.path.join(tempfile.mkdtemp(), "load.sqlite3")
+        os.environ['STORAGE_BACKEND'] = 'sqlite'
+        os.environ['SQLITE_PATH'] = path
+    else:
+        os.environ['STORAGE_BACKEND'] = 'mongo'
+        os.environ['DB_NAME'] = name
+        if args.storage == "mongomock":
+            import mongomock_motor
+            import motor.motor_asyncio
+
+            motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+            os.environ.setdefault('MONGO_URL', 'mongodb://mongomock')
+    import server
+
+    # server.py logs at INFO, which would log every request
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return server, path or name
+
+
+async def seed(server, args) -> List[dict]:
+    from rollups import rebuild_rollups
+
+    roster = make_employees(args.employees)
+    for employee in roster:
+        await server.storage.insert_employee(employee)
+    entries = make_entries(roster, args.entries, days=args.days, now=datetime.utcnow() - timedelta(days=1))
+    if server.db is None:
+        for entry in entries:
+            await server.storage.insert_time_entry(entry)
+        return roster
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= 10000:
+            await server.db.time_entries.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await server.db.time_entries.insert_many(batch, ordered=False)
+    await rebuild_rollups(server.db)
+    return roster
+
+
+async def run(args) -> Dict[str, Any]:
+    server, target = configure(args)
+    if server.db is not None:
+        await server.client.drop_database(target)
+    if args.storage == "mongomock":
+        # No change streams there: publish in-process, as on a standalone server
+        server.broker.start = no_change_stream
+    # Seeded before the indexes exist, as a bulk import would be; mongomock
+    # would apply one_open_entry_per_employee to completed entries too
+    await server.storage.start()
+    started = time.perf_counter()
+    roster = await seed(server, args)
+    print(f"seeded {args.employees} employees and {args.entries} entries "
+          f"in {time.perf_counter() - started:.1f}s ({args.storage})")
+    await server.startup_event()
+    try:
+
+        recorder = Recorder()
+        # Server errors are counted per route rather than raised
+        transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load/api", timeout=60) as client:
+            bursting = [employee["id"] for employee in random.sample(roster, min(args.burst, len(roster)))]
+            deadline = time.monotonic() + args.duration
+            started = time.perf_counter()
+            await asyncio.gather(
+                shift_changes(client, recorder, bursting, args, deadline),
+                *(kiosk(client, recorder, args, deadline) for _ in range(args.kiosks)),
+                *(admin(client, recorder, args, deadline) for _ in range(args.admins)),
+                *(payroll(client, recorder, args, deadline) for _ in range(args.exporters)),
+            )
+            elapsed = time.perf_counter() - started
+    finally:
+        await server.shutdown_event()
+        if server.db is not None and args.storage == "mongo":
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            cleanup = AsyncIOMotorClient(os.environ['MONGO_URL'])
+            await cleanup.drop_database(target)
+            cleanup.close()
+
+    return {
+        "startedAt": datetime.utcnow().isoformat(),
+        "storage": args.storage,
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "durationSeconds": round(elapsed, 2),
+        "routes": recorder.results(elapsed),
+    }
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    for label, route in results["routes"].items():
+        print(f"{label:<44} n={route['count']:<7} {route['rps']:>8.1f}/s err={route['errors']:<5} "
+              f"p50={route['p50_ms']:>9.3f}ms p95={route['p95_ms']:>9.3f}ms p99={route['p99_ms']:>9.3f}ms")
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Routes whose p95 grew by more than ``tolerance`` (a fraction) over the baseline."""
+    if baseline.get("config") != results["config"]:
+        print("note: the baseline ran with different options")
+    regressions = []
+    for label, route in results["routes"].items():
+        before = baseline["routes"].get(label)
+        if not before or not before["p95_ms"]:
+            continue
+        change = route["p95_ms"] / before["p95_ms"] - 1
+        flag = " REGRESSION" if change > tolerance else ""
+        print(f"{label:<44} p95 {before['p95_ms']:>9.3f}ms -> {route['p95_ms']:>9.3f}ms ({change:+.0%}){flag}")
+        if flag:
+            regressions.append(label)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--storage", choices=["mongo", "mongomock", "sqlite"], default="mongo")
+    parser.add_argument("--employees", type=int, default=200)
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=365, help="history the entries are spread over")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--burst", type=int, default=100, help="employees clocking in at each shift change")
+    parser.add_argument("--shift-interval", type=float, default=5.0)
+    parser.add_argument("--kiosks", type=int, default=20)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--admins", type=int, default=2)
+    parser.add_argument("--admin-interval", type=float, default=2.0)
+    parser.add_argument("--exporters", type=int, default=1)
+    parser.add_argument("--export-interval", type=float, default=5.0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 growth, as a fraction")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
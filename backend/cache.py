@@ -0,0 +1,85 @@
+"""Small in-process TTL cache for read-mostly documents.
+
+Each worker keeps its own copy, so entries are also bounded by ``ttl``: a
+write handled by another worker becomes visible here once the entry expires.
+Writes handled by this worker call ``invalidate`` and are visible at once.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    def __init__(self, ttl: float, maxsize: int = 128):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._invalidations = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drop one key, or everything when called without a key."""
+        self._invalidations += 1
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value or load it, sharing one load between concurrent misses."""
+        marker = object()
+        value = self.get(key, marker)
+        if value is not marker:
+            return value
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        invalidations = self._invalidations
+        try:
+            value = await loader()
+        except Exception as exc:
+            future.set_exception(exc)
+            # Mark the exception retrieved when nobody else was waiting
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            # A load racing with an invalidation may have read the old value
+            if invalidations == self._invalidations:
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._loading[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "size": len(self._entries),
+            "ttl": self.ttl,
+        }
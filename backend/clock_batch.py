@@ -0,0 +1,221 @@
+"""Planning of batched clock events (shift changes, offline replay).
+
+``plan_clock_events`` replays a list of ``{employeeId, action, timestamp}``
+events against the open entries loaded up front and produces a result per
+event and the before/after image of every touched entry. The batch is
+written with one operation per entry: for existing entries an update
+filtered on the state they were loaded in, so an entry changed by a
+concurrent tap makes its operation match nothing without holding up the
+other entries, then an insert for the entries it creates. Each kind goes in
+its own unordered ``bulk_write``, updates first: an unordered bulk runs its
+inserts ahead of its updates, which would open an employee's new entry
+before the old one is closed (``one_open_entry_per_employee``).
+"""
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from rollups import ROLLUP_COLLECTION, rollup_updates
+from timesheet import parse_timestamp, to_storage, utc_now
+
+logger = logging.getLogger(__name__)
+
+CLOCK_ACTIONS = ("clock_in", "clock_out", "start_break", "end_break")
+# Result code of an event a concurrent write got in the way of, rather than
+# one invalid in itself: sending it again may apply it
+CONFLICT = "conflict"
+# The fields a clock event changes on an existing entry
+ENTRY_STATE = ("status", "endTime", "breaks")
+
+
+@dataclass
+class ClockPlan:
+    results: List[Dict[str, Any]] = field(default_factory=list)
+    # entry id -> image before the batch (None for entries inserted by it)
+    before: Dict[str, Optional[Dict[str, Any]]] = field(default_factory=dict)
+    # entry id -> planned image after the batch
+    after: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    @property
+    def updates(self) -> List[UpdateOne]:
+        """One write per existing entry the batch changes."""
+        return [
+            UpdateOne(
+                {"id": entry_id, "status": before["status"], "breaks": before.get("breaks")},
+                {"$set": {name: self.after[entry_id].get(name) for name in ENTRY_STATE}},
+            )
+            for entry_id, before in self.before.items() if before is not None
+        ]
+
+    @property
+    def inserts(self) -> List[InsertOne]:
+        """One write per entry the batch creates."""
+        return [
+            InsertOne(dict(self.after[entry_id]))
+            for entry_id, before in self.before.items() if before is None
+        ]
+
+    @property
+    def operations(self) -> List[Any]:
+        """Every write of the batch, in the order they must be applied."""
+        return [*self.updates, *self.inserts]
+
+    @property
+    def update_count(self) -> int:
+        return sum(before is not None for before in self.before.values())
+
+    def changes(self) -> List[Tuple[Optional[Dict[str, Any]], Dict[str, Any]]]:
+        return [(self.before[entry_id], after) for entry_id, after in self.after.items()]
+
+
+def plan_clock_events(
+    events: Iterable[Dict[str, Any]],
+    active_employees: Set[str],
+    open_entries: Dict[str, Dict[str, Any]],
+    new_entry: Callable[[str, datetime], Dict[str, Any]],
+    now: Optional[datetime] = None,
+) -> ClockPlan:
+    """Plan ``events`` in order.
+
+    ``open_entries`` maps employee ids to their open entry, ``new_entry``
+    builds the document of a new entry from an employee id and start time.
+    """
+    now = now or utc_now()
+    plan = ClockPlan()
+    state = {employee_id: dict(entry) for employee_id, entry in open_entries.items()}
+
+    for index, event in enumerate(events):
+        employee_id = event["employeeId"]
+        action = event["action"]
+        result = {"index": index, "employeeId": employee_id, "action": action}
+        plan.results.append(result)
+
+        error = None
+        try:
+            at = parse_timestamp(event.get("timestamp")) or now
+        except ValueError:
+            at = None
+            error = "Invalid timestamp"
+        entry = state.get(employee_id)
+
+        if error:
+            pass
+        elif action not in CLOCK_ACTIONS:
+            error = "Unknown action"
+        elif employee_id not in active_employees:
+            error = "Employee not found"
+        elif action == "clock_in":
+            if entry:
+                error = "Employee already clocked in"
+        elif not entry:
+            error = "No active time entry found for employee"
+        elif action == "start_break" and entry["status"] != "active":
+            error = "No active time entry found for employee"
+        elif action == "end_break" and entry["status"] != "on_break":
+            error = "No active break found for employee"
+        elif at < _last_change(entry):
+            error = "Timestamp is before the last change of the time entry"
+
+        if error:
+            result.update({"ok": False, "error": error})
+            continue
+
+        timestamp = to_storage(at)
+        if action != "clock_in" and entry["id"] not in plan.before:
+            plan.before[entry["id"]] = open_entries[employee_id]
+        if action == "clock_in":
+            entry = new_entry(employee_id, timestamp)
+            plan.before[entry["id"]] = None
+            state[employee_id] = entry
+        elif action == "clock_out":
+            entry = {**entry, "endTime": timestamp, "status": "completed"}
+            del state[employee_id]
+        elif action == "start_break":
+            new_break = {"startTime": timestamp, "endTime": None}
+            entry = {**entry, "breaks": [*entry.get("breaks", []), new_break], "status": "on_break"}
+            state[employee_id] = entry
+        else:  # end_break
+            entry = {
+                **entry,
+                "breaks": [
+                    {**item, "endTime": timestamp} if item.get("endTime") is None else item
+                    for item in entry.get("breaks", [])
+                ],
+                "status": "active",
+            }
+            state[employee_id] = entry
+
+        plan.after[entry["id"]] = entry
+        result.update({"ok": True, "entryId": entry["id"], "status": entry["status"]})
+
+    return plan
+
+
+def _last_change(entry: Dict[str, Any]) -> datetime:
+    """When the entry was clocked in or last started or ended a break."""
+    times = [entry["startTime"]]
+    for item in entry.get("breaks") or []:
+        times.extend([item.get("startTime"), item.get("endTime")])
+    return max(parse_timestamp(value) for value in times if value)
+
+
+def _same_state(left: Dict[str, Any], right: Dict[str, Any]) -> bool:
+    return all(left.get(name) == right.get(name) for name in ENTRY_STATE)
+
+
+async def apply_clock_plan(db, plan: ClockPlan) -> List[Tuple[Optional[Dict[str, Any]], Dict[str, Any]]]:
+    """Execute a plan (updates, then inserts) and fold it into the rollups.
+
+    Returns the ``(before, after)`` images of the entries the batch changed.
+    When a concurrent write got in the way (a duplicate open entry, or an
+    entry no longer in the state it was loaded in) the touched entries are
+    re-read: the writes to the other entries still apply, while entries that
+    did not end up in the planned state are reported as conflicts and left
+    out of the rollups, since part of their change came from the other
+    writer (``python rollups.py --since`` repairs them).
+    """
+    if not plan.after:
+        return []
+
+    matched = 0
+    consistent = True
+    # Closing updates before the inserts that open the employees' next entries
+    for operations in (plan.updates, plan.inserts):
+        if not operations:
+            continue
+        try:
+            result = await db.time_entries.bulk_write(operations, ordered=False)
+            matched += result.matched_count
+        except BulkWriteError:
+            consistent = False
+    consistent = consistent and matched == plan.update_count
+
+    changes = plan.changes()
+    if not consistent:
+        current = {
+            entry["id"]: entry
+            for entry in await db.time_entries.find({"id": {"$in": list(plan.after)}}).to_list(None)
+        }
+        applied = []
+        for before, after in changes:
+            actual = current.get(after["id"])
+            if actual is not None and _same_state(actual, after):
+                applied.append((before, actual))
+                continue
+            if actual is not None and (before is None or not _same_state(actual, before)):
+                logger.warning("Clock batch conflicted on time entry %s; rollups may need a rebuild", after["id"])
+            for result_entry in plan.results:
+                if result_entry.get("entryId") == after["id"]:
+                    result_entry.update({"ok": False, "error": "Conflicting concurrent update", "code": CONFLICT})
+                    if actual is not None:
+                        result_entry["status"] = actual["status"]
+        changes = applied
+
+    operations = [operation for before, after in changes for operation in rollup_updates(before, after)]
+    if operations:
+        await db[ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+    return changes
@@ -0,0 +1,149 @@
+"""MongoDB client instrumentation: command latencies and pool usage.
+
+``CommandLatencyMonitor`` is a pymongo command listener keeping a latency
+histogram per (collection, command), in the ``metrics`` format so that
+``/metrics`` exports it too. ``PoolMonitor`` follows the connection
+pool events to report, per server, how many connections are open and how
+many are checked out. Both are fed from Motor's worker threads, hence the
+locks. Pass them to the client with ``event_listeners``.
+"""
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import monitoring
+
+from metrics import Counter, Histogram
+
+# Upper bounds of the latency buckets, in milliseconds
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Commands whose value is not the collection name
+COLLECTION_ARGUMENT = {"getMore": "collection"}
+
+
+class CommandLatencyMonitor(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[Any, int], Tuple[str, str]] = {}
+        # Registered with the /metrics registry by the server
+        self.durations = Histogram(
+            "mongodb_command_duration_seconds", "MongoDB command round trips.",
+            ("collection", "command"), buckets=[bound / 1000 for bound in LATENCY_BUCKETS_MS]
+        )
+        self.failures = Counter(
+            "mongodb_command_failures_total", "MongoDB commands that failed.", ("collection", "command")
+        )
+
+    def started(self, event) -> None:
+        argument = COLLECTION_ARGUMENT.get(event.command_name, event.command_name)
+        collection = event.command.get(argument)
+        if not isinstance(collection, str):
+            collection = "-"  # database commands (ping, aggregate: 1, ...)
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def _finished(self, event, failed: bool) -> None:
+        with self._lock:
+            key = self._pending.pop((event.connection_id, event.request_id), None)
+            if key is None:
+                return
+            self.durations.labels(*key).observe(event.duration_micros / 1e6)
+            if failed:
+                self.failures.labels(*key).inc()
+
+    def succeeded(self, event) -> None:
+        self._finished(event, failed=False)
+
+    def failed(self, event) -> None:
+        self._finished(event, failed=True)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """``{collection: {command: histogram}}``, in milliseconds."""
+        result: Dict[str, Dict[str, Any]] = defaultdict(dict)
+        for (collection, command), histogram in self.durations.children():
+            failures = self.failures.labels(collection, command).value
+            result[collection][command] = {
+                "count": histogram.count,
+                "failures": int(failures),
+                "meanMs": round(histogram.sum / histogram.count * 1000, 3) if histogram.count else 0.0,
+                "p50Ms": round(histogram.quantile(0.5) * 1000, 3),
+                "p95Ms": round(histogram.quantile(0.95) * 1000, 3),
+                "p99Ms": round(histogram.quantile(0.99) * 1000, 3),
+                "buckets": dict(zip([*map(str, LATENCY_BUCKETS_MS), "+Inf"], histogram.counts)),
+            }
+        return dict(result)
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    def __init__(self, max_pool_size: Optional[int] = None):
+        self.max_pool_size = max_pool_size
+        self._lock = threading.Lock()
+        self._open: Dict[str, int] = defaultdict(int)
+        self._checked_out: Dict[str, int] = defaultdict(int)
+        self._wait_failures: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def _server(event) -> str:
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def _add(self, counter: Dict[str, int], event, value: int) -> None:
+        with self._lock:
+            counter[self._server(event)] += value
+
+    def connection_created(self, event) -> None:
+        self._add(self._open, event, 1)
+
+    def connection_closed(self, event) -> None:
+        self._add(self._open, event, -1)
+
+    def connection_checked_out(self, event) -> None:
+        self._add(self._checked_out, event, 1)
+
+    def connection_checked_in(self, event) -> None:
+        self._add(self._checked_out, event, -1)
+
+    def connection_check_out_failed(self, event) -> None:
+        self._add(self._wait_failures, event, 1)
+
+    def pool_closed(self, event) -> None:
+        with self._lock:
+            server = self._server(event)
+            self._open.pop(server, None)
+            self._checked_out.pop(server, None)
+
+    # Events the pool statistics don't need
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        # Connections checked out when the pool is cleared are still checked
+        # in (and closed) afterwards, so the counts stay as they are
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            servers = set(self._open) | set(self._checked_out)
+            return {
+                server: {
+                    "open": self._open.get(server, 0),
+                    "inUse": self._checked_out.get(server, 0),
+                    "maxSize": self.max_pool_size,
+                    "utilisation": (
+                        round(self._checked_out.get(server, 0) / self.max_pool_size, 3)
+                        if self.max_pool_size else None
+                    ),
+                    "checkoutFailures": self._wait_failures.get(server, 0),
+                }
+                for server in sorted(servers)
+            }
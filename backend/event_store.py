@@ -0,0 +1,476 @@
+"""Append-only ``clock_events`` log behind the ``time_entries`` documents.
+
+Every change to a time entry is also recorded as an event carrying only
+the fields that changed::
+
+    {"employeeId": ..., "entryId": ..., "sequence": 42, "type": "break_started",
+     "at": <when it happened>, "recordedAt": <when it was logged>,
+     "changes": {"status": "on_break", "breaks": [...]}}
+
+with ``type`` one of ``EVENT_TYPES``. ``entry_created`` carries the whole
+entry and ``entry_deleted`` no changes. ``time_entries`` stays the document
+the API reads and the one the transitions are checked against (the
+partial unique index, the status filters), so events are appended from
+``record_entry_change`` and the batch path once the write went through
+and was folded into the rollups. The append is tried ``APPEND_ATTEMPTS``
+times; a change it could not log is undone (``undo_changes``) and the
+request fails, so the changes that stand are the ones in the log. Only an
+undo that fails too, or finds the entry changed again meanwhile, leaves an
+entry ahead of its events; that is logged, and a rebuild leaves such
+entries alone (see below). ``sequence`` numbers an employee's events in the order
+they were logged, from a per-employee counter in ``clock_event_sequences``
+rather than the clocks of the API servers. Folding an employee's events
+in ``sequence`` order gives back their entries, and corrections keep
+their history. A clock batch logs one event per entry it touched, with
+the combined change of its taps on that entry.
+
+Per-employee snapshots in ``clock_snapshots`` hold the folded entries up
+to a position in the log, so rebuilding an employee reads the snapshot
+and the events after it. ``take_snapshots`` refreshes the employees with
+at least ``min_events`` events since their snapshot, leaving out events
+younger than ``SNAPSHOT_LAG`` that a slower worker might still be
+appending before them.
+
+``python event_store.py backfill``, run once when the log is turned on,
+logs an ``entry_created`` event for the entries that predate it;
+``snapshot`` takes snapshots and ``rebuild`` rewrites ``time_entries``
+from the log, ``--concurrency`` employees at a time. A rebuild only moves
+an entry forward along its logged history: it replaces an entry whose
+document is an earlier state of it, deletes one with an ``entry_deleted``
+event and recreates missing ones. An entry in a state the log never saw
+(a change whose event was lost, or a write racing the rebuild) is left
+alone and logged, and so is a completed entry the log has open. Entries
+with no events at all are left alone too. Run ``rollups.py`` afterwards.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, DeleteOne, InsertOne, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from timesheet import OPEN_STATUSES, to_storage, utc_now
+
+logger = logging.getLogger(__name__)
+
+EVENTS_COLLECTION = "clock_events"
+SNAPSHOTS_COLLECTION = "clock_snapshots"
+SEQUENCES_COLLECTION = "clock_event_sequences"
+EVENT_TYPES = (
+    "entry_created", "clocked_out", "break_started", "break_ended", "entry_corrected", "entry_deleted"
+)
+# Events this recent may still be overtaken by a slower writer
+SNAPSHOT_LAG = timedelta(seconds=60)
+EVENT_ORDER = [("sequence", ASCENDING)]
+# Tries at logging a change before it is undone, and the wait after the
+# first failed one (doubled each time)
+APPEND_ATTEMPTS = 3
+APPEND_RETRY_DELAY = 0.1  # seconds
+
+DUPLICATE_KEY = 11000
+
+Change = Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+
+def _fields(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: value for name, value in entry.items() if name != "_id"}
+
+
+def entry_event(
+    before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]], now: Optional[datetime] = None
+) -> Optional[Dict[str, Any]]:
+    """The event for a time entry going from ``before`` to ``after``, or None if nothing changed."""
+    now = now or utc_now()
+    if before is None and after is None:
+        return None
+    entry = after or before
+    event = {"employeeId": entry["employeeId"], "entryId": entry["id"], "recordedAt": now}
+    if before is None:
+        return {**event, "type": "entry_created", "at": after.get("startTime"), "changes": _fields(after)}
+    if after is None:
+        return {**event, "type": "entry_deleted", "at": now, "changes": None}
+
+    changes = {name: value for name, value in _fields(after).items() if before.get(name) != value}
+    if not changes:
+        return None
+    kind, at = _tap(before, after, changes) or ("entry_corrected", now)
+    return {**event, "type": kind, "at": at, "changes": changes}
+
+
+def _tap(
+    before: Dict[str, Any], after: Dict[str, Any], changes: Dict[str, Any]
+) -> Optional[Tuple[str, Any]]:
+    """The clock tap an update amounts to, as ``(type, time)``, if it is one."""
+    previous, status = before.get("status"), after.get("status")
+    previous_breaks, breaks = before.get("breaks") or [], after.get("breaks") or []
+    if set(changes) <= {"status", "endTime"}:
+        if previous in OPEN_STATUSES and status == "completed" and not before.get("endTime") and after.get("endTime"):
+            return "clocked_out", after["endTime"]
+        return None
+    if set(changes) != {"status", "breaks"}:
+        return None
+    if (previous, status) == ("active", "on_break") and breaks and breaks[:-1] == previous_breaks:
+        return "break_started", breaks[-1]["startTime"]
+    if (previous, status) == ("on_break", "active") and len(breaks) == len(previous_breaks):
+        closed = [(old, new) for old, new in zip(previous_breaks, breaks) if old != new]
+        if closed and all(
+            old.get("endTime") is None and new.get("endTime") and new == {**old, "endTime": new["endTime"]}
+            for old, new in closed
+        ):
+            return "break_ended", max(new["endTime"] for _, new in closed)
+    return None
+
+
+async def _number(db, events: List[Dict[str, Any]], field: str = "sequence", step: int = 1) -> None:
+    """Give ``events`` the next numbers of their employee's counter, in order.
+
+    ``step=-1`` counts down from zero instead, for events that must sort
+    before everything logged so far (see ``backfill_events``).
+    """
+    by_employee: Dict[str, List[Dict[str, Any]]] = {}
+    for event in events:
+        by_employee.setdefault(event["employeeId"], []).append(event)
+
+    async def number(employee_id: str, employee_events: List[Dict[str, Any]]) -> None:
+        counter = await db[SEQUENCES_COLLECTION].find_one_and_update(
+            {"_id": employee_id}, {"$inc": {field: step * len(employee_events)}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        last = counter[field]
+        if step < 0:
+            last += len(employee_events) - 1
+        for offset, event in enumerate(reversed(employee_events)):
+            event["sequence"] = last - offset
+
+    await asyncio.gather(*(number(*item) for item in by_employee.items()))
+
+
+async def append_events(db, changes: Iterable[Change], attempts: int = APPEND_ATTEMPTS) -> int:
+    """Log the events for a list of ``(before, after)`` images; returns how many.
+
+    A failed try is repeated with the same ``_id`` and sequence for each
+    event, so the events an earlier try did insert are not logged twice.
+    """
+    now = utc_now()
+    events = [
+        {"_id": ObjectId(), **event} for before, after in changes if (event := entry_event(before, after, now))
+    ]
+    numbered = False
+    delay = APPEND_RETRY_DELAY
+    for attempt in range(1, attempts + 1):
+        if not events:
+            break
+        try:
+            if not numbered:
+                await _number(db, events)
+                numbered = True
+            await db[EVENTS_COLLECTION].insert_many(events, ordered=False)
+            break
+        except BulkWriteError as exc:
+            errors = exc.details.get("writeErrors", [])
+            if not exc.details.get("writeConcernErrors") and all(error["code"] == DUPLICATE_KEY for error in errors):
+                break  # the rest were inserted by an earlier try
+            if attempt == attempts:
+                raise
+        except PyMongoError:
+            if attempt == attempts:
+                raise
+        logger.warning("Logging %d clock events failed (try %d of %d)", len(events), attempt, attempts)
+        await asyncio.sleep(delay)
+        delay *= 2
+    return len(events)
+
+
+async def undo_changes(db, changes: Iterable[Change]) -> List[Change]:
+    """Put time entries back to their ``before`` image, for changes the log could not record.
+
+    Returns the changes undone. They are undone last first, so that an
+    entry a batch closed is reopened once the one it opened is gone. An
+    entry changed again since is left as it is, and so is one whose undo
+    would reopen it next to another open entry.
+    """
+    undone = []
+    for before, after in reversed(list(changes)):
+        try:
+            if after is None:
+                await db.time_entries.insert_one(_fields(before))
+                done = True
+            elif before is None:
+                done = (await db.time_entries.delete_one(_as_of(after))).deleted_count
+            else:
+                done = (await db.time_entries.replace_one(_as_of(after), _fields(before))).matched_count
+        except DuplicateKeyError:
+            done = False
+        if done:
+            undone.append((before, after))
+        else:
+            logger.warning("Time entry %s has a change missing from the log", (after or before)["id"])
+    return undone
+
+
+def fold(entries: Dict[str, Optional[Dict[str, Any]]], event: Dict[str, Any]) -> None:
+    """Apply one event to ``entries`` (entry id -> entry, None once deleted)."""
+    entry_id = event["entryId"]
+    if event["type"] == "entry_created":
+        entries[entry_id] = dict(event["changes"])
+    elif event["type"] == "entry_deleted":
+        entries[entry_id] = None
+    elif entries.get(entry_id) is not None:
+        entries[entry_id].update(event["changes"])
+    else:
+        # Changed before the log existed (see backfill_events)
+        logger.debug("Event %s for unknown time entry %s skipped", event["type"], entry_id)
+
+
+def _after(position: Optional[int]) -> Dict[str, Any]:
+    return {} if position is None else {"sequence": {"$gt": position}}
+
+
+async def employee_state(
+    db,
+    employee_id: str,
+    until: Optional[datetime] = None,
+    history: Optional[Dict[str, List[Optional[Dict[str, Any]]]]] = None,
+) -> Tuple[Dict[str, Optional[Dict[str, Any]]], Optional[int], int]:
+    """Fold an employee's snapshot and the events after it.
+
+    Returns the entries, the sequence of the last event folded and the
+    number of events read past the snapshot. ``history``, if given, is
+    filled with the states each entry went through, the snapshot's first.
+    """
+    snapshot = await db[SNAPSHOTS_COLLECTION].find_one({"_id": employee_id})
+    entries = {entry_id: entry for entry_id, entry in (snapshot or {}).get("entries", {}).items()}
+    position = (snapshot or {}).get("position")
+    query: Dict[str, Any] = {"employeeId": employee_id, **_after(position)}
+    if until is not None:
+        query = {"$and": [query, {"recordedAt": {"$lte": until}}]}
+    if history is not None:
+        for entry_id, entry in entries.items():
+            history[entry_id] = [entry and dict(entry)]
+    folded = 0
+    async for event in db[EVENTS_COLLECTION].find(query).sort(EVENT_ORDER):
+        fold(entries, event)
+        if history is not None:
+            entry = entries.get(event["entryId"])
+            history.setdefault(event["entryId"], []).append(entry and dict(entry))
+        position = event["sequence"]
+        folded += 1
+    return entries, position, folded
+
+
+async def snapshot_employee(db, employee_id: str, now: Optional[datetime] = None) -> int:
+    """Store the employee's state up to ``SNAPSHOT_LAG`` ago; returns the events it covers anew."""
+    until = (now or utc_now()) - SNAPSHOT_LAG
+    entries, position, folded = await employee_state(db, employee_id, until=until)
+    if folded:
+        await db[SNAPSHOTS_COLLECTION].replace_one(
+            {"_id": employee_id},
+            {"entries": entries, "position": position, "takenAt": utc_now()},
+            upsert=True,
+        )
+    return folded
+
+
+async def take_snapshots(db, min_events: int = 100, concurrency: int = 8) -> int:
+    """Snapshot the employees with at least ``min_events`` events since their last snapshot."""
+    positions = {
+        snapshot["_id"]: snapshot.get("position")
+        async for snapshot in db[SNAPSHOTS_COLLECTION].find({}, {"position": 1})
+    }
+    employee_ids = await db[EVENTS_COLLECTION].distinct("employeeId")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def maybe_snapshot(employee_id: str) -> bool:
+        async with semaphore:
+            pending = await db[EVENTS_COLLECTION].count_documents(
+                {"employeeId": employee_id, **_after(positions.get(employee_id))}, limit=min_events
+            )
+            if pending < min_events:
+                return False
+            await snapshot_employee(db, employee_id)
+            return True
+
+    taken = await asyncio.gather(*(maybe_snapshot(employee_id) for employee_id in employee_ids))
+    return sum(taken)
+
+
+class SnapshotScheduler:
+    """Takes snapshots every ``interval`` seconds in the background."""
+
+    def __init__(self, interval: float = 3600, min_events: int = 100):
+        self.interval = interval
+        self.min_events = min_events
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, db) -> None:
+        self._task = asyncio.create_task(self._run(db))
+
+    async def _run(self, db) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                taken = await take_snapshots(db, self.min_events)
+                if taken:
+                    logger.info("Took %d clock event snapshots", taken)
+            except Exception:
+                logger.exception("Taking clock event snapshots failed")
+
+    async def stop(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+
+def _as_of(entry: Dict[str, Any]) -> Dict[str, Any]:
+    # Matches the entry only while it is still in this state
+    return {"id": entry["id"], **{name: entry.get(name) for name in ("status", "endTime", "breaks")}}
+
+
+async def rebuild_employee(db, employee_id: str, batch_size: int = 1000) -> int:
+    """Rewrite one employee's time entries from the log; returns the documents written."""
+    history: Dict[str, List[Optional[Dict[str, Any]]]] = {}
+    entries, _, _ = await employee_state(db, employee_id, history=history)
+    if not entries:
+        return 0
+    current = {
+        entry["id"]: entry
+        async for entry in db.time_entries.find({"id": {"$in": list(entries)}}, {"_id": 0})
+    }
+    # Open entries in a second pass, so that one_open_entry_per_employee
+    # never sees the new open entry before the old one is closed
+    closing: List[Any] = []
+    opening: List[Any] = []
+    for entry_id, entry in entries.items():
+        existing = current.get(entry_id)
+        if existing == entry or (entry is None and existing is None):
+            continue
+        if existing is not None and existing not in history[entry_id]:
+            logger.warning("Time entry %s was changed outside the log; not rebuilt", entry_id)
+            continue
+        opens = entry is not None and entry.get("status") in OPEN_STATUSES
+        if existing is None:
+            operation = InsertOne(entry)
+        elif entry is None:
+            operation = DeleteOne(_as_of(existing))
+        elif opens and existing.get("status") not in OPEN_STATUSES:
+            logger.warning("Time entry %s is open in the log but completed; not reopened", entry_id)
+            continue
+        else:
+            operation = ReplaceOne(_as_of(existing), entry)
+        (opening if opens else closing).append(operation)
+    # Separate writes: an unordered bulk_write runs all its inserts first
+    return await _write_entries(db, closing, batch_size) + await _write_entries(db, opening, batch_size)
+
+
+async def _write_entries(db, operations: List[Any], batch_size: int) -> int:
+    written = 0
+    for i in range(0, len(operations), batch_size):
+        batch = operations[i:i + batch_size]
+        try:
+            # Unordered: an entry changed since it was read is simply not matched
+            await db.time_entries.bulk_write(batch, ordered=False)
+            written += len(batch)
+        except BulkWriteError as exc:
+            errors = exc.details.get("writeErrors", [])
+            for error in errors:
+                logger.warning("Time entry not rebuilt: %s", error.get("errmsg"))
+            written += len(batch) - len(errors)
+    return written
+
+
+async def rebuild_projections(db, concurrency: int = 8, batch_size: int = 1000) -> int:
+    """Rebuild the time entries of every employee in the log, ``concurrency`` at a time."""
+    queue: "asyncio.Queue[str]" = asyncio.Queue()
+    for employee_id in await db[EVENTS_COLLECTION].distinct("employeeId"):
+        queue.put_nowait(employee_id)
+    written = 0
+
+    async def worker() -> None:
+        nonlocal written
+        while not queue.empty():
+            employee_id = queue.get_nowait()
+            written += await rebuild_employee(db, employee_id, batch_size)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return written
+
+
+async def backfill_events(db, batch_size: int = 1000) -> int:
+    """Log ``entry_created`` for the time entries that have no events yet."""
+    logged = 0
+    batch: List[Dict[str, Any]] = []
+
+    async def flush() -> int:
+        known = set(await db[EVENTS_COLLECTION].distinct(
+            "entryId", {"entryId": {"$in": [entry["id"] for entry in batch]}}
+        ))
+        events = [
+            {
+                "employeeId": entry["employeeId"],
+                "entryId": entry["id"],
+                "type": "entry_created",
+                "at": entry.get("startTime"),
+                "recordedAt": to_storage(entry.get("createdAt") or entry.get("startTime")) or datetime.min,
+                "changes": entry,
+            }
+            for entry in batch if entry["id"] not in known
+        ]
+        if events:
+            # Numbered down from zero, so that the events logged since sort after them
+            await _number(db, events, field="backfilled", step=-1)
+            await db[EVENTS_COLLECTION].insert_many(events, ordered=False)
+        return len(events)
+
+    async for entry in db.time_entries.find({}, {"_id": 0}).batch_size(batch_size):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            logged += await flush()
+            batch = []
+    if batch:
+        logged += await flush()
+    return logged
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Maintain the clock_events log and its projections.")
+    parser.add_argument("command", choices=["backfill", "snapshot", "rebuild"])
+    parser.add_argument("--min-events", type=int, default=1, help="snapshot: events needed since the last one")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def run():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            db = client[os.environ['DB_NAME']]
+            if args.command == "backfill":
+                logger.info("Logged %d entry_created events", await backfill_events(db, args.batch_size))
+            elif args.command == "snapshot":
+                taken = await take_snapshots(db, args.min_events, args.concurrency)
+                logger.info("Took %d snapshots", taken)
+            else:
+                written = await rebuild_projections(db, args.concurrency, args.batch_size)
+                logger.info("Rewrote %d time entries; run rollups.py to refresh the rollups", written)
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Fan-out of clock state changes to Server-Sent Events subscribers.
+
+Deltas come from a MongoDB change stream when the server is a replica set,
+so every worker sees the writes of every other worker. On a standalone
+server the broker falls back to in-process publishing: endpoints call
+``publish_local`` after each write and subscribers only see the changes made
+through their own worker.
+
+Each subscriber owns a bounded queue. A slow client never blocks the
+publisher: once its queue is full the pending deltas are dropped and
+replaced by a single ``resync`` event telling it to refetch.
+"""
+import asyncio
+import itertools
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from timesheet import OPEN_STATUSES
+
+logger = logging.getLogger(__name__)
+
+WATCHED_COLLECTIONS = ["time_entries", "employees"]
+
+
+class Subscription:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._events: Deque[Dict[str, Any]] = deque()
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def push(self, event: Dict[str, Any]) -> None:
+        if len(self._events) >= self.maxsize:
+            self.dropped += len(self._events)
+            self._events.clear()
+            self._events.append({"id": event["id"], "type": "resync"})
+        elif self._events and self._events[0]["type"] == "resync":
+            # Already told to resync; further deltas are redundant until it drains
+            self.dropped += 1
+        else:
+            self._events.append(event)
+        self._ready.set()
+
+    async def get(self) -> Dict[str, Any]:
+        while not self._events:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._events.popleft()
+
+
+class EventBroker:
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self.mode = "local"
+        self._subscriptions: Set[Subscription] = set()
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._sequence = itertools.count(1)
+        self._watcher: Optional[asyncio.Task] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """Register an in-process consumer called synchronously with every delta."""
+        self._listeners.append(listener)
+
+    def publish(self, delta: Dict[str, Any]) -> None:
+        event = {"id": next(self._sequence), **delta}
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Event listener failed")
+        for subscription in self._subscriptions:
+            subscription.push(event)
+
+    def publish_local(self, delta: Optional[Dict[str, Any]]) -> None:
+        """Publish a delta produced by an endpoint, unless the change stream already will."""
+        if delta and self.mode == "local":
+            self.publish(delta)
+
+    async def start(self, db) -> None:
+        """Follow the database change stream if the server supports one."""
+        stream = _watch(db)
+        try:
+            first = await stream.try_next()
+        except OperationFailure as exc:
+            logger.info("Change streams unavailable (%s); publishing events in-process", exc)
+            await stream.close()
+            return
+        self.mode = "change_stream"
+        if first:
+            self._publish_change(first)
+        self._watcher = asyncio.create_task(self._follow(db, stream))
+        logger.info("Publishing events from the MongoDB change stream")
+
+    def _publish_change(self, change: Dict[str, Any]) -> None:
+        delta = change_delta(change)
+        if delta:
+            self.publish(delta)
+
+    async def _follow(self, db, stream) -> None:
+        while True:
+            try:
+                async with stream:
+                    async for change in stream:
+                        self._publish_change(change)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError:
+                logger.exception("Change stream interrupted; resuming")
+                await asyncio.sleep(1)
+            stream = _watch(db, resume_after=stream.resume_token)
+
+    async def stop(self) -> None:
+        if self._watcher:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+
+def _watch(db, resume_after=None):
+    return db.watch(
+        [{"$match": {"ns.coll": {"$in": WATCHED_COLLECTIONS}}}],
+        full_document="updateLookup",
+        resume_after=resume_after,
+    )
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def entry_delta(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Compact delta for a time entry going from ``before`` to ``after``."""
+    entry = after or before
+    if entry is None:
+        return None
+    if after is None:
+        kind = "entry_deleted"
+    elif before is None:
+        kind = "clock_in" if after.get("status") in OPEN_STATUSES else "entry_created"
+    else:
+        kind = _transition(before.get("status"), after.get("status"))
+    return {
+        "type": kind,
+        "employeeId": entry["employeeId"],
+        "entryId": entry["id"],
+        "status": after.get("status") if after else None,
+        "since": status_since(after) if after else None,
+        "at": _now(),
+    }
+
+
+def status_since(entry: Dict[str, Any]) -> Optional[str]:
+    """When the entry entered its current status."""
+    breaks = entry.get("breaks") or []
+    status = entry.get("status")
+    if status == "completed":
+        value = entry.get("endTime")
+    elif status == "on_break" and breaks:
+        value = breaks[-1].get("startTime")
+    elif status == "active" and breaks and breaks[-1].get("endTime"):
+        value = breaks[-1]["endTime"]
+    else:
+        value = entry.get("startTime")
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def employee_delta(kind: str, employee_id: str) -> Dict[str, Any]:
+    return {"type": kind, "employeeId": employee_id, "at": _now()}
+
+
+def _transition(previous: Optional[str], current: Optional[str]) -> str:
+    if current == "completed" and previous in OPEN_STATUSES:
+        return "clock_out"
+    if previous == "active" and current == "on_break":
+        return "start_break"
+    if previous == "on_break" and current == "active":
+        return "end_break"
+    return "entry_updated"
+
+
+def change_delta(change: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Translate a change stream event into the same deltas as ``entry_delta``."""
+    collection = change["ns"]["coll"]
+    operation = change["operationType"]
+    document = change.get("fullDocument") or {}
+    updated = (change.get("updateDescription") or {}).get("updatedFields", {})
+
+    if collection == "employees":
+        if operation == "insert":
+            return employee_delta("employee_created", document.get("id"))
+        if operation in ("update", "replace") and document:
+            kind = "employee_deleted" if updated.get("isActive") is False else "employee_updated"
+            return employee_delta(kind, document.get("id"))
+        return None
+
+    if operation == "delete":
+        # Without pre-images only the Mongo _id of the entry is known
+        return {"type": "entry_deleted", "at": _now()}
+    if not document:
+        return None
+    if operation == "insert":
+        kind = "clock_in" if document.get("status") in OPEN_STATUSES else "entry_created"
+    elif "status" in updated:
+        status = updated["status"]
+        if status == "completed":
+            kind = "clock_out"
+        elif status == "on_break":
+            kind = "start_break"
+        elif status == "active" and any(name.startswith("breaks") for name in updated):
+            kind = "end_break"
+        else:
+            kind = "entry_updated"
+    else:
+        kind = "entry_updated"
+    return {
+        "type": kind,
+        "employeeId": document.get("employeeId"),
+        "entryId": document.get("id"),
+        "status": document.get("status"),
+        "since": status_since(document),
+        "at": _now(),
+    }
@@ -0,0 +1,101 @@
+"""Server-side payroll exports streamed from a Mongo cursor.
+
+Rows are formatted one at a time and flushed in chunks, so memory stays
+bounded by ``chunk_rows`` whatever the size of the requested range. XLSX
+output uses openpyxl's write-only mode, which spools rows to a temporary file
+instead of keeping the sheet in memory.
+"""
+import asyncio
+import csv
+import io
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List
+
+from timesheet import entry_seconds, parse_timestamp
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX exports are optional
+    Workbook = None
+
+XLSX_AVAILABLE = Workbook is not None
+
+# Same labels as the client-side exports in ExportManager.js
+EXPORT_COLUMNS = [
+    "Employé",
+    "Poste",
+    "Date",
+    "Arrivée",
+    "Départ",
+    "Heures travaillées",
+    "Heures de pause",
+    "Taux horaire",
+    "Coût",
+    "Statut",
+]
+
+# Fields of a time entry the export needs
+EXPORT_PROJECTION = {"_id": 0, "employeeId": 1, "startTime": 1, "endTime": 1, "breaks": 1}
+EMPLOYEE_PROJECTION = {"_id": 0, "id": 1, "name": 1, "position": 1, "hourlyRate": 1}
+
+UNKNOWN_EMPLOYEE = {"name": "Unknown", "position": "", "hourlyRate": 0.0}
+
+
+def export_row(entry: Dict[str, Any], employee: Dict[str, Any]) -> List[Any]:
+    start = parse_timestamp(entry["startTime"])
+    end = parse_timestamp(entry.get("endTime"))
+    worked, breaks = entry_seconds(entry)
+    worked_hours = round(worked / 3600, 2)
+    rate = employee.get("hourlyRate") or 0.0
+    return [
+        employee.get("name", ""),
+        employee.get("position", ""),
+        start.date().isoformat(),
+        start.time().isoformat("minutes"),
+        end.time().isoformat("minutes") if end else "En cours",
+        worked_hours,
+        round(breaks / 3600, 2),
+        rate,
+        round(worked_hours * rate, 2),
+        "Terminé" if end else "En cours",
+    ]
+
+
+async def iter_rows(
+    entries: AsyncIterable[Dict[str, Any]], employees: Dict[str, Dict[str, Any]]
+) -> AsyncIterator[List[Any]]:
+    async for entry in entries:
+        yield export_row(entry, employees.get(entry["employeeId"], UNKNOWN_EMPLOYEE))
+
+
+async def csv_chunks(
+    entries: AsyncIterable[Dict[str, Any]],
+    employees: Dict[str, Dict[str, Any]],
+    chunk_rows: int = 1000,
+) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    pending = 0
+    async for row in iter_rows(entries, employees):
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    yield buffer.getvalue()
+
+
+async def write_xlsx(
+    entries: AsyncIterable[Dict[str, Any]], employees: Dict[str, Dict[str, Any]], path: str
+) -> None:
+    if not XLSX_AVAILABLE:
+        raise RuntimeError("XLSX exports require openpyxl")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Pointages")
+    sheet.append(EXPORT_COLUMNS)
+    async for row in iter_rows(entries, employees):
+        sheet.append(row)
+    # Zipping the spooled sheet is CPU bound; keep it off the event loop
+    await asyncio.to_thread(workbook.save, path)
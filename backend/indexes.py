@@ -0,0 +1,123 @@
+"""Declarative index definitions, ensured on every startup.
+
+``create_index`` is a no-op for an index that already exists with the same
+options, so ``ensure_indexes`` is cheap on a provisioned database. A
+definition that cannot be built (e.g. duplicate ids in legacy data) is
+logged and skipped rather than preventing the API from starting.
+
+``one_open_entry_per_employee`` can't be built over data written before it
+existed if an employee has several open entries: ``close_duplicate_open_entries``
+closes all but the latest one first. If the index still can't be built
+(e.g. MongoDB older than 6.0, which rejects ``$in`` in a partial filter),
+the caller falls back to looking up the open entry before each insert.
+"""
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from event_store import EVENTS_COLLECTION
+from period_stats import STATS_CACHE, STATS_CACHE_TTL
+from rollups import ROLLUP_COLLECTION, ROLLUP_INDEXES
+from sync import SYNC_RECEIPT_TTL, SYNC_RECEIPTS
+from timesheet import OPEN_STATUSES
+
+logger = logging.getLogger(__name__)
+
+OPEN_ENTRY_INDEX = "one_open_entry_per_employee"
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "employees": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "time_entries": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # clock-in/out and break transitions look up the open entry of an employee
+        IndexModel([("employeeId", ASCENDING), ("status", ASCENDING)], name="employee_status"),
+        # at most one open entry per employee, enforced by the insert in clock_in
+        # ($in in a partial filter needs MongoDB 6.0+)
+        IndexModel(
+            [("employeeId", ASCENDING)],
+            name=OPEN_ENTRY_INDEX,
+            unique=True,
+            partialFilterExpression={"status": {"$in": OPEN_STATUSES}},
+        ),
+        # listing and stats ranges, newest first; the id suffix serves the
+        # keyset pagination of /api/time-entries/page
+        IndexModel([("startTime", DESCENDING), ("id", DESCENDING)], name="start_time_id_desc"),
+        # per-employee history
+        IndexModel([("employeeId", ASCENDING), ("startTime", ASCENDING)], name="employee_start_time"),
+    ],
+    ROLLUP_COLLECTION: ROLLUP_INDEXES,
+    EVENTS_COLLECTION: [
+        # an employee's events in log order, from a snapshot position on
+        IndexModel(
+            [("employeeId", ASCENDING), ("sequence", ASCENDING)], name="employee_sequence", unique=True
+        ),
+        # history of one entry; the backfill looks up entries already logged
+        IndexModel([("entryId", ASCENDING), ("recordedAt", ASCENDING)], name="entry_recorded_at"),
+    ],
+    STATS_CACHE: [
+        # summaries of elapsed days only need to outlive the reviews reading them
+        IndexModel([("storedAt", ASCENDING)], name="stored_at_ttl", expireAfterSeconds=STATS_CACHE_TTL),
+    ],
+    SYNC_RECEIPTS: [
+        # idempotency keys are the _id; receipts only need to outlive retries
+        IndexModel([("receivedAt", ASCENDING)], name="received_at_ttl", expireAfterSeconds=SYNC_RECEIPT_TTL),
+    ],
+}
+
+
+async def ensure_indexes(db, indexes: Dict[str, List[IndexModel]] = INDEXES) -> List[str]:
+    """Create the missing indexes; returns the names of those that failed."""
+    failed = []
+    for collection, models in indexes.items():
+        for model in models:
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as exc:
+                logger.error("Could not create index %s.%s: %s", collection, model.document["name"], exc)
+                failed.append(model.document["name"])
+    return failed
+
+
+async def close_duplicate_open_entries(db) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Leave each employee at most one open entry, before the index is built.
+
+    Older open entries are closed when the next one started, open breaks
+    included. Returns the ``(before, after)`` images of the closed entries
+    for the caller to record. Skipped once the index exists.
+    """
+    if OPEN_ENTRY_INDEX in await db.time_entries.index_information():
+        return []
+    groups = db.time_entries.aggregate([
+        {"$match": {"status": {"$in": OPEN_STATUSES}}},
+        {"$sort": {"startTime": 1, "id": 1}},
+        {"$group": {"_id": "$employeeId", "entries": {"$push": "$$ROOT"}}},
+        {"$match": {"entries.1": {"$exists": True}}},
+    ])
+    changes = []
+    async for group in groups:
+        entries = [{key: value for key, value in entry.items() if key != "_id"} for entry in group["entries"]]
+        for entry, successor in zip(entries, entries[1:]):
+            closed = _closed(entry, successor["startTime"])
+            result = await db.time_entries.update_one(
+                {"id": entry["id"], "status": entry["status"]},
+                {"$set": {name: closed[name] for name in ("endTime", "status", "breaks")}},
+            )
+            if result.modified_count:
+                logger.warning(
+                    "Closed duplicate open time entry %s of employee %s at %s",
+                    entry["id"], group["_id"], successor["startTime"]
+                )
+                changes.append((entry, closed))
+    return changes
+
+
+def _closed(entry: Dict[str, Any], end: Optional[Any]) -> Dict[str, Any]:
+    breaks = [
+        {**item, "endTime": end} if item.get("endTime") is None else item
+        for item in entry.get("breaks") or []
+    ]
+    return {**entry, "endTime": end, "status": "completed", "breaks": breaks}
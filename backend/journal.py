@@ -0,0 +1,269 @@
+"""Write-behind journal for kiosk clock taps.
+
+With ``TAP_JOURNAL_DIR`` set, the tap endpoints don't wait for MongoDB:
+each tap is appended to a local append-only journal and acknowledged once
+the journal is fsync'd, then a background task applies the journaled taps
+to MongoDB in batches.
+
+- Group commit: taps arriving while a write is in flight are written and
+  fsync'd together, so a burst of taps costs one fsync per group rather
+  than one per tap.
+- Taps are applied through the offline sync path (``sync.ingest``) with
+  the journal record's key as idempotency key, so a tap applied before a
+  crash but still in the journal is acknowledged as a duplicate when
+  replayed, never applied twice.
+- The journal is split into numbered segments of at most
+  ``segment_bytes``; a segment is deleted once every tap in it has been
+  applied. ``start`` queues whatever segments are left for replay in the
+  background, ahead of new taps. A torn last line (a crash mid-write) was
+  never acknowledged and is skipped. ``stop`` leaves the taps not applied
+  yet in the journal for the next start.
+
+Conflicts (clocking in twice, ending a break that never started) can't be
+reported to the kiosk any more: they are rejected when applied, logged and
+counted in ``timetracker_journal_taps_total``. Taps acked ``retry`` (a
+concurrent writer got in the way, or their receipt is still pending) are
+retried until they settle; they stay in the journal until then.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "taps-"
+SEGMENT_SUFFIX = ".log"
+
+# Acks that mean the tap needs no further work: "duplicate" only for a
+# receipt recorded as applied (see sync.ingest)
+SETTLED_ACKS = ("applied", "rejected", "duplicate")
+
+journal_taps = REGISTRY.counter(
+    "timetracker_journal_taps_total", "Journaled clock taps, by outcome once applied.", ("ack",)
+)
+journal_backlog = REGISTRY.gauge(
+    "timetracker_journal_backlog", "Journaled clock taps not yet applied to the database."
+)
+journal_commit_size = REGISTRY.histogram(
+    "timetracker_journal_commit_taps", "Taps written per journal fsync.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500)
+)
+
+ApplyTaps = Callable[[List[Dict[str, Any]]], Awaitable[Dict[str, Any]]]
+
+
+class TapJournal:
+    def __init__(
+        self,
+        directory: str,
+        batch_size: int = 500,
+        segment_bytes: int = 16 * 1024 * 1024,
+        commit_delay: float = 0.0,
+        retry_delay: float = 1.0,
+    ):
+        self.directory = Path(directory)
+        self.apply_taps: Optional[ApplyTaps] = None
+        self.batch_size = batch_size
+        self.segment_bytes = segment_bytes
+        self.commit_delay = commit_delay
+        self.retry_delay = retry_delay
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._wakeup = asyncio.Event()
+        self._queue: "asyncio.Queue[Optional[Tuple[int, Dict[str, Any]]]]" = asyncio.Queue()
+        self._unapplied: Dict[int, int] = {}
+        self._segment = 0
+        self._file = None
+        self._stopping = False
+        self._committer: Optional[asyncio.Task] = None
+        self._applier: Optional[asyncio.Task] = None
+
+    @property
+    def backlog(self) -> int:
+        return sum(self._unapplied.values())
+
+    def _segment_path(self, sequence: int) -> Path:
+        return self.directory / f"{SEGMENT_PREFIX}{sequence:012d}{SEGMENT_SUFFIX}"
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            for path in self.directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}")
+        )
+
+    # Lifecycle
+    async def start(self, apply_taps: ApplyTaps) -> None:
+        """Queue the segments left by the previous run, then take new taps.
+
+        ``apply_taps`` takes a list of journal records and returns the ack
+        map of ``sync.ingest``.
+        """
+        self.apply_taps = apply_taps
+        self.directory.mkdir(parents=True, exist_ok=True)
+        segments = self._segments()
+        replayed = 0
+        for sequence in segments:
+            records = await asyncio.to_thread(self._read_segment, sequence)
+            for record in records:
+                self._enqueue(sequence, record)
+            replayed += len(records)
+            if not records:
+                self._segment_path(sequence).unlink()
+        # Never append after a possibly torn tail: always open a new segment
+        self._segment = segments[-1] + 1 if segments else 1
+        self._file = await asyncio.to_thread(open, self._segment_path(self._segment), "ab")
+
+        if replayed:
+            logger.info("Replaying %d journaled taps from %d segments", replayed, len(segments))
+        self._applier = asyncio.create_task(self._apply_loop())
+        self._committer = asyncio.create_task(self._commit_loop())
+
+    async def stop(self) -> None:
+        """Commit what was appended and close the journal.
+
+        The batch being applied is finished; the rest of the backlog stays
+        in the journal and is replayed by the next ``start``.
+        """
+        self._stopping = True
+        if self._committer:
+            self._wakeup.set()
+            await self._committer
+            self._committer = None
+        if self._applier:
+            await self._queue.put(None)
+            await self._applier
+            self._applier = None
+        if self._file:
+            self._file.close()
+            self._file = None
+            if not self._unapplied.get(self._segment):
+                self._segment_path(self._segment).unlink(missing_ok=True)
+
+    # Appending
+    async def append(self, employee_id: str, action: str, timestamp: str) -> Dict[str, Any]:
+        """Journal one tap; returns its record once it is on disk."""
+        record = {
+            "key": str(uuid.uuid4()),
+            "employeeId": employee_id,
+            "action": action,
+            "timestamp": timestamp,
+        }
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((record, future))
+        self._wakeup.set()
+        await future
+        return record
+
+    def _take_pending(self) -> List[Tuple[Dict[str, Any], asyncio.Future]]:
+        pending, self._pending = self._pending, []
+        return pending
+
+    async def _commit_loop(self) -> None:
+        while not (self._stopping and not self._pending):
+            await self._wakeup.wait()
+            if self.commit_delay and not self._stopping:
+                # Let taps arriving together join the group
+                await asyncio.sleep(self.commit_delay)
+            self._wakeup.clear()
+            await self._commit(self._take_pending())
+
+    async def _commit(self, group: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        if not group:
+            return
+        data = b"".join(dumps(record) + b"\n" for record, _ in group)
+        try:
+            size = await asyncio.to_thread(self._write, data)
+        except Exception as exc:
+            logger.exception("Journal write failed")
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        journal_commit_size.labels().observe(len(group))
+        for record, future in group:
+            self._enqueue(self._segment, record)
+            if not future.done():
+                future.set_result(None)
+        if size >= self.segment_bytes:
+            await asyncio.to_thread(self._file.close)
+            self._segment += 1
+            self._file = await asyncio.to_thread(open, self._segment_path(self._segment), "ab")
+            self._prune()
+
+    def _write(self, data: bytes) -> int:
+        # Runs in a worker thread; only one commit is in flight at a time
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def _read_segment(self, sequence: int) -> List[Dict[str, Any]]:
+        records = []
+        with open(self._segment_path(sequence), "rb") as segment:
+            for number, line in enumerate(segment, 1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping torn journal record %s:%d", self._segment_path(sequence).name, number)
+        return records
+
+    # Applying
+    def _enqueue(self, sequence: int, record: Dict[str, Any]) -> None:
+        self._unapplied[sequence] = self._unapplied.get(sequence, 0) + 1
+        journal_backlog.labels().inc()
+        self._queue.put_nowait((sequence, record))
+
+    def _settle(self, sequence: int) -> None:
+        self._unapplied[sequence] -= 1
+        journal_backlog.labels().dec()
+        self._prune()
+
+    def _prune(self) -> None:
+        """Delete the finished segments whose taps have all been applied."""
+        for sequence in [sequence for sequence, count in self._unapplied.items() if not count]:
+            if sequence != self._segment:
+                del self._unapplied[sequence]
+                self._segment_path(sequence).unlink(missing_ok=True)
+
+    async def _apply_loop(self) -> None:
+        while not self._stopping:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            batch = [item for item in batch if item is not None]
+            if batch:
+                await self._apply(batch)
+
+    async def _apply(self, batch: List[Tuple[int, Dict[str, Any]]]) -> None:
+        # Retried while the database is unreachable and while taps are acked
+        # "retry": the journal keeps the taps until they settle, or until
+        # ``stop`` leaves them for the next start.
+        while batch and not self._stopping:
+            try:
+                result = await self.apply_taps([record for _, record in batch])
+            except Exception:
+                logger.exception("Applying %d journaled taps failed; retrying", len(batch))
+                await asyncio.sleep(self.retry_delay)
+                continue
+            retry = []
+            for sequence, record in batch:
+                ack = result["acks"].get(record["key"], "retry")
+                error = result["errors"].get(record["key"])
+                if ack not in SETTLED_ACKS:
+                    retry.append((sequence, record))
+                    continue
+                if ack == "rejected":
+                    logger.warning(
+                        "Journaled %s for %s rejected: %s", record["action"], record["employeeId"], error
+                    )
+                journal_taps.labels(ack).inc()
+                self._settle(sequence)
+            batch = retry
+            if batch:
+                await asyncio.sleep(self.retry_delay)
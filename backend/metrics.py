@@ -0,0 +1,264 @@
+"""Prometheus-style metrics, rendered in the text exposition format at ``/metrics``.
+
+A small in-process registry (counters, gauges and histograms with labels)
+rather than a client library, so recording a value costs a dict lookup and
+a few additions. ``MetricsMiddleware`` times every HTTP request under the
+template of the route it matches (``/api/clock-in/{employee_id}``), so the
+label values stay bounded whatever the ids in the URLs. Values are per
+worker process.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Request latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def children(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        return list(self._children.items())
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, child in self.children():
+            yield from child.render(self.name, self.label_names, values)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render(self, name, label_names, values) -> Iterable[str]:
+        yield f"{name}{_format_labels(label_names, values)} {_format_value(self.value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        # Also called from Motor's worker threads (see db_monitoring)
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self, name, label_names, values) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip([*self.buckets, float("inf")], self.counts):
+            cumulative += count
+            labels = _format_labels(label_names, values, f'le="{_format_value(bound)}"')
+            yield f"{name}_bucket{labels} {cumulative}"
+        yield f"{name}_sum{_format_labels(label_names, values)} {_format_value(self.sum)}"
+        yield f"{name}_count{_format_labels(label_names, values)} {self.count}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = [line for metric in self._metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_requests = REGISTRY.counter(
+    "http_requests_total", "HTTP requests handled.", ("method", "route", "status")
+)
+http_duration = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to the end of the response body.", ("method", "route")
+)
+http_in_flight = REGISTRY.gauge(
+    "http_requests_in_flight", "HTTP requests being handled.", ("method", "route")
+)
+
+# Domain counters
+clock_events = REGISTRY.counter(
+    "timetracker_clock_events_total", "Clock events applied, by action and entry point.", ("action", "source")
+)
+sync_batches = REGISTRY.counter(
+    "timetracker_sync_batches_total", "Offline sync batches received."
+)
+sync_operations = REGISTRY.counter(
+    "timetracker_sync_operations_total", "Offline sync operations, by acknowledgement.", ("ack",)
+)
+
+
+def leaf_routes(routes: Iterable[Any]) -> List[Any]:
+    """Routes with a path template, looking through included routers."""
+    leaves = []
+    for route in routes:
+        if hasattr(route, "path_regex"):
+            leaves.append(route)
+            continue
+        # Routers included as a whole (FastAPI >= 0.140 keeps them nested)
+        router = getattr(route, "original_router", route)
+        leaves.extend(leaf_routes(getattr(router, "routes", ())))
+    return leaves
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording count, latency and in-flight requests per route.
+
+    The route is resolved before the request runs, so that the in-flight
+    gauge has it too, and memoised per path.
+    """
+
+    def __init__(self, app, exclude: Sequence[str] = ("/metrics",), max_paths: int = 10_000):
+        self.app = app
+        self.exclude = set(exclude)
+        self.max_paths = max_paths
+        self._routes: Optional[List[Any]] = None
+        self._templates: Dict[str, str] = {}
+
+    def route_template(self, scope: Dict[str, Any]) -> str:
+        path = scope["path"]
+        template = self._templates.get(path)
+        if template is not None:
+            return template
+        if self._routes is None:
+            self._routes = leaf_routes(scope["app"].routes)
+        template = next(
+            (route.path for route in self._routes if route.path_regex.match(path)), UNMATCHED_ROUTE
+        )
+        if len(self._templates) >= self.max_paths:
+            self._templates.clear()  # paths carry ids; don't grow without bound
+        self._templates[path] = template
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self.route_template(scope)
+        in_flight = http_in_flight.labels(method, route)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            http_duration.labels(method, route).observe(time.perf_counter() - started)
+            http_requests.labels(method, route, str(status)).inc()
+
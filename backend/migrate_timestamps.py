@@ -0,0 +1,124 @@
+"""Convert the ISO string timestamps of ``time_entries`` to BSON dates.
+
+Entries still holding a string ``startTime``, ``endTime`` or break time are
+scanned in ``_id`` order and rewritten in batches of ``--batch-size``. Each
+rewrite only applies if the entry still holds the values that were read, so
+the API can keep serving while it runs: an entry clocked out in between is
+skipped and picked up by the next run. The ``_id`` reached is checkpointed
+in the ``migrations`` collection after every batch and an interrupted run
+resumes from there (``--restart`` scans from the beginning)::
+
+    python migrate_timestamps.py --batch-size 1000
+
+Run it until it reports no entries left, then set
+``LEGACY_STRING_TIMESTAMPS=false`` to stop the API matching strings.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict
+
+from pymongo import UpdateOne
+
+from timesheet import storage_times
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = "migrations"
+MIGRATION_ID = "time_entry_dates"
+
+TIMESTAMP_FIELDS = ("startTime", "endTime", "breaks")
+LEGACY_FILTER = {"$or": [
+    {"startTime": {"$type": "string"}},
+    {"endTime": {"$type": "string"}},
+    {"breaks.startTime": {"$type": "string"}},
+    {"breaks.endTime": {"$type": "string"}},
+]}
+
+
+async def migrate_timestamps(db, batch_size: int = 1000, restart: bool = False) -> Dict[str, int]:
+    """Convert every entry with string timestamps; returns the counts of this run."""
+    checkpoint = None if restart else await db[MIGRATIONS].find_one({"_id": MIGRATION_ID})
+    last_id = checkpoint.get("lastId") if checkpoint else None
+    if last_id is not None:
+        logger.info("Resuming after _id %s", last_id)
+
+    counts = {"converted": 0, "changed": 0, "invalid": 0}
+    while True:
+        query: Dict[str, Any] = LEGACY_FILTER
+        if last_id is not None:
+            query = {"$and": [LEGACY_FILTER, {"_id": {"$gt": last_id}}]}
+        batch = await db.time_entries.find(
+            query, {field: 1 for field in TIMESTAMP_FIELDS}
+        ).sort("_id", 1).limit(batch_size).to_list(None)
+        if not batch:
+            break
+
+        operations = []
+        for entry in batch:
+            current = {field: entry[field] for field in TIMESTAMP_FIELDS if field in entry}
+            try:
+                converted = storage_times(current)
+            except (ValueError, TypeError):
+                counts["invalid"] += 1
+                logger.warning("Time entry %s has an unparseable timestamp; left as is", entry["_id"])
+                continue
+            operations.append(UpdateOne(
+                {"_id": entry["_id"], **{field: entry.get(field) for field in TIMESTAMP_FIELDS}},
+                {"$set": converted},
+            ))
+        if operations:
+            result = await db.time_entries.bulk_write(operations, ordered=False)
+            counts["converted"] += result.modified_count
+            counts["changed"] += len(operations) - result.matched_count
+
+        last_id = batch[-1]["_id"]
+        await db[MIGRATIONS].update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {"lastId": last_id, "updatedAt": datetime.utcnow()}},
+            upsert=True,
+        )
+        logger.info("Converted %d time entries so far", counts["converted"])
+
+    # Scan complete: the next run starts over for entries skipped this time
+    await db[MIGRATIONS].update_one(
+        {"_id": MIGRATION_ID},
+        {"$set": {"lastId": None, "completedAt": datetime.utcnow()}},
+        upsert=True,
+    )
+    return counts
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Convert time entry timestamps from ISO strings to BSON dates.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an interrupted run")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def run():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            db = client[os.environ['DB_NAME']]
+            counts = await migrate_timestamps(db, args.batch_size, args.restart)
+            remaining = await db.time_entries.count_documents(LEGACY_FILTER)
+            logger.info(
+                "Converted %d time entries (%d changed concurrently, %d invalid); %d left with string timestamps",
+                counts["converted"], counts["changed"], counts["invalid"], remaining,
+            )
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Hours over arbitrary date ranges, grouped by day, week or month.
+
+Ranges are assembled from one summary per UTC day, computed from the
+``daily_rollups`` of that day. A day that has fully elapsed only changes when
+an entry of that day is edited afterwards, so its summary is memoised in an
+in-process LRU and persisted in ``stats_cache`` for the other workers; the
+current day (and any later one) is always recomputed. Changes to past days
+call ``invalidate``; other workers drop their in-memory copy once its TTL
+runs out.
+
+Invalidating marks the stored summaries stale and bumps their
+``generation`` rather than deleting them, and a summary is only stored
+over the generation it was computed under: a worker whose computation
+raced an invalidation, in this process or another, doesn't write back what
+it read before the change. Stored summaries expire ``STATS_CACHE_TTL``
+after they were written.
+"""
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from cache import TTLCache
+from rollups import ROLLUP_COLLECTION
+
+STATS_CACHE = "stats_cache"
+STATS_CACHE_TTL = 90 * 24 * 3600  # seconds
+
+DUPLICATE_KEY = 11000
+
+
+def summary_id(day: str, employee_id: Optional[str]) -> str:
+    return f"{day}:{employee_id or '*'}"
+
+
+def empty_summary(day: str) -> Dict[str, Any]:
+    return {
+        "day": day, "workedSeconds": 0.0, "breakSeconds": 0.0, "elapsedSeconds": 0.0, "entries": 0, "employeeIds": []
+    }
+
+
+class DailyStatsCache:
+    def __init__(self, ttl: float, maxsize: int = 4096):
+        self.memory = TTLCache(ttl=ttl, maxsize=maxsize)
+        self.stored_hits = 0  # days served from stats_cache
+        self.computed = 0  # days recomputed from the rollups
+        self._invalidations = 0
+
+    async def summaries(
+        self, db, days: List[date], employee_id: Optional[str], today: date
+    ) -> Dict[str, Dict[str, Any]]:
+        """One summary per day, from memory, then ``stats_cache``, then the rollups."""
+        found: Dict[str, Dict[str, Any]] = {}
+        closed = [day.isoformat() for day in days if day < today]
+        open_days = [day.isoformat() for day in days if day >= today]
+
+        missing = []
+        for day in closed:
+            summary = self.memory.get((day, employee_id))
+            if summary is None:
+                missing.append(day)
+            else:
+                found[day] = summary
+
+        generations: Dict[str, Optional[int]] = {}  # None: nothing stored
+        if missing:
+            stored = await db[STATS_CACHE].find(
+                {"_id": {"$in": [summary_id(day, employee_id) for day in missing]}}
+            ).to_list(None)
+            hits = 0
+            for document in stored:
+                summary = _summary(document)
+                day = document["_id"].split(":", 1)[0]
+                if summary is None:
+                    generations[day] = document.get("generation", 0)
+                    continue
+                found[day] = summary
+                self.memory.set((day, employee_id), summary)
+                hits += 1
+            self.stored_hits += hits
+            missing = [day for day in missing if day not in found]
+
+        invalidations = self._invalidations
+        computed = await compute_summaries(db, missing + open_days, employee_id)
+        self.computed += len(computed)
+        found.update(computed)
+        # Don't keep what may predate an edit made while computing
+        if missing and invalidations == self._invalidations:
+            if await self._store(db, {day: computed[day] for day in missing}, employee_id, generations):
+                for day in missing:
+                    self.memory.set((day, employee_id), computed[day])
+        return found
+
+    @staticmethod
+    async def _store(
+        db, summaries: Dict[str, Dict[str, Any]], employee_id: Optional[str], generations: Dict[str, Optional[int]]
+    ) -> bool:
+        """Store ``summaries`` over the generations they were computed under; False if any was invalidated since."""
+        now = datetime.utcnow()
+        operations = []
+        for day, summary in summaries.items():
+            document = {**summary, "employeeId": employee_id, "storedAt": now}
+            generation = generations.get(day)
+            if generation is None:
+                # Loses to an invalidation that stored a stale marker first
+                operations.append(InsertOne({"_id": summary_id(day, employee_id), "generation": 0, **document}))
+            else:
+                operations.append(ReplaceOne(
+                    {"_id": summary_id(day, employee_id), "generation": generation},
+                    {"generation": generation, **document},
+                ))
+        try:
+            result = await db[STATS_CACHE].bulk_write(operations, ordered=False)
+        except BulkWriteError as exc:
+            if any(error["code"] != DUPLICATE_KEY for error in exc.details.get("writeErrors", [])):
+                raise
+            return False
+        return result.inserted_count + result.matched_count == len(operations)
+
+    async def invalidate(self, db, buckets: Iterable[Tuple[str, str]], today: date) -> None:
+        """Forget the summaries of the (employeeId, day) buckets a change touched."""
+        ids = []
+        self._invalidations += 1
+        for employee_id, day in set(buckets):
+            if day >= today.isoformat():
+                continue  # never cached
+            for key in (employee_id, None):
+                self.memory.invalidate((day, key))
+                ids.append(summary_id(day, key))
+        if ids:
+            now = datetime.utcnow()
+            await db[STATS_CACHE].bulk_write([
+                UpdateOne(
+                    {"_id": stored_id},
+                    {"$set": {"stale": True, "storedAt": now}, "$inc": {"generation": 1}},
+                    upsert=True,
+                )
+                for stored_id in ids
+            ], ordered=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.memory.stats(), "storedHits": self.stored_hits, "computed": self.computed}
+
+
+def _summary(document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The summary a ``stats_cache`` document holds, or None if it is stale."""
+    # Stored before elapsedSeconds was summed: stale too
+    if document.get("stale") or "elapsedSeconds" not in document:
+        return None
+    return {name: document[name] for name in empty_summary(document["day"])}
+
+
+async def compute_summaries(db, days: List[str], employee_id: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """Summaries of ``days`` folded from the rollups, zeros for days without any."""
+    if not days:
+        return {}
+    match: Dict[str, Any] = {"day": {"$in": days}, "entryCount": {"$gt": 0}}
+    if employee_id:
+        match["employeeId"] = employee_id
+    grouped = await db[ROLLUP_COLLECTION].aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": "$day",
+            "workedSeconds": {"$sum": "$workedSeconds"},
+            "breakSeconds": {"$sum": "$breakSeconds"},
+            "elapsedSeconds": {"$sum": "$elapsedSeconds"},
+            "entries": {"$sum": "$entryCount"},
+            "employeeIds": {"$addToSet": "$employeeId"},
+        }},
+    ]).to_list(None)
+    summaries = {day: empty_summary(day) for day in days}
+    for summary in grouped:
+        day = summary.pop("_id")
+        summaries[day] = {"day": day, **summary, "employeeIds": sorted(summary["employeeIds"])}
+    return summaries
+
+
+def summarise_rollups(rollups: Iterable[Dict[str, Any]], days: List[str]) -> Dict[str, Dict[str, Any]]:
+    """``compute_summaries`` in Python, over rollups held in memory."""
+    summaries = {day: empty_summary(day) for day in days}
+    for rollup in rollups:
+        summary = summaries.get(rollup["day"])
+        if summary is None or rollup["entryCount"] <= 0:
+            continue
+        summary["workedSeconds"] += rollup["workedSeconds"]
+        summary["breakSeconds"] += rollup["breakSeconds"]
+        summary["elapsedSeconds"] += rollup.get("elapsedSeconds", 0)
+        summary["entries"] += rollup["entryCount"]
+        summary["employeeIds"] = sorted({*summary["employeeIds"], rollup["employeeId"]})
+    return summaries
+
+
+def period_of(day: date, group_by: str) -> Tuple[date, date]:
+    """First and last day of the period ``day`` falls in."""
+    if group_by == "week":
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if group_by == "month":
+        start = day.replace(day=1)
+        following = (start + timedelta(days=32)).replace(day=1)
+        return start, following - timedelta(days=1)
+    return day, day
+
+
+def period_label(start: date, group_by: str) -> str:
+    if group_by == "week":
+        year, week, _ = start.isocalendar()
+        return f"{year}-W{week:02d}"
+    if group_by == "month":
+        return start.strftime("%Y-%m")
+    return start.isoformat()
+
+
+def _totals(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    worked = sum(summary["workedSeconds"] for summary in summaries)
+    breaks = sum(summary["breakSeconds"] for summary in summaries)
+    elapsed = sum(summary["elapsedSeconds"] for summary in summaries)
+    return {
+        "hours": round(elapsed / 3600, 2),
+        "workedHours": round(worked / 3600, 2),
+        "breakHours": round(breaks / 3600, 2),
+        "entries": sum(summary["entries"] for summary in summaries),
+        "employees": len({employee for summary in summaries for employee in summary["employeeIds"]}),
+    }
+
+
+async def range_stats(
+    db,
+    cache: DailyStatsCache,
+    start: date,
+    end: date,
+    group_by: str,
+    employee_id: Optional[str],
+    today: date,
+) -> Dict[str, Any]:
+    """Per-period and overall figures between ``start`` and ``end`` (inclusive).
+
+    ``hours`` is the elapsed time of closed entries, breaks included, as on
+    the dashboard; ``workedHours`` and ``breakHours`` count open entries so
+    far too. Periods at the edges are clipped to the range.
+    """
+    days = range_days(start, end)
+    summaries = await cache.summaries(db, days, employee_id, today)
+    return group_summaries(start, end, group_by, employee_id, summaries)
+
+
+def range_days(start: date, end: date) -> List[date]:
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+def group_summaries(
+    start: date, end: date, group_by: str, employee_id: Optional[str], summaries: Dict[str, Dict[str, Any]]
+) -> Dict[str, Any]:
+    """The ``range_stats`` result for one summary per day of the range."""
+    days = range_days(start, end)
+    periods: Dict[date, List[Dict[str, Any]]] = {}
+    for day in days:
+        periods.setdefault(period_of(day, group_by)[0], []).append(summaries[day.isoformat()])
+
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "groupBy": group_by,
+        "employeeId": employee_id,
+        "periods": [
+            {
+                "period": period_label(period_start, group_by),
+                "start": max(period_start, start).isoformat(),
+                "end": min(period_of(period_start, group_by)[1], end).isoformat(),
+                **_totals(period_summaries),
+            }
+            for period_start, period_summaries in periods.items()
+        ],
+        "totals": _totals(list(summaries.values())),
+    }
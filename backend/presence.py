@@ -0,0 +1,139 @@
+"""In-memory "who is in" board.
+
+Maps each clocked-in employee to ``{status, since, entryId}``. It is warmed
+from the open ``time_entries`` at startup and then kept current by the
+deltas of the event broker, so lookups never query the database. With the
+change stream every worker sees every tap; with in-process events a worker
+only sees its own, so the board is also re-warmed every ``refresh_interval``
+seconds in that mode. ``check`` compares the board with the stored entries
+(``storage.py``). Deltas that arrive while the entries are being read are
+replayed over what was read, so a warm or repair never drops a tap.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from events import status_since
+from timesheet import OPEN_STATUSES
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_PROJECTION = {"_id": 0, "id": 1, "employeeId": 1, "status": 1, "startTime": 1, "breaks": 1}
+
+
+class PresenceIndex:
+    def __init__(self, refresh_interval: float = 60.0):
+        self.refresh_interval = refresh_interval
+        self.warmed_at: Optional[datetime] = None
+        self._present: Dict[str, Dict[str, Any]] = {}
+        self._storage = None
+        self._refresher: Optional[asyncio.Task] = None
+        self._rewarm: Optional[asyncio.Task] = None
+        # Deltas applied during each load in flight
+        self._recordings: List[List[Dict[str, Any]]] = []
+
+    def __len__(self) -> int:
+        return len(self._present)
+
+    def get(self, employee_id: str) -> Optional[Dict[str, Any]]:
+        return self._present.get(employee_id)
+
+    def board(self) -> List[Dict[str, Any]]:
+        return [{"employeeId": employee_id, **state} for employee_id, state in self._present.items()]
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(OPEN_STATUSES, 0)
+        for state in self._present.values():
+            counts[state["status"]] += 1
+        return counts
+
+    async def _load(self, storage) -> Dict[str, Dict[str, Any]]:
+        """The board from the stored open entries, and the deltas applied since the read began."""
+        deltas: List[Dict[str, Any]] = []
+        self._recordings.append(deltas)
+        try:
+            entries = await storage.find_time_entries(statuses=OPEN_STATUSES, projection=PRESENCE_PROJECTION)
+        finally:
+            self._recordings.remove(deltas)
+        present = {
+            entry["employeeId"]: {"status": entry["status"], "since": status_since(entry), "entryId": entry["id"]}
+            for entry in entries
+        }
+        for event in deltas:
+            _fold(present, event)
+        return present
+
+    async def warm(self, storage) -> None:
+        self._storage = storage
+        self._present = await self._load(storage)
+        self.warmed_at = datetime.utcnow()
+        logger.debug("Presence index warmed with %d employees", len(self._present))
+
+    def apply(self, event: Dict[str, Any]) -> None:
+        """Broker listener: fold one delta into the board."""
+        if "entryId" not in event:
+            if event["type"] == "entry_deleted":
+                # Change stream deletes only carry the Mongo _id
+                self.schedule_rewarm()
+            return
+        _fold(self._present, event)
+        for deltas in self._recordings:
+            deltas.append(event)
+
+    def schedule_rewarm(self) -> None:
+        if self._storage is not None and (self._rewarm is None or self._rewarm.done()):
+            self._rewarm = asyncio.create_task(self.warm(self._storage))
+
+    async def check(self, storage, repair: bool = False) -> Dict[str, Any]:
+        """Differences between the board and the stored open entries."""
+        actual = await self._load(storage)
+        missing = sorted(set(actual) - set(self._present))
+        stale = sorted(set(self._present) - set(actual))
+        mismatched = sorted(
+            employee_id
+            for employee_id in set(actual) & set(self._present)
+            if actual[employee_id]["entryId"] != self._present[employee_id]["entryId"]
+            or actual[employee_id]["status"] != self._present[employee_id]["status"]
+        )
+        consistent = not (missing or stale or mismatched)
+        if repair and not consistent:
+            self._present = actual
+            self.warmed_at = datetime.utcnow()
+        return {
+            "consistent": consistent,
+            "missing": missing,
+            "stale": stale,
+            "mismatched": mismatched,
+            "repaired": repair and not consistent,
+        }
+
+    def start_refresher(self, storage) -> None:
+        self._refresher = asyncio.create_task(self._refresh(storage))
+
+    async def _refresh(self, storage) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.warm(storage)
+            except Exception:
+                logger.exception("Presence refresh failed")
+
+    async def stop(self) -> None:
+        for task in (self._refresher, self._rewarm):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+
+def _fold(present: Dict[str, Dict[str, Any]], event: Dict[str, Any]) -> None:
+    employee_id = event.get("employeeId")
+    if event.get("status") in OPEN_STATUSES:
+        present[employee_id] = {"status": event["status"], "since": event.get("since"), "entryId": event["entryId"]}
+    else:
+        current = present.get(employee_id)
+        if current and current["entryId"] == event["entryId"]:
+            del present[employee_id]
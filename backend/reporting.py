@@ -0,0 +1,191 @@
+"""Columnar timesheet reports computed with NumPy.
+
+The entries of a range are loaded once into flat arrays (start, end and
+break seconds plus the index of the employee) and every figure is then
+computed with whole-array passes instead of a Python loop per entry:
+
+* worked time is the clocked span minus closed breaks, for closed entries
+  only, as in ``timesheet.entry_seconds``;
+* overtime is counted per employee and UTC day, as the worked time beyond
+  the employee's schedule (``endTime - startTime - breakDuration``);
+* cost is worked hours times ``hourlyRate``.
+"""
+import warnings
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from timesheet import parse_timestamp
+
+REPORT_PROJECTION = {"_id": 0, "employeeId": 1, "startTime": 1, "endTime": 1, "breaks": 1}
+REPORT_EMPLOYEE_PROJECTION = {
+    "_id": 0, "id": 1, "name": 1, "position": 1,
+    "startTime": 1, "endTime": 1, "breakDuration": 1, "hourlyRate": 1,
+}
+
+DAY_SECONDS = 86400
+
+
+@dataclass
+class TimesheetColumns:
+    start: np.ndarray  # epoch seconds (float64)
+    end: np.ndarray  # epoch seconds, NaN while the entry is open
+    breaks: np.ndarray  # closed break seconds per entry
+    employee: np.ndarray  # index into employee_ids (int64)
+    employee_ids: List[str]
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+
+def to_epoch_seconds(values: List[Any]) -> np.ndarray:
+    """UTC epoch seconds for ISO strings or datetimes, NaN where missing."""
+    try:
+        with warnings.catch_warnings():
+            # NumPy only warns about offsets it would silently drop
+            warnings.simplefilter("error")
+            stamps = np.array(values, dtype="datetime64[us]")
+    except (ValueError, TypeError, UserWarning):
+        stamps = np.array([parse_timestamp(value) for value in values], dtype="datetime64[us]")
+    seconds = stamps.astype(np.int64) / 1e6
+    seconds[np.isnat(stamps)] = np.nan
+    return seconds
+
+
+class ColumnBuilder:
+    """Accumulates entries row by row and converts them to columns once."""
+
+    def __init__(self):
+        self.employee_ids: List[str] = []
+        self._employee_index: Dict[str, int] = {}
+        self._starts: List[Any] = []
+        self._ends: List[Any] = []
+        self._owners: List[int] = []
+        self._break_starts: List[Any] = []
+        self._break_ends: List[Any] = []
+        self._break_owners: List[int] = []
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        employee_id = entry["employeeId"]
+        owner = self._employee_index.get(employee_id)
+        if owner is None:
+            owner = self._employee_index[employee_id] = len(self.employee_ids)
+            self.employee_ids.append(employee_id)
+        row = len(self._starts)
+        self._starts.append(entry["startTime"])
+        self._ends.append(entry.get("endTime"))
+        self._owners.append(owner)
+        for item in entry.get("breaks") or []:
+            self._break_starts.append(item.get("startTime"))
+            self._break_ends.append(item.get("endTime"))
+            self._break_owners.append(row)
+
+    def build(self) -> TimesheetColumns:
+        rows = len(self._starts)
+        spans = to_epoch_seconds(self._break_ends) - to_epoch_seconds(self._break_starts)
+        # Open and negative breaks count for nothing, as in timesheet.break_seconds
+        spans = np.where(spans > 0, spans, 0.0)
+        return TimesheetColumns(
+            start=to_epoch_seconds(self._starts),
+            end=to_epoch_seconds(self._ends),
+            breaks=np.bincount(
+                np.asarray(self._break_owners, dtype=np.int64), weights=spans, minlength=rows
+            ),
+            employee=np.asarray(self._owners, dtype=np.int64),
+            employee_ids=self.employee_ids,
+        )
+
+
+def columns_from_entries(entries: Iterable[Dict[str, Any]]) -> TimesheetColumns:
+    builder = ColumnBuilder()
+    for entry in entries:
+        builder.add(entry)
+    return builder.build()
+
+
+async def load_columns(cursor: AsyncIterable[Dict[str, Any]]) -> TimesheetColumns:
+    builder = ColumnBuilder()
+    async for entry in cursor:
+        builder.add(entry)
+    return builder.build()
+
+
+def _minutes(value: Any) -> Optional[int]:
+    try:
+        hours, minutes = str(value).split(":")
+        return int(hours) * 60 + int(minutes)
+    except ValueError:
+        return None
+
+
+def scheduled_seconds(employee: Dict[str, Any]) -> float:
+    """Planned daily work net of the break, NaN when the schedule is unusable."""
+    start = _minutes(employee.get("startTime"))
+    end = _minutes(employee.get("endTime"))
+    if start is None or end is None:
+        return float("nan")
+    span = end - start if end > start else end - start + 24 * 60  # overnight shift
+    return max(0, span - (employee.get("breakDuration") or 0)) * 60.0
+
+
+def compute_report(columns: TimesheetColumns, employees: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-employee totals and grand totals for the loaded entries."""
+    count = len(columns.employee_ids)
+    profiles = [employees.get(employee_id, {}) for employee_id in columns.employee_ids]
+    rates = np.array([profile.get("hourlyRate") or 0.0 for profile in profiles], dtype=np.float64)
+    schedules = np.array([scheduled_seconds(profile) for profile in profiles], dtype=np.float64)
+
+    closed = ~np.isnan(columns.end)
+    with np.errstate(invalid="ignore"):
+        span = np.where(closed, np.maximum(columns.end - columns.start, 0.0), 0.0)
+    worked = np.maximum(span - columns.breaks, 0.0) * closed
+
+    # One cell per employee and UTC day the employee started an entry on
+    day = (columns.start // DAY_SECONDS).astype(np.int64)
+    first_day = day.min() if len(day) else 0
+    days = int(day.max() - first_day + 1) if len(day) else 1
+    cells, cell_of_entry = np.unique(columns.employee * days + (day - first_day), return_inverse=True)
+    cell_employee = cells // days
+    cell_worked = np.bincount(cell_of_entry, weights=worked, minlength=len(cells))
+    with np.errstate(invalid="ignore"):
+        cell_overtime = np.maximum(cell_worked - schedules[cell_employee], 0.0)
+    cell_overtime = np.nan_to_num(cell_overtime)
+
+    worked_seconds = np.bincount(columns.employee, weights=worked, minlength=count)
+    break_seconds = np.bincount(columns.employee, weights=columns.breaks, minlength=count)
+    overtime_seconds = np.bincount(cell_employee, weights=cell_overtime, minlength=count)
+    entry_counts = np.bincount(columns.employee, minlength=count)
+    open_counts = np.bincount(columns.employee, weights=~closed, minlength=count)
+    days_worked = np.bincount(cell_employee, minlength=count)
+    worked_hours = worked_seconds / 3600
+    costs = worked_hours * rates
+
+    rows = []
+    for index, employee_id in enumerate(columns.employee_ids):
+        profile = profiles[index]
+        rows.append({
+            "employeeId": employee_id,
+            "name": profile.get("name", "Unknown"),
+            "position": profile.get("position", ""),
+            "entries": int(entry_counts[index]),
+            "openEntries": int(open_counts[index]),
+            "daysWorked": int(days_worked[index]),
+            "workedHours": round(float(worked_hours[index]), 2),
+            "breakHours": round(float(break_seconds[index] / 3600), 2),
+            "overtimeHours": round(float(overtime_seconds[index] / 3600), 2),
+            "hourlyRate": float(rates[index]),
+            "cost": round(float(costs[index]), 2),
+        })
+    rows.sort(key=lambda row: row["name"])
+
+    return {
+        "employees": rows,
+        "totals": {
+            "entries": len(columns),
+            "workedHours": round(float(worked_seconds.sum() / 3600), 2),
+            "breakHours": round(float(break_seconds.sum() / 3600), 2),
+            "overtimeHours": round(float(overtime_seconds.sum() / 3600), 2),
+            "cost": round(float(costs.sum()), 2),
+        },
+    }
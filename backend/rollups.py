@@ -0,0 +1,391 @@
+"""Maintained ``daily_rollups`` collection backing ``/api/stats``.
+
+One document per employee and UTC day (the day an entry started on)::
+
+    {"_id": "<employeeId>:<YYYY-MM-DD>", "employeeId": ..., "day": ...,
+     "workedSeconds": ..., "breakSeconds": ..., "elapsedSeconds": ..., "entryCount": ...}
+
+``elapsedSeconds`` is the clocked span of the closed entries, breaks
+included: the dashboard's weekly hours.
+
+Every mutation of a time entry hands its before/after images to
+``apply_entry_change`` which turns the difference into ``$inc`` upserts, so
+the rollups never need a full recomputation. ``python rollups.py`` rebuilds
+them from ``time_entries`` for backfills or after manual edits, with an
+aggregation pipeline on the server when it supports ``$dateDiff``
+(MongoDB 5.0+), in Python otherwise. The rebuilt rollups go to a scratch
+collection, renamed over ``daily_rollups`` once complete, so ``/api/stats``
+never reads a range emptied for the rebuild and ``$inc`` updates racing it
+can't be replaced by a stale merge. Changes written while the rebuild
+reads the entries are still missed: rebuild when the kiosks are quiet, or
+again with ``--since``.
+
+``read_week_stats`` folds a range of rollups into the dashboard figures with
+a single ``$facet`` pipeline, so only the result document is transferred.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import date
+from pathlib import Path
+from typing import Any, AsyncIterable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, IndexModel, InsertOne, UpdateOne
+from pymongo.errors import OperationFailure
+
+from timesheet import entry_day, entry_seconds, timestamp_range
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "daily_rollups"
+# Where rebuild_rollups builds the new rollups before swapping them in
+ROLLUP_REBUILD_COLLECTION = "daily_rollups_rebuild"
+ROLLUP_INDEXES = [
+    IndexModel([("day", ASCENDING), ("employeeId", ASCENDING)], name="day_employee"),
+]
+ROLLUP_FIELDS = ("workedSeconds", "breakSeconds", "elapsedSeconds", "entryCount")
+TOP_EMPLOYEES = 5
+
+
+def rollup_id(employee_id: str, day: str) -> str:
+    return f"{employee_id}:{day}"
+
+
+def entry_contribution(entry: Optional[Dict[str, Any]]) -> Dict[Tuple[str, str], Dict[str, float]]:
+    """What a single time entry adds to the rollups, keyed by (employeeId, day)."""
+    if not entry:
+        return {}
+    worked, breaks = entry_seconds(entry)
+    return {
+        (entry["employeeId"], entry_day(entry)): {
+            "workedSeconds": worked,
+            "breakSeconds": breaks,
+            "elapsedSeconds": worked + breaks if entry.get("endTime") else 0.0,
+            "entryCount": 1,
+        }
+    }
+
+
+def rollup_updates(
+    before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]
+) -> List[UpdateOne]:
+    """Upserts moving the rollups from the ``before`` to the ``after`` image.
+
+    ``before`` is ``None`` for inserts and ``after`` is ``None`` for deletes.
+    An entry whose start day or employee changed is removed from the old
+    bucket and added to the new one.
+    """
+    deltas: Dict[Tuple[str, str], Dict[str, float]] = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+    for key, values in entry_contribution(before).items():
+        for field in ROLLUP_FIELDS:
+            deltas[key][field] -= values[field]
+    for key, values in entry_contribution(after).items():
+        for field in ROLLUP_FIELDS:
+            deltas[key][field] += values[field]
+
+    operations = []
+    for (employee_id, day), values in deltas.items():
+        increments = {field: round(value, 3) for field, value in values.items() if round(value, 3)}
+        if not increments:
+            continue
+        operations.append(UpdateOne(
+            {"_id": rollup_id(employee_id, day)},
+            {"$inc": increments, "$setOnInsert": {"employeeId": employee_id, "day": day}},
+            upsert=True,
+        ))
+    return operations
+
+
+async def apply_entry_change(db, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> None:
+    """Fold one time entry mutation into the rollups."""
+    operations = rollup_updates(before, after)
+    if operations:
+        await db[ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def read_rollups(db, start_day: date, end_day: date) -> List[Dict[str, Any]]:
+    """All non-empty rollups between two days (inclusive)."""
+    return await db[ROLLUP_COLLECTION].find(
+        {"day": {"$gte": start_day.isoformat(), "$lte": end_day.isoformat()}, "entryCount": {"$gt": 0}},
+        {"_id": 0},
+    ).to_list(None)
+
+
+def week_stats_pipeline(start_day: date, end_day: date, top: int = TOP_EMPLOYEES) -> List[Dict[str, Any]]:
+    """Totals, top employees and per-day figures of a range of rollups.
+
+    Hours are the elapsed time of closed entries, breaks included, as the
+    dashboard has always shown them.
+    """
+    return [
+        {"$match": {
+            "day": {"$gte": start_day.isoformat(), "$lte": end_day.isoformat()},
+            "entryCount": {"$gt": 0},
+        }},
+        {"$project": {
+            "_id": 0,
+            "employeeId": 1,
+            "day": 1,
+            "hours": {"$divide": [{"$ifNull": ["$elapsedSeconds", 0]}, 3600]},
+        }},
+        {"$facet": {
+            "totals": [
+                {"$group": {"_id": None, "hours": {"$sum": "$hours"}, "employees": {"$addToSet": "$employeeId"}}},
+                {"$project": {"_id": 0, "hours": 1, "employees": {"$size": "$employees"}}},
+            ],
+            "topEmployees": [
+                {"$group": {"_id": "$employeeId", "hours": {"$sum": "$hours"}}},
+                {"$sort": {"hours": -1, "_id": 1}},
+                {"$limit": top},
+                {"$lookup": {
+                    "from": "employees",
+                    "localField": "_id",
+                    "foreignField": "id",
+                    "pipeline": [{"$project": {"_id": 0, "name": 1}}],
+                    "as": "employee",
+                }},
+                {"$project": {
+                    "_id": 0,
+                    "id": "$_id",
+                    "name": {"$ifNull": [{"$first": "$employee.name"}, "Unknown"]},
+                    "hours": 1,
+                }},
+            ],
+            # One rollup per employee and day, so the count is the distinct employees
+            "daily": [
+                {"$group": {"_id": "$day", "hours": {"$sum": "$hours"}, "employees": {"$sum": 1}}},
+                {"$project": {"_id": 0, "date": "$_id", "hours": 1, "employees": 1}},
+            ],
+        }},
+    ]
+
+
+async def read_week_stats(db, start_day: date, end_day: date) -> Dict[str, Any]:
+    """``{"hours", "employees", "topEmployees", "daily"}`` for a range of days, in one round trip."""
+    result = await db[ROLLUP_COLLECTION].aggregate(week_stats_pipeline(start_day, end_day)).to_list(None)
+    facets = result[0]
+    totals = facets["totals"][0] if facets["totals"] else {"hours": 0.0, "employees": 0}
+    return {
+        "hours": totals["hours"],
+        "employees": totals["employees"],
+        "topEmployees": facets["topEmployees"],
+        "daily": {day["date"]: day for day in facets["daily"]},
+    }
+
+
+async def rollups_from_entries(entries: AsyncIterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Rollup documents summed from the entries themselves, for stores without ``daily_rollups``."""
+    totals: Dict[Tuple[str, str], Dict[str, float]] = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+    async for entry in entries:
+        for key, values in entry_contribution(entry).items():
+            for field in ROLLUP_FIELDS:
+                totals[key][field] += values[field]
+    return [
+        {"employeeId": employee_id, "day": day, **{k: round(v, 3) for k, v in values.items()}}
+        for (employee_id, day), values in totals.items()
+    ]
+
+
+def fold_week_stats(
+    rollups: Iterable[Dict[str, Any]], start_day: date, end_day: date, names: Dict[str, str],
+    top: int = TOP_EMPLOYEES,
+) -> Dict[str, Any]:
+    """``read_week_stats`` in Python, over rollups held in memory; ``names`` maps employee ids to names."""
+    employee_hours: Dict[str, float] = defaultdict(float)
+    daily: Dict[str, Dict[str, Any]] = {}
+    for rollup in rollups:
+        if not (start_day.isoformat() <= rollup["day"] <= end_day.isoformat()) or rollup["entryCount"] <= 0:
+            continue
+        hours = rollup.get("elapsedSeconds", 0) / 3600
+        employee_hours[rollup["employeeId"]] += hours
+        day = daily.setdefault(rollup["day"], {"date": rollup["day"], "hours": 0.0, "employees": 0})
+        day["hours"] += hours
+        day["employees"] += 1
+    ranked = sorted(employee_hours.items(), key=lambda item: (-item[1], item[0]))[:top]
+    return {
+        "hours": sum(employee_hours.values()),
+        "employees": len(employee_hours),
+        "topEmployees": [
+            {"id": employee_id, "name": names.get(employee_id, "Unknown"), "hours": hours}
+            for employee_id, hours in ranked
+        ],
+        "daily": daily,
+    }
+
+
+def as_date(expression: Any) -> Dict[str, Any]:
+    """Aggregation expression turning a BSON date or an ISO string into a date.
+
+    Python writes six fractional digits, which are cut to the milliseconds a
+    BSON date keeps; offsets are honoured. Missing values and strings that do
+    not parse become null.
+    """
+    return {"$cond": [
+        {"$eq": [{"$type": expression}, "string"]},
+        {"$dateFromString": {
+            "dateString": {"$cond": [
+                {"$regexMatch": {"input": expression, "regex": r"^.{19}\.\d{6}"}},
+                {"$concat": [{"$substrCP": [expression, 0, 23]}, {"$substrCP": [expression, 26, 32]}]},
+                expression,
+            ]},
+            "onError": None,
+        }},
+        {"$ifNull": [expression, None]},
+    ]}
+
+
+def _seconds_between(start: Any, end: Any) -> Dict[str, Any]:
+    return {"$divide": [{"$dateDiff": {"startDate": start, "endDate": end, "unit": "millisecond"}}, 1000]}
+
+
+def rollup_pipeline(since: Optional[date] = None, into: str = ROLLUP_COLLECTION) -> List[Dict[str, Any]]:
+    """Server-side equivalent of ``entry_contribution`` summed per bucket and merged into ``into``."""
+    closed_break = {"$and": [
+        {"$ne": ["$$item.startTime", None]},
+        {"$ne": ["$$item.endTime", None]},
+        {"$gt": ["$$item.endTime", "$$item.startTime"]},
+    ]}
+    return [
+        {"$match": timestamp_range("startTime", since.isoformat()) if since else {}},
+        {"$project": {
+            "_id": 0,
+            "employeeId": 1,
+            "start": as_date("$startTime"),
+            "end": as_date("$endTime"),
+            "breaks": {"$map": {
+                "input": {"$ifNull": ["$breaks", []]},
+                "as": "item",
+                "in": {"startTime": as_date("$$item.startTime"), "endTime": as_date("$$item.endTime")},
+            }},
+        }},
+        {"$match": {"start": {"$ne": None}}},
+        {"$addFields": {
+            "breakSeconds": {"$sum": {"$map": {
+                "input": "$breaks",
+                "as": "item",
+                "in": {"$cond": [closed_break, _seconds_between("$$item.startTime", "$$item.endTime"), 0]},
+            }}},
+        }},
+        {"$project": {
+            "employeeId": 1,
+            "breakSeconds": 1,
+            "closed": {"$ne": ["$end", None]},
+            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$start"}},
+            # Worked time only counts once the entry is closed
+            "workedSeconds": {"$cond": [
+                {"$ne": ["$end", None]},
+                {"$max": [0, {"$subtract": [
+                    {"$max": [0, _seconds_between("$start", "$end")]}, "$breakSeconds"
+                ]}]},
+                0,
+            ]},
+        }},
+        {"$group": {
+            "_id": {"employeeId": "$employeeId", "day": "$day"},
+            "workedSeconds": {"$sum": "$workedSeconds"},
+            "breakSeconds": {"$sum": "$breakSeconds"},
+            "elapsedSeconds": {"$sum": {"$cond": [
+                "$closed", {"$add": ["$workedSeconds", "$breakSeconds"]}, 0
+            ]}},
+            "entryCount": {"$sum": 1},
+        }},
+        {"$project": {
+            "_id": {"$concat": ["$_id.employeeId", ":", "$_id.day"]},
+            "employeeId": "$_id.employeeId",
+            "day": "$_id.day",
+            "workedSeconds": {"$round": ["$workedSeconds", 3]},
+            "breakSeconds": {"$round": ["$breakSeconds", 3]},
+            "elapsedSeconds": {"$round": ["$elapsedSeconds", 3]},
+            "entryCount": 1,
+        }},
+        {"$merge": {"into": into, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+async def rebuild_rollups(db, since: Optional[date] = None, batch_size: int = 1000) -> int:
+    """Recompute the rollups from ``time_entries``, optionally from a day on.
+
+    Returns the number of rollup documents written.
+    """
+    scratch = db[ROLLUP_REBUILD_COLLECTION]
+    await scratch.drop()
+    if since:
+        # The days before ``since`` are kept as they are
+        batch: List[InsertOne] = []
+        async for rollup in db[ROLLUP_COLLECTION].find({"day": {"$lt": since.isoformat()}}).batch_size(batch_size):
+            batch.append(InsertOne(rollup))
+            if len(batch) >= batch_size:
+                await scratch.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            await scratch.bulk_write(batch, ordered=False)
+    try:
+        await db.time_entries.aggregate(rollup_pipeline(since, into=ROLLUP_REBUILD_COLLECTION)).to_list(None)
+        written = await scratch.count_documents({"day": {"$gte": since.isoformat()}} if since else {})
+    except OperationFailure as exc:
+        logger.info("Server-side rebuild unavailable (%s); rebuilding in Python", exc)
+        written = await _rebuild_in_python(db, since, batch_size, into=ROLLUP_REBUILD_COLLECTION)
+    await scratch.create_indexes(ROLLUP_INDEXES)
+    await scratch.rename(ROLLUP_COLLECTION, dropTarget=True)
+    return written
+
+
+async def _rebuild_in_python(
+    db, since: Optional[date], batch_size: int, into: str = ROLLUP_COLLECTION
+) -> int:
+    entry_filter: Dict[str, Any] = timestamp_range("startTime", since.isoformat()) if since else {}
+    totals: Dict[Tuple[str, str], Dict[str, float]] = defaultdict(lambda: dict.fromkeys(ROLLUP_FIELDS, 0))
+    cursor = db.time_entries.find(
+        entry_filter, {"_id": 0, "employeeId": 1, "startTime": 1, "endTime": 1, "breaks": 1}
+    ).batch_size(batch_size)
+    async for entry in cursor:
+        for key, values in entry_contribution(entry).items():
+            for field in ROLLUP_FIELDS:
+                totals[key][field] += values[field]
+
+    operations = [
+        InsertOne({
+            "_id": rollup_id(employee_id, day),
+            "employeeId": employee_id,
+            "day": day,
+            **{k: round(v, 3) for k, v in values.items()},
+        })
+        for (employee_id, day), values in totals.items()
+    ]
+    for i in range(0, len(operations), batch_size):
+        await db[into].bulk_write(operations[i:i + batch_size], ordered=False)
+    return len(operations)
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from period_stats import STATS_CACHE
+
+    parser = argparse.ArgumentParser(description="Rebuild the daily_rollups collection from time_entries.")
+    parser.add_argument("--since", type=date.fromisoformat, help="only rebuild days from this date (YYYY-MM-DD)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def run():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            db = client[os.environ['DB_NAME']]
+            written = await rebuild_rollups(db, args.since, args.batch_size)
+            logger.info("Rebuilt %d daily rollups", written)
+            # Day summaries cached from the old rollups (see period_stats.py)
+            await db[STATS_CACHE].delete_many({"day": {"$gte": args.since.isoformat()}} if args.since else {})
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
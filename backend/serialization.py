@@ -0,0 +1,61 @@
+"""JSON encoding of API responses, with orjson when it is installed.
+
+``FastJSONResponse`` serves documents read with ``response_projection`` as
+they come from Mongo, skipping the per-document Pydantic instances and
+FastAPI's re-validation of the response model. The projection limits the
+read to the fields of the model; documents written before a field existed
+get the model's defaults (``model_defaults``) before encoding, so the
+output has the same shape.
+"""
+from datetime import datetime
+from typing import Any, Dict, Type
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # falls back to the stdlib encoder
+    orjson = None
+
+ORJSON_AVAILABLE = orjson is not None
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(value: Any) -> bytes:
+        # orjson writes naive datetimes as isoformat() does
+        return orjson.dumps(value, default=json_default)
+else:
+    import json
+
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, default=json_default).encode('utf-8')
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def response_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """Mongo projection returning exactly the fields of ``model``."""
+    fields = getattr(model, "model_fields", None) or model.__fields__
+    return {"_id": 0, **{name: 1 for name in fields}}
+
+
+def model_defaults(model: Type[BaseModel]) -> Dict[str, Any]:
+    """The values ``model`` gives its optional fields when they are missing."""
+    if hasattr(model, "model_fields"):
+        return {
+            name: field.get_default(call_default_factory=True)
+            for name, field in model.model_fields.items() if not field.is_required()
+        }
+    return {name: field.get_default() for name, field in model.__fields__.items() if not field.required}
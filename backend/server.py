@@ -1,23 +1,139 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
+import base64
+import hashlib
+import hmac
+import tempfile
+import json
 import logging
+from functools import partial
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import Iterable, List, Optional, Dict, Any, Literal, Tuple, Union
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+from clock_batch import apply_clock_plan, plan_clock_events
+from db_monitoring import CommandLatencyMonitor, PoolMonitor
+from event_store import SnapshotScheduler, append_events, undo_changes
+from events import EventBroker, employee_delta, entry_delta
+from exports import EMPLOYEE_PROJECTION, EXPORT_PROJECTION, XLSX_AVAILABLE, csv_chunks, write_xlsx
+from indexes import OPEN_ENTRY_INDEX, close_duplicate_open_entries, ensure_indexes
+from journal import TapJournal
+from metrics import REGISTRY, MetricsMiddleware, clock_events, sync_batches, sync_operations
+from presence import PresenceIndex
+from period_stats import DailyStatsCache, group_summaries, range_days, range_stats, summarise_rollups
+from rollups import apply_entry_change, entry_contribution, fold_week_stats, read_week_stats, rollups_from_entries
+from serialization import FastJSONResponse, dumps, json_default, model_defaults, response_projection
+from storage import STORAGE_ERRORS, DuplicateOpenEntry, MongoStorage, SQLiteStorage
+from sync import ingest
+from timesheet import OPEN_STATUSES, storage_times, to_storage, utc_now
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection. Pool options are only passed when set, so the driver
+# defaults (100 connections, primary reads) apply otherwise.
+MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': ('MONGO_MAX_POOL_SIZE', int),
+    'minPoolSize': ('MONGO_MIN_POOL_SIZE', int),
+    'maxIdleTimeMS': ('MONGO_MAX_IDLE_TIME_MS', int),
+    'waitQueueTimeoutMS': ('MONGO_WAIT_QUEUE_TIMEOUT_MS', int),
+    'connectTimeoutMS': ('MONGO_CONNECT_TIMEOUT_MS', int),
+    'socketTimeoutMS': ('MONGO_SOCKET_TIMEOUT_MS', int),
+    'serverSelectionTimeoutMS': ('MONGO_SERVER_SELECTION_TIMEOUT_MS', int),
+    'readPreference': ('MONGO_READ_PREFERENCE', str),
+}
+mongo_options = {
+    option: convert(os.environ[variable])
+    for option, (variable, convert) in MONGO_CLIENT_OPTIONS.items()
+    if os.environ.get(variable)
+}
+command_monitor = CommandLatencyMonitor()
+pool_monitor = PoolMonitor(max_pool_size=mongo_options.get('maxPoolSize', 100))
+REGISTRY.register(command_monitor.durations)
+REGISTRY.register(command_monitor.failures)
+
+# Also match time entries still storing ISO strings; turn off once
+# migrate_timestamps.py has converted every collection
+LEGACY_STRING_TIMESTAMPS = os.environ.get('LEGACY_STRING_TIMESTAMPS', 'true').lower() == 'true'
+
+# Employees, time entries and settings live in MongoDB, or in an embedded
+# SQLite file for single-site installs (see storage.py). Rollups, stats,
+# batched clock events and offline sync need MongoDB.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo').lower()
+if STORAGE_BACKEND == 'sqlite':
+    client = None
+    db = None
+    storage = SQLiteStorage(
+        os.environ.get('SQLITE_PATH', str(ROOT_DIR / 'timetracker.sqlite3')),
+        readers=int(os.environ.get('SQLITE_READERS', '4'))
+    )
+else:
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[command_monitor, pool_monitor], **mongo_options)
+    db = client[os.environ['DB_NAME']]
+    storage = MongoStorage(db, legacy_strings=LEGACY_STRING_TIMESTAMPS)
+
+# In-process caches for the read-dominated kiosk traffic
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '30'))
+settings_cache = TTLCache(ttl=CACHE_TTL_SECONDS, maxsize=1)
+roster_cache = TTLCache(ttl=CACHE_TTL_SECONDS, maxsize=1)
+# Rendered JSON bodies keyed by (resource, version), for conditional GETs
+rendered_cache = TTLCache(ttl=CACHE_TTL_SECONDS, maxsize=8)
+
+# bcrypt takes ~250 ms per call; run it on a small dedicated pool so it never
+# blocks the event loop, and remember recent successful admin logins
+bcrypt_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('BCRYPT_WORKERS', '2')),
+    thread_name_prefix="bcrypt"
+)
+verified_credentials = TTLCache(ttl=float(os.environ.get('CREDENTIAL_CACHE_TTL_SECONDS', '60')), maxsize=64)
+# Per-process key so cached digests are useless outside this worker
+CREDENTIAL_CACHE_KEY = os.urandom(32)
+
+# Clock state deltas for /api/events subscribers
+broker = EventBroker(queue_size=int(os.environ.get('EVENT_QUEUE_SIZE', '256')))
+
+# Who is clocked in right now, kept current from the broker deltas
+presence = PresenceIndex(refresh_interval=float(os.environ.get('PRESENCE_REFRESH_SECONDS', '60')))
+broker.add_listener(presence.apply)
+
+# Per-day summaries behind the ranged /api/stats (see period_stats.py)
+period_cache = DailyStatsCache(ttl=float(os.environ.get('STATS_CACHE_TTL_SECONDS', '300')))
+
+# Snapshots of the clock_events log, so rebuilding an employee's entries
+# only reads the events since (see event_store.py)
+snapshots = SnapshotScheduler(
+    interval=float(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', '3600')),
+    min_events=int(os.environ.get('SNAPSHOT_MIN_EVENTS', '100'))
+)
+
+# Serve list endpoints straight from projected documents, without building
+# and re-validating a Pydantic model per document (see serialization.py)
+FAST_RESPONSES = os.environ.get('FAST_RESPONSES', 'false').lower() == 'true'
+
+# Acknowledge kiosk taps once they are in a local fsync'd journal and apply
+# them to MongoDB in the background (see journal.py). Off unless set.
+TAP_JOURNAL_DIR = os.environ.get('TAP_JOURNAL_DIR', '')
+tap_journal = TapJournal(
+    TAP_JOURNAL_DIR,
+    batch_size=int(os.environ.get('TAP_JOURNAL_BATCH_SIZE', '500')),
+    commit_delay=float(os.environ.get('TAP_JOURNAL_COMMIT_DELAY_MS', '0')) / 1000
+) if TAP_JOURNAL_DIR and db is not None else None
+
+# Versions of the polled resources, bumped by every endpoint mutating them
+resource_versions = {"employees": 0, "settings": 0}
+resource_caches = {"employees": roster_cache, "settings": settings_cache}
 
 # Create the main app
 app = FastAPI(title="TimeTracker API", version="1.0.0")
@@ -38,6 +154,20 @@ class Employee(BaseModel):
     isActive: bool = True
     createdAt: datetime = Field(default_factory=datetime.utcnow)
 
+EMPLOYEE_FIELDS = [name for name in response_projection(Employee) if name != "_id"]
+
+def employee_documents(employees: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # What Employee(**employee) would encode, for FastJSONResponse: missing
+    # fields defaulted, an ISO string createdAt parsed like a date
+    defaults = model_defaults(Employee)
+    documents = []
+    for employee in employees:
+        employee = {**defaults, **employee}
+        if isinstance(employee["createdAt"], str):
+            employee["createdAt"] = to_storage(employee["createdAt"])
+        documents.append({name: employee[name] for name in EMPLOYEE_FIELDS})
+    return documents
+
 class EmployeeCreate(BaseModel):
     name: str
     position: str
@@ -57,30 +187,50 @@ class EmployeeUpdate(BaseModel):
     hourlyRate: Optional[float] = None
     isActive: Optional[bool] = None
 
+# Timestamps are stored as naive UTC dates (see timesheet.py); requests may
+# send ISO strings with or without an offset.
 class Break(BaseModel):
-    startTime: str
-    endTime: Optional[str] = None
+    startTime: datetime
+    endTime: Optional[datetime] = None
 
 class TimeEntry(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     employeeId: str
-    startTime: str
-    endTime: Optional[str] = None
+    startTime: datetime
+    endTime: Optional[datetime] = None
     breaks: List[Break] = []
     status: str = "active"  # active, on_break, completed
     notes: Optional[str] = None
     createdAt: datetime = Field(default_factory=datetime.utcnow)
 
+TIME_ENTRY_PROJECTION = response_projection(TimeEntry)
+TIME_ENTRY_TIMES = ("startTime", "endTime", "createdAt")
+
+def time_entry_documents(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # What TimeEntry(**entry) would encode, for FastJSONResponse: missing
+    # fields defaulted, ISO strings not migrated yet parsed like dates
+    defaults = model_defaults(TimeEntry)
+    documents = []
+    for entry in entries:
+        entry = {**defaults, **entry}
+        breaks = entry["breaks"] or []
+        if any(isinstance(entry[name], str) for name in TIME_ENTRY_TIMES) or any(
+            isinstance(value, str) for item in breaks for value in (item.get("startTime"), item.get("endTime"))
+        ):
+            entry = {**storage_times(entry), "createdAt": to_storage(entry["createdAt"])}
+        documents.append(entry)
+    return documents
+
 class TimeEntryCreate(BaseModel):
     employeeId: str
-    startTime: str
-    endTime: Optional[str] = None
+    startTime: datetime
+    endTime: Optional[datetime] = None
     breaks: List[Break] = []
     status: str = "active"
     notes: Optional[str] = None
 
 class TimeEntryUpdate(BaseModel):
-    endTime: Optional[str] = None
+    endTime: Optional[datetime] = None
     breaks: Optional[List[Break]] = None
     status: Optional[str] = None
     notes: Optional[str] = None
@@ -106,10 +256,65 @@ class StatsResponse(BaseModel):
     weeklyHours: float
     activeEmployees: int
     totalEmployees: int
+    weekEmployees: int = 0  # distinct employees with time this week
     overtimeHours: float
     topEmployees: List[Dict[str, Any]]
     dailyBreakdown: List[Dict[str, Any]]
 
+class TimesheetReportRow(BaseModel):
+    employeeId: str
+    name: str
+    position: str
+    entries: int
+    openEntries: int
+    daysWorked: int
+    workedHours: float
+    breakHours: float
+    overtimeHours: float
+    hourlyRate: float
+    cost: float
+
+class TimesheetReport(BaseModel):
+    employees: List[TimesheetReportRow]
+    totals: Dict[str, Any]
+
+class PeriodStats(BaseModel):
+    period: str
+    start: str
+    end: str
+    hours: float
+    workedHours: float
+    breakHours: float
+    entries: int
+    employees: int
+
+class RangeStatsResponse(BaseModel):
+    from_: str = Field(alias="from")
+    to: str
+    groupBy: str
+    employeeId: Optional[str] = None
+    periods: List[PeriodStats]
+    totals: Dict[str, Any]
+
+class ClockEvent(BaseModel):
+    employeeId: str
+    action: Literal["clock_in", "clock_out", "start_break", "end_break"]
+    timestamp: Optional[str] = None  # defaults to the time the batch is received
+
+class ClockEventBatch(BaseModel):
+    events: List[ClockEvent]
+
+class SyncOperation(ClockEvent):
+    key: str  # client-generated idempotency key
+
+class SyncRequest(BaseModel):
+    deviceId: Optional[str] = None
+    operations: List[SyncOperation]
+
+class TimeEntryPage(BaseModel):
+    items: List[TimeEntry]
+    next_cursor: Optional[str] = None
+
 # Utility functions
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -120,39 +325,224 @@ def verify_password(password: str, hashed: str) -> bool:
     except:
         return False
 
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(bcrypt_executor, hash_password, password)
+
+async def check_password(password: str, hashed: str) -> bool:
+    # Keyed on the stored hash too, so a password change invalidates the entry.
+    # Only successes are cached: wrong guesses always pay the full bcrypt cost.
+    key = hmac.new(
+        CREDENTIAL_CACHE_KEY,
+        hashed.encode('utf-8') + b"\0" + password.encode('utf-8'),
+        hashlib.sha256
+    ).digest()
+    if verified_credentials.get(key):
+        return True
+    loop = asyncio.get_running_loop()
+    verified = await loop.run_in_executor(bcrypt_executor, verify_password, password, hashed)
+    if verified:
+        verified_credentials.set(key, True)
+    return verified
+
 async def get_or_create_settings():
-    settings = await db.settings.find_one({"_id": "default"})
+    return await settings_cache.get_or_load("default", load_or_create_settings)
+
+async def load_or_create_settings():
+    settings = await storage.get_settings()
     if not settings:
         default_settings = {
-            "_id": "default",
-            "adminPassword": hash_password("admin123"),
+            "adminPassword": await hash_password_async("admin123"),
             "workingHours": {"start": "08:00", "end": "17:00"},
             "breakDuration": 30,
             "companyName": "TimeTracker24",
             "currency": "EUR"
         }
-        await db.settings.insert_one(default_settings)
+        await storage.insert_settings(default_settings)
         return default_settings
     return settings
 
+async def get_active_roster() -> Dict[str, Dict[str, Any]]:
+    # Active employees by id, in insertion order
+    return await roster_cache.get_or_load("active", load_active_roster)
+
+async def load_active_roster() -> Dict[str, Dict[str, Any]]:
+    employees = await storage.list_employees()
+    return {employee["id"]: employee for employee in employees}
+
+async def get_active_employee(employee_id: str) -> Optional[Dict[str, Any]]:
+    roster = await get_active_roster()
+    if employee_id in roster:
+        return roster[employee_id]
+    # Not cached yet, e.g. created on another worker within the TTL
+    return await storage.get_employee(employee_id)
+
+def encode_cursor(entry: Dict[str, Any]) -> str:
+    # Opaque keyset position: the (startTime, id) of the last entry returned,
+    # flagged when the start time is a date rather than a legacy string
+    start_time = entry["startTime"]
+    if isinstance(start_time, datetime):
+        position = [start_time.isoformat(), entry["id"], "date"]
+    else:
+        position = [start_time, entry["id"]]
+    raw = json.dumps(position).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor: str):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        start_time, entry_id = position[:2]
+        if position[2:] == ["date"]:
+            start_time = datetime.fromisoformat(start_time)
+    except (ValueError, TypeError, IndexError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return start_time, entry_id
+
+def time_entry_query(
+    employee_id: Optional[str],
+    start_date: Optional[str],
+    end_date: Optional[str],
+    status: Optional[str]
+) -> Dict[str, Any]:
+    # Keyword arguments of the storage time entry queries
+    for bound in (start_date, end_date):
+        try:
+            to_storage(bound)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date")
+    
+    return {
+        "employee_id": employee_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "statuses": [status] if status else None
+    }
+
+async def ndjson_lines(cursor, chunk_size: int = 500):
+    # Yield documents as they arrive from Mongo, a few hundred lines per chunk
+    lines = []
+    async for document in cursor:
+        lines.append(dumps(document))
+        if len(lines) >= chunk_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+def bump_version(resource: str) -> None:
+    resource_versions[resource] += 1
+    resource_caches[resource].invalidate()
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as for GET requests
+    candidates = {tag.strip().replace("W/", "", 1) for tag in header.split(",")}
+    return etag.replace("W/", "", 1) in candidates
+
+async def conditional_json(request: Request, resource: str, render) -> Response:
+    # Serve a cached rendering of the resource, or 304 when the client has it.
+    # The ETag is a digest of the body so every worker agrees on it.
+    version = resource_versions[resource]
+    cached = rendered_cache.get((resource, version))
+    if cached is None:
+        body = dumps(await render())
+        cached = ('W/"%s"' % hashlib.sha1(body).hexdigest()[:20], body)
+        if version == resource_versions[resource]:
+            rendered_cache.set((resource, version), cached)
+    etag, body = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def require_mongo(feature: str) -> None:
+    if db is None:
+        raise HTTPException(
+            status_code=501,
+            detail=f"{feature} needs the MongoDB storage backend"
+        )
+
+async def forget_period_stats(changes) -> None:
+    # Past days whose rollups moved can no longer be served from the cache
+    if db is None:
+        return
+    buckets = [bucket for before, after in changes for image in (before, after) for bucket in entry_contribution(image)]
+    await period_cache.invalidate(db, buckets, datetime.utcnow().date())
+
+async def log_entry_changes(changes: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]) -> None:
+    # A change the log cannot record is undone, rollups included, and the
+    # request fails: the changes that stand are the logged ones (event_store.py)
+    try:
+        await append_events(db, changes)
+    except STORAGE_ERRORS:
+        logger.exception("Could not log %d time entry changes to clock_events; undoing them", len(changes))
+        try:
+            for before, after in await undo_changes(db, changes):
+                await apply_entry_change(db, after, before)
+        except STORAGE_ERRORS:
+            logger.exception("Could not undo the time entry changes missing from clock_events")
+        raise HTTPException(status_code=503, detail="Could not record the change, please try again")
+
+async def record_entry_change(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> None:
+    # Every time entry write goes through here: rollups, event log, then subscribers
+    if db is not None:
+        await apply_entry_change(db, before, after)
+        await log_entry_changes([(before, after)])
+        await forget_period_stats([(before, after)])
+    broker.publish_local(entry_delta(before, after))
+
+def format_sse(event: Dict[str, Any]) -> str:
+    data = json.dumps({key: value for key, value in event.items() if key != "id"}, default=json_default)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
 # API Routes
 
 # Health check
+HEALTH_PING_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_PING_TIMEOUT_SECONDS', '2'))
+
 @api_router.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+    try:
+        ping_ms = await asyncio.wait_for(storage.ping(), HEALTH_PING_TIMEOUT_SECONDS)
+    except (*STORAGE_ERRORS, asyncio.TimeoutError) as exc:
+        logger.warning("Health check ping failed: %s", exc)
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    health = {
+        "status": "healthy",
+        "timestamp": datetime.utcnow().isoformat(),
+        "database": {
+            "backend": storage.backend,
+            "pingMs": ping_ms,
+            "pool": pool_monitor.snapshot()
+        }
+    }
+    if tap_journal is not None:
+        health["journal"] = {"backlog": tap_journal.backlog}
+    return health
+
+@api_router.get("/health/commands")
+async def command_latencies():
+    # Latency histograms of the commands sent by this worker, by collection
+    return command_monitor.snapshot()
 
 # Auth
 @api_router.post("/auth/admin")
 async def authenticate_admin(auth: AuthRequest):
     settings = await get_or_create_settings()
-    if verify_password(auth.password, settings["adminPassword"]):
+    if await check_password(auth.password, settings["adminPassword"]):
         return {"authenticated": True, "message": "Authentication successful"}
     raise HTTPException(status_code=401, detail="Invalid password")
 
 # Settings
 @api_router.get("/settings")
-async def get_settings():
+async def get_settings(request: Request):
+    return await conditional_json(request, "settings", render_settings)
+
+async def render_settings():
     settings = await get_or_create_settings()
     # Don't return the password hash
     return {
@@ -169,31 +559,46 @@ async def update_settings(settings_update: SettingsUpdate):
     
     # Hash password if provided
     if "adminPassword" in update_data:
-        update_data["adminPassword"] = hash_password(update_data["adminPassword"])
+        update_data["adminPassword"] = await hash_password_async(update_data["adminPassword"])
     
-    await db.settings.update_one(
-        {"_id": "default"},
-        {"$set": update_data}
-    )
+    await storage.update_settings(update_data)
+    bump_version("settings")
     return {"message": "Settings updated successfully"}
 
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    return {
+        "settings": settings_cache.stats(),
+        "roster": roster_cache.stats(),
+        "rendered": rendered_cache.stats(),
+        "credentials": verified_credentials.stats(),
+        "periodStats": period_cache.stats()
+    }
+
 # Employees
 @api_router.get("/employees", response_model=List[Employee])
-async def get_employees():
-    employees = await db.employees.find({"isActive": True}).to_list(1000)
-    return [Employee(**employee) for employee in employees]
+async def get_employees(request: Request):
+    return await conditional_json(request, "employees", render_employees)
+
+async def render_employees():
+    roster = await get_active_roster()
+    if FAST_RESPONSES:
+        return employee_documents(roster.values())
+    return [Employee(**employee).dict() for employee in roster.values()]
 
 @api_router.post("/employees", response_model=Employee)
 async def create_employee(employee: EmployeeCreate):
     employee_dict = employee.dict()
     employee_obj = Employee(**employee_dict)
     
-    await db.employees.insert_one(employee_obj.dict())
+    await storage.insert_employee(employee_obj.dict())
+    bump_version("employees")
+    broker.publish_local(employee_delta("employee_created", employee_obj.id))
     return employee_obj
 
 @api_router.get("/employees/{employee_id}", response_model=Employee)
 async def get_employee(employee_id: str):
-    employee = await db.employees.find_one({"id": employee_id, "isActive": True})
+    employee = await get_active_employee(employee_id)
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
     return Employee(**employee)
@@ -202,27 +607,24 @@ async def get_employee(employee_id: str):
 async def update_employee(employee_id: str, employee_update: EmployeeUpdate):
     update_data = employee_update.dict(exclude_unset=True)
     
-    result = await db.employees.update_one(
-        {"id": employee_id, "isActive": True},
-        {"$set": update_data}
-    )
+    employee = await storage.update_employee(employee_id, update_data)
     
-    if result.matched_count == 0:
+    if employee is None:
         raise HTTPException(status_code=404, detail="Employee not found")
     
-    employee = await db.employees.find_one({"id": employee_id})
+    bump_version("employees")
+    broker.publish_local(employee_delta("employee_updated", employee_id))
     return Employee(**employee)
 
 @api_router.delete("/employees/{employee_id}")
 async def delete_employee(employee_id: str):
-    result = await db.employees.update_one(
-        {"id": employee_id},
-        {"$set": {"isActive": False}}
-    )
+    employee = await storage.update_employee(employee_id, {"isActive": False}, active_only=False)
     
-    if result.matched_count == 0:
+    if employee is None:
         raise HTTPException(status_code=404, detail="Employee not found")
     
+    bump_version("employees")
+    broker.publish_local(employee_delta("employee_deleted", employee_id))
     return {"message": "Employee deleted successfully"}
 
 # Time Entries
@@ -234,38 +636,60 @@ async def get_time_entries(
     status: Optional[str] = None,
     limit: int = 1000
 ):
-    filters = {}
-    
-    if employee_id:
-        filters["employeeId"] = employee_id
-    
-    if start_date:
-        filters["startTime"] = {"$gte": start_date}
-    
-    if end_date:
-        if "startTime" in filters:
-            filters["startTime"]["$lte"] = end_date
-        else:
-            filters["startTime"] = {"$lte": end_date}
+    query = time_entry_query(employee_id, start_date, end_date, status)
+    if FAST_RESPONSES:
+        time_entries = await storage.find_time_entries(**query, limit=limit, projection=TIME_ENTRY_PROJECTION)
+        return FastJSONResponse(time_entry_documents(time_entries))
+    time_entries = await storage.find_time_entries(**query, limit=limit)
+    return [TimeEntry(**entry) for entry in time_entries]
+
+@api_router.get("/time-entries/page", response_model=TimeEntryPage)
+async def get_time_entries_page(
+    employee_id: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    query = time_entry_query(employee_id, start_date, end_date, status)
     
-    if status:
-        filters["status"] = status
+    # Keyset position: entries after the (startTime, id) of the previous page
+    after = decode_cursor(cursor) if cursor else None
     
-    time_entries = await db.time_entries.find(filters).sort("startTime", -1).to_list(limit)
-    return [TimeEntry(**entry) for entry in time_entries]
+    if FAST_RESPONSES:
+        time_entries = await storage.find_time_entries(
+            **query, after=after, limit=limit, projection=TIME_ENTRY_PROJECTION
+        )
+        next_cursor = encode_cursor(time_entries[-1]) if len(time_entries) == limit else None
+        return FastJSONResponse({"items": time_entry_documents(time_entries), "next_cursor": next_cursor})
+    time_entries = await storage.find_time_entries(**query, after=after, limit=limit)
+    next_cursor = encode_cursor(time_entries[-1]) if len(time_entries) == limit else None
+    return TimeEntryPage(
+        items=[TimeEntry(**entry) for entry in time_entries],
+        next_cursor=next_cursor
+    )
+
+@api_router.get("/time-entries/stream")
+async def stream_time_entries(
+    employee_id: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    status: Optional[str] = None
+):
+    query = time_entry_query(employee_id, start_date, end_date, status)
+    entries = storage.iter_time_entries(**query)
+    return StreamingResponse(ndjson_lines(entries), media_type="application/x-ndjson")
 
 @api_router.post("/time-entries", response_model=TimeEntry)
 async def create_time_entry(time_entry: TimeEntryCreate):
     # Check if employee exists
-    employee = await db.employees.find_one({"id": time_entry.employeeId, "isActive": True})
+    employee = await get_active_employee(time_entry.employeeId)
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
     
     # Check if employee already has an active time entry
-    existing_entry = await db.time_entries.find_one({
-        "employeeId": time_entry.employeeId,
-        "status": {"$in": ["active", "on_break"]}
-    })
+    existing_entry = await storage.find_open_entry(time_entry.employeeId)
     
     if existing_entry:
         raise HTTPException(
@@ -273,237 +697,421 @@ async def create_time_entry(time_entry: TimeEntryCreate):
             detail="Employee already has an active time entry"
         )
     
-    time_entry_dict = time_entry.dict()
+    time_entry_dict = storage_times(time_entry.dict())
     time_entry_obj = TimeEntry(**time_entry_dict)
     
-    await db.time_entries.insert_one(time_entry_obj.dict())
+    try:
+        await storage.insert_time_entry(time_entry_obj.dict())
+    except DuplicateOpenEntry:
+        # Lost a race against a concurrent clock-in (one_open_entry_per_employee)
+        raise HTTPException(
+            status_code=400, 
+            detail="Employee already has an active time entry"
+        )
+    await record_entry_change(None, time_entry_obj.dict())
     return time_entry_obj
 
 @api_router.put("/time-entries/{entry_id}", response_model=TimeEntry)
 async def update_time_entry(entry_id: str, time_entry_update: TimeEntryUpdate):
-    update_data = time_entry_update.dict(exclude_unset=True)
+    update_data = storage_times(time_entry_update.dict(exclude_unset=True))
     
-    result = await db.time_entries.update_one(
-        {"id": entry_id},
-        {"$set": update_data}
-    )
+    try:
+        previous_entry = await storage.update_time_entry(entry_id, update_data)
+    except DuplicateOpenEntry:
+        raise HTTPException(
+            status_code=400, 
+            detail="Employee already has an active time entry"
+        )
     
-    if result.matched_count == 0:
+    if not previous_entry:
         raise HTTPException(status_code=404, detail="Time entry not found")
     
-    time_entry = await db.time_entries.find_one({"id": entry_id})
+    time_entry = {**previous_entry, **update_data}
+    await record_entry_change(previous_entry, time_entry)
     return TimeEntry(**time_entry)
 
 @api_router.delete("/time-entries/{entry_id}")
 async def delete_time_entry(entry_id: str):
-    result = await db.time_entries.delete_one({"id": entry_id})
+    deleted_entry = await storage.delete_time_entry(entry_id)
     
-    if result.deleted_count == 0:
+    if not deleted_entry:
         raise HTTPException(status_code=404, detail="Time entry not found")
     
+    await record_entry_change(deleted_entry, None)
     return {"message": "Time entry deleted successfully"}
 
+# Exports
+@api_router.get("/exports/time-entries")
+async def export_time_entries(
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+    employee_id: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    status: Optional[str] = None
+):
+    if format == "xlsx" and not XLSX_AVAILABLE:
+        raise HTTPException(status_code=501, detail="XLSX exports are not available on this server")
+    
+    employees = await storage.list_employees(active_only=False, projection=EMPLOYEE_PROJECTION)
+    employees_by_id = {employee["id"]: employee for employee in employees}
+    
+    query = time_entry_query(employee_id, start_date, end_date, status)
+    cursor = storage.iter_time_entries(**query, projection=EXPORT_PROJECTION, ascending=True)
+    filename = f"pointage_{datetime.utcnow().date().isoformat()}.{format}"
+    
+    if format == "csv":
+        return StreamingResponse(
+            csv_chunks(cursor, employees_by_id),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+    
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        await write_xlsx(cursor, employees_by_id, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return FileResponse(
+        path,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=filename,
+        background=BackgroundTask(os.remove, path)
+    )
+
+# Reports
+@api_router.get("/reports/timesheet", response_model=TimesheetReport)
+async def get_timesheet_report(
+    employee_id: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+):
+    # NumPy is only needed here: import it on first use, not at startup
+    try:
+        from reporting import REPORT_EMPLOYEE_PROJECTION, REPORT_PROJECTION, compute_report, load_columns
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Timesheet reports require numpy on this server")
+
+    employees = await storage.list_employees(active_only=False, projection=REPORT_EMPLOYEE_PROJECTION)
+    employees_by_id = {employee["id"]: employee for employee in employees}
+    
+    query = time_entry_query(employee_id, start_date, end_date, None)
+    columns = await load_columns(storage.iter_time_entries(**query, projection=REPORT_PROJECTION))
+    # The array passes are CPU-bound; keep them off the event loop
+    return await asyncio.to_thread(compute_report, columns, employees_by_id)
+
 # Clock in/out endpoints
-@api_router.post("/clock-in/{employee_id}")
-async def clock_in(employee_id: str):
-    # Check if employee exists
-    employee = await db.employees.find_one({"id": employee_id, "isActive": True})
+async def journal_tap(employee_id: str, action: str) -> Response:
+    # Accepted once on disk; conflicts are only found when it is applied
+    employee = await get_active_employee(employee_id)
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
     
-    # Check if employee already has an active time entry
-    existing_entry = await db.time_entries.find_one({
-        "employeeId": employee_id,
-        "status": {"$in": ["active", "on_break"]}
-    })
+    record = await tap_journal.append(employee_id, action, utc_now().isoformat())
+    return JSONResponse(status_code=202, content={**record, "status": "queued"})
+
+@api_router.post("/clock-in/{employee_id}")
+async def clock_in(employee_id: str):
+    if tap_journal is not None:
+        return await journal_tap(employee_id, "clock_in")
     
-    if existing_entry:
-        raise HTTPException(
-            status_code=400, 
-            detail="Employee already clocked in"
-        )
+    # Check if employee exists (served from the roster cache)
+    employee = await get_active_employee(employee_id)
+    if not employee:
+        raise HTTPException(status_code=404, detail="Employee not found")
     
     time_entry = TimeEntry(
         employeeId=employee_id,
-        startTime=datetime.utcnow().isoformat(),
+        startTime=utc_now(),
         status="active"
     )
     
-    await db.time_entries.insert_one(time_entry.dict())
+    # The one_open_entry_per_employee unique index rejects a second open
+    # entry, so the insert itself is the "already clocked in" check.
+    try:
+        await storage.insert_time_entry(time_entry.dict())
+    except DuplicateOpenEntry:
+        raise HTTPException(
+            status_code=400, 
+            detail="Employee already clocked in"
+        )
+    await record_entry_change(None, time_entry.dict())
+    clock_events.labels("clock_in", "tap").inc()
     return time_entry
 
 @api_router.post("/clock-out/{employee_id}")
 async def clock_out(employee_id: str):
-    # Find active time entry
-    active_entry = await db.time_entries.find_one({
-        "employeeId": employee_id,
-        "status": {"$in": ["active", "on_break"]}
-    })
+    if tap_journal is not None:
+        return await journal_tap(employee_id, "clock_out")
+    
+    # Close the open time entry in a single round trip
+    now = utc_now()
+    previous_entry = await storage.clock_out(employee_id, now)
     
-    if not active_entry:
+    if not previous_entry:
         raise HTTPException(
             status_code=400, 
             detail="No active time entry found for employee"
         )
     
-    # Update entry with end time
-    await db.time_entries.update_one(
-        {"id": active_entry["id"]},
-        {"$set": {
-            "endTime": datetime.utcnow().isoformat(),
-            "status": "completed"
-        }}
-    )
-    
-    updated_entry = await db.time_entries.find_one({"id": active_entry["id"]})
+    # The pre-image, as matched: active or on a break
+    updated_entry = {**previous_entry, "endTime": now, "status": "completed"}
+    await record_entry_change(previous_entry, updated_entry)
+    clock_events.labels("clock_out", "tap").inc()
     return TimeEntry(**updated_entry)
 
 @api_router.post("/start-break/{employee_id}")
 async def start_break(employee_id: str):
-    # Find active time entry
-    active_entry = await db.time_entries.find_one({
-        "employeeId": employee_id,
-        "status": "active"
-    })
+    if tap_journal is not None:
+        return await journal_tap(employee_id, "start_break")
+    
+    # Append a break to the active time entry
+    updated_entry = await storage.start_break(employee_id, utc_now())
     
-    if not active_entry:
+    if not updated_entry:
         raise HTTPException(
             status_code=400, 
             detail="No active time entry found for employee"
         )
     
-    # Add break
-    breaks = active_entry.get("breaks", [])
-    breaks.append({
-        "startTime": datetime.utcnow().isoformat(),
-        "endTime": None
-    })
-    
-    await db.time_entries.update_one(
-        {"id": active_entry["id"]},
-        {"$set": {
-            "breaks": breaks,
-            "status": "on_break"
-        }}
-    )
-    
-    updated_entry = await db.time_entries.find_one({"id": active_entry["id"]})
+    # The pre-image only differs by the break appended just now
+    previous_entry = {**updated_entry, "status": "active", "breaks": updated_entry["breaks"][:-1]}
+    await record_entry_change(previous_entry, updated_entry)
+    clock_events.labels("start_break", "tap").inc()
     return TimeEntry(**updated_entry)
 
 @api_router.post("/end-break/{employee_id}")
 async def end_break(employee_id: str):
-    # Find active time entry
-    active_entry = await db.time_entries.find_one({
-        "employeeId": employee_id,
-        "status": "on_break"
-    })
+    if tap_journal is not None:
+        return await journal_tap(employee_id, "end_break")
+    
+    # Close the open break in place
+    now = utc_now()
+    updated_entry = await storage.end_break(employee_id, now)
     
-    if not active_entry:
+    if not updated_entry:
         raise HTTPException(
             status_code=400, 
             detail="No active break found for employee"
         )
     
-    # End the last break
-    breaks = active_entry.get("breaks", [])
-    if breaks and not breaks[-1].get("endTime"):
-        breaks[-1]["endTime"] = datetime.utcnow().isoformat()
-    
-    await db.time_entries.update_one(
-        {"id": active_entry["id"]},
-        {"$set": {
-            "breaks": breaks,
-            "status": "active"
-        }}
+    # The pre-image only differs by the break(s) closed just now
+    previous_entry = {
+        **updated_entry,
+        "status": "on_break",
+        "breaks": [
+            {**item, "endTime": None} if item.get("endTime") == now else item
+            for item in updated_entry.get("breaks", [])
+        ]
+    }
+    await record_entry_change(previous_entry, updated_entry)
+    clock_events.labels("end_break", "tap").inc()
+    return TimeEntry(**updated_entry)
+
+# Batched clock events (shift changes, buffered kiosk taps)
+MAX_CLOCK_BATCH = 1000
+
+def new_time_entry(employee_id: str, start_time: datetime) -> Dict[str, Any]:
+    return TimeEntry(employeeId=employee_id, startTime=start_time, status="active").dict()
+
+async def apply_clock_events(events: List[Dict[str, Any]], source: str = "batch"):
+    employee_ids = list({event["employeeId"] for event in events})
+    active_employees = {
+        employee["id"]
+        for employee in await db.employees.find(
+            {"id": {"$in": employee_ids}, "isActive": True}, {"_id": 0, "id": 1}
+        ).to_list(None)
+    }
+    open_entries = {
+        entry["employeeId"]: entry
+        for entry in await db.time_entries.find(
+            {"employeeId": {"$in": employee_ids}, "status": {"$in": OPEN_STATUSES}}
+        ).to_list(None)
+    }
+    plan = plan_clock_events(events, active_employees, open_entries, new_time_entry)
+    changes = await apply_clock_plan(db, plan)
+    await log_entry_changes(changes)
+    await forget_period_stats(changes)
+    for before, after in changes:
+        broker.publish_local(entry_delta(before, after))
+    for result in plan.results:
+        if result["ok"]:
+            clock_events.labels(result["action"], source).inc()
+    return plan
+
+async def apply_journaled_taps(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Journal keys double as sync receipts, so replayed taps apply once
+    return await ingest(db, records, "journal", partial(apply_clock_events, source="journal"))
+
+@api_router.post("/clock-events/batch")
+async def clock_events_batch(batch: ClockEventBatch):
+    require_mongo("Batched clock events")
+    if len(batch.events) > MAX_CLOCK_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_CLOCK_BATCH} events per batch"
+        )
+    
+    plan = await apply_clock_events([event.dict() for event in batch.events])
+    applied = sum(1 for result in plan.results if result["ok"])
+    return {
+        "applied": applied,
+        "failed": len(plan.results) - applied,
+        "results": plan.results
+    }
+
+# Offline sync
+MAX_SYNC_BATCH = 5000
+
+@api_router.post("/sync")
+async def sync_offline_operations(sync_request: SyncRequest):
+    require_mongo("Offline sync")
+    if len(sync_request.operations) > MAX_SYNC_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_SYNC_BATCH} operations per sync"
+        )
+    
+    result = await ingest(
+        db,
+        [operation.dict() for operation in sync_request.operations],
+        sync_request.deviceId,
+        partial(apply_clock_events, source="sync")
     )
+    sync_batches.inc()
+    for ack in result["acks"].values():
+        sync_operations.labels(ack).inc()
+    return result
+
+# Live clock state changes
+@api_router.get("/events")
+async def stream_events(request: Request):
+    subscription = broker.subscribe()
     
-    updated_entry = await db.time_entries.find_one({"id": active_entry["id"]})
-    return TimeEntry(**updated_entry)
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            broker.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Presence board
+@api_router.get("/presence")
+async def get_presence():
+    return {
+        "present": presence.board(),
+        "counts": presence.counts(),
+        "warmedAt": presence.warmed_at
+    }
+
+@api_router.get("/presence/check")
+async def check_presence(repair: bool = False):
+    return await presence.check(storage, repair=repair)
+
+@api_router.get("/presence/{employee_id}")
+async def get_employee_presence(employee_id: str):
+    state = presence.get(employee_id)
+    if not state:
+        return {"employeeId": employee_id, "status": "out"}
+    return {"employeeId": employee_id, **state}
 
 # Statistics
-@api_router.get("/stats", response_model=StatsResponse)
-async def get_stats():
+# Longest range /api/stats accepts, in days
+MAX_STATS_RANGE_DAYS = 731
+
+async def entry_rollups(start_day: date, end_day: date, employee_id: Optional[str] = None):
+    """Rollups for the days between ``start_day`` and ``end_day``, summed from the entries (SQLite keeps no ``daily_rollups``)."""
+    return await rollups_from_entries(storage.iter_time_entries(
+        employee_id=employee_id,
+        start_date=start_day.isoformat(),
+        end_date=(end_day + timedelta(days=1)).isoformat(),
+    ))
+
+@api_router.get("/stats", response_model=Union[StatsResponse, RangeStatsResponse])
+async def get_stats(
+    from_: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    group_by: str = Query("day", alias="groupBy", pattern="^(day|week|month)$"),
+    employee_id: Optional[str] = Query(None, alias="employeeId")
+):
     now = datetime.utcnow()
-    week_start = now - timedelta(days=now.weekday())
     today = now.date()
     
-    # Get all time entries for the week
-    week_entries = await db.time_entries.find({
-        "startTime": {"$gte": week_start.isoformat()}
-    }).to_list(1000)
+    # Any range parameter asks for the payroll review figures instead of the dashboard
+    if from_ or to or employee_id or group_by != "day":
+        if not from_:
+            raise HTTPException(status_code=400, detail="from is required")
+        to = to or today
+        if to < from_:
+            raise HTTPException(status_code=400, detail="to must not be before from")
+        if (to - from_).days >= MAX_STATS_RANGE_DAYS:
+            raise HTTPException(status_code=400, detail=f"Ranges are limited to {MAX_STATS_RANGE_DAYS} days")
+        if db is None:
+            days = [day.isoformat() for day in range_days(from_, to)]
+            summaries = summarise_rollups(await entry_rollups(from_, to, employee_id), days)
+            return group_summaries(from_, to, group_by, employee_id, summaries)
+        return await range_stats(db, period_cache, from_, to, group_by, employee_id, today)
     
-    # Calculate weekly hours
-    weekly_hours = 0
-    for entry in week_entries:
-        if entry.get("endTime"):
-            start = datetime.fromisoformat(entry["startTime"])
-            end = datetime.fromisoformat(entry["endTime"])
-            duration = (end - start).total_seconds() / 3600
-            weekly_hours += duration
+    week_start = today - timedelta(days=today.weekday())
+    week_end = week_start + timedelta(days=6)
     
-    # Get active employees (those with active time entries today)
-    today_entries = await db.time_entries.find({
-        "startTime": {"$gte": today.isoformat()},
-        "status": {"$in": ["active", "on_break"]}
-    }).to_list(1000)
+    # Totals, top employees and daily figures folded from the per-employee
+    # daily rollups by the database, in one round trip (see rollups.py).
+    # The dashboard reports the elapsed time of closed entries, breaks included.
+    if db is None:
+        employees = await storage.list_employees(active_only=False, projection={"_id": 0, "id": 1, "name": 1})
+        names = {employee["id"]: employee["name"] for employee in employees}
+        week = fold_week_stats(await entry_rollups(week_start, week_end), week_start, week_end, names)
+    else:
+        week = await read_week_stats(db, week_start, week_end)
+    weekly_hours = week["hours"]
     
-    active_employees = len(set(entry["employeeId"] for entry in today_entries))
+    # Employees currently clocked in, from the presence index
+    active_employees = len(presence)
     
     # Get total employees
-    total_employees = await db.employees.count_documents({"isActive": True})
+    if db is None:
+        total_employees = len(await storage.list_employees())
+    else:
+        total_employees = await db.employees.count_documents({"isActive": True})
     
     # Calculate overtime (assuming 40 hours/week standard)
     overtime_hours = max(0, weekly_hours - 40)
     
-    # Get top employees by hours this week
-    employee_hours = {}
-    for entry in week_entries:
-        if entry.get("endTime"):
-            start = datetime.fromisoformat(entry["startTime"])
-            end = datetime.fromisoformat(entry["endTime"])
-            duration = (end - start).total_seconds() / 3600
-            
-            emp_id = entry["employeeId"]
-            if emp_id not in employee_hours:
-                employee_hours[emp_id] = 0
-            employee_hours[emp_id] += duration
-    
-    # Get employee names
-    employees = await db.employees.find({}).to_list(1000)
-    employee_names = {emp["id"]: emp["name"] for emp in employees}
-    
-    top_employees = []
-    for emp_id, hours in sorted(employee_hours.items(), key=lambda x: x[1], reverse=True)[:5]:
-        top_employees.append({
-            "id": emp_id,
-            "name": employee_names.get(emp_id, "Unknown"),
-            "hours": round(hours, 1)
-        })
+    top_employees = [
+        {"id": employee["id"], "name": employee["name"], "hours": round(employee["hours"], 1)}
+        for employee in week["topEmployees"]
+    ]
     
     # Daily breakdown for the week
     daily_breakdown = []
     for i in range(7):
-        day = week_start + timedelta(days=i)
-        day_entries = [e for e in week_entries if datetime.fromisoformat(e["startTime"]).date() == day.date()]
-        
-        day_hours = 0
-        for entry in day_entries:
-            if entry.get("endTime"):
-                start = datetime.fromisoformat(entry["startTime"])
-                end = datetime.fromisoformat(entry["endTime"])
-                duration = (end - start).total_seconds() / 3600
-                day_hours += duration
-        
+        day = (week_start + timedelta(days=i)).isoformat()
+        totals = week["daily"].get(day, {})
         daily_breakdown.append({
-            "date": day.date().isoformat(),
-            "hours": round(day_hours, 1),
-            "employees": len(set(entry["employeeId"] for entry in day_entries))
+            "date": day,
+            "hours": round(totals.get("hours", 0), 1),
+            "employees": totals.get("employees", 0)
         })
     
     return StatsResponse(
         weeklyHours=round(weekly_hours, 1),
         activeEmployees=active_employees,
         totalEmployees=total_employees,
+        weekEmployees=week["employees"],
         overtimeHours=round(overtime_hours, 1),
         topEmployees=top_employees,
         dailyBreakdown=daily_breakdown
@@ -512,6 +1120,13 @@ async def get_stats():
 # Include the router
 app.include_router(api_router)
 
+# Prometheus scrape endpoint, outside /api so it isn't exposed with the API
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+app.add_middleware(MetricsMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -531,11 +1146,35 @@ logger = logging.getLogger(__name__)
 @app.on_event("startup")
 async def startup_event():
     logger.info("TimeTracker API starting up...")
+    await storage.start()
     await get_or_create_settings()
+    if db is not None:
+        for before, after in await close_duplicate_open_entries(db):
+            await record_entry_change(before, after)
+        if OPEN_ENTRY_INDEX in await ensure_indexes(db):
+            logger.warning("Without %s, clock-ins check for an open entry first (racy)", OPEN_ENTRY_INDEX)
+            storage.check_open_entry = True
+        await broker.start(db)
+        snapshots.start(db)
+    if tap_journal is not None:
+        await tap_journal.start(apply_journaled_taps)
+    elif TAP_JOURNAL_DIR:
+        logger.warning("TAP_JOURNAL_DIR is ignored: the tap journal needs the MongoDB storage backend")
+    await presence.warm(storage)
+    if broker.mode == "local":
+        presence.start_refresher(storage)
     logger.info("TimeTracker API started successfully")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("TimeTracker API shutting down...")
-    client.close()
+    if tap_journal is not None:
+        await tap_journal.stop()
+    await broker.stop()
+    await snapshots.stop()
+    await presence.stop()
+    await storage.close()
+    if client is not None:
+        client.close()
+    bcrypt_executor.shutdown(wait=False)
     logger.info("TimeTracker API shutdown complete")
\ No newline at end of file
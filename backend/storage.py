@@ -0,0 +1,649 @@
+"""Storage of employees, time entries and settings behind one interface.
+
+``MongoStorage`` keeps them in the Motor database the rest of the server
+also uses (rollups, sync receipts, stats cache). ``SQLiteStorage`` keeps the
+same documents in an embedded SQLite file, for single-site installs without
+a MongoDB server: WAL mode so reads don't wait for writes, every write on
+one dedicated thread (SQLite has a single writer anyway), reads on a small
+pool of threads. The server picks one with ``STORAGE_BACKEND``.
+
+Documents are dicts shaped like the Pydantic models in ``server.py``, with
+timestamps as naive UTC datetimes (see ``timesheet.py``).
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from timesheet import OPEN_STATUSES, timestamp_range, to_storage
+
+# Errors meaning the store cannot be reached or used
+STORAGE_ERRORS = (PyMongoError, sqlite3.Error)
+
+# Newest first, with the id as a tie-breaker so keyset pagination is stable
+TIME_ENTRY_SORT = [("startTime", -1), ("id", -1)]
+
+
+class DuplicateOpenEntry(Exception):
+    """The employee already has an open (active or on break) time entry."""
+
+
+class Storage(ABC):
+    """What the API needs from a store; see the two implementations below.
+
+    Time entry queries take the ``start_date``/``end_date`` bounds as given
+    to the API (ISO strings, ``ValueError`` if they aren't) and an optional
+    ``after`` keyset position ``(startTime, id)`` in ``TIME_ENTRY_SORT``
+    order. Projections only narrow Mongo reads; SQLite returns whole
+    documents.
+    """
+    backend = ""
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def ping(self) -> float:
+        raise NotImplementedError
+
+    # Settings
+    @abstractmethod
+    async def get_settings(self) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def insert_settings(self, settings: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_settings(self, fields: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    # Employees
+    @abstractmethod
+    async def list_employees(
+        self, active_only: bool = True, projection: Optional[Dict[str, int]] = None
+    ) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_employee(self, employee_id: str, active_only: bool = True) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def insert_employee(self, employee: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_employee(
+        self, employee_id: str, fields: Dict[str, Any], active_only: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """Updated employee, or None if there is no such (active) employee."""
+        raise NotImplementedError
+
+    # Time entries
+    @abstractmethod
+    async def find_time_entries(
+        self,
+        employee_id: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        statuses: Optional[Sequence[str]] = None,
+        after: Optional[Tuple[Any, str]] = None,
+        limit: int = 0,
+        projection: Optional[Dict[str, int]] = None,
+    ) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_time_entries(
+        self,
+        employee_id: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        statuses: Optional[Sequence[str]] = None,
+        projection: Optional[Dict[str, int]] = None,
+        ascending: bool = False,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """All matching entries, streamed in batches."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def find_open_entry(self, employee_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def insert_time_entry(self, entry: Dict[str, Any]) -> None:
+        """Raises ``DuplicateOpenEntry`` for a second open entry of an employee."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_time_entry(self, entry_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The entry before the update, or None if there is none.
+
+        Raises ``DuplicateOpenEntry`` if the update would leave the employee
+        with two open entries.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_time_entry(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    # Clock transitions of the open entry; each returns the entry after the
+    # change (clock_out: before it), or None if the employee isn't in the
+    # expected state
+    @abstractmethod
+    async def clock_out(self, employee_id: str, now: datetime) -> Optional[Dict[str, Any]]:
+        """The entry *before* it was closed: it may have been active or on a break."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def start_break(self, employee_id: str, now: datetime) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def end_break(self, employee_id: str, now: datetime) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+def _without_id(document: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # Updates return the whole document: with a projection, mongomock looks
+    # the post-image up again by the (by then stale) filter
+    if document is not None:
+        document.pop("_id", None)
+    return document
+
+
+class MongoStorage(Storage):
+    backend = "mongo"
+
+    def __init__(self, db, legacy_strings: bool = True):
+        self.db = db
+        # Also match entries still storing ISO strings (migrate_timestamps.py)
+        self.legacy_strings = legacy_strings
+        # Set when one_open_entry_per_employee couldn't be built (indexes.py):
+        # inserts then look up the open entry first, which is racy
+        self.check_open_entry = False
+
+    async def ping(self) -> float:
+        started = time.perf_counter()
+        await self.db.command("ping")
+        return round((time.perf_counter() - started) * 1000, 3)
+
+    async def get_settings(self):
+        return await self.db.settings.find_one({"_id": "default"}, {"_id": 0})
+
+    async def insert_settings(self, settings):
+        await self.db.settings.insert_one({"_id": "default", **settings})
+
+    async def update_settings(self, fields):
+        await self.db.settings.update_one({"_id": "default"}, {"$set": fields})
+
+    async def list_employees(self, active_only=True, projection=None):
+        query = {"isActive": True} if active_only else {}
+        return await self.db.employees.find(query, projection or {"_id": 0}).to_list(None)
+
+    async def get_employee(self, employee_id, active_only=True):
+        query = {"id": employee_id, "isActive": True} if active_only else {"id": employee_id}
+        return await self.db.employees.find_one(query, {"_id": 0})
+
+    async def insert_employee(self, employee):
+        await self.db.employees.insert_one(dict(employee))
+
+    async def update_employee(self, employee_id, fields, active_only=True):
+        query = {"id": employee_id, "isActive": True} if active_only else {"id": employee_id}
+        return _without_id(await self.db.employees.find_one_and_update(
+            query, {"$set": fields}, return_document=ReturnDocument.AFTER
+        ))
+
+    def cursor_filter(self, start_time, entry_id: str) -> Dict[str, Any]:
+        # Entries after the cursor in TIME_ENTRY_SORT order. Mongo sorts strings
+        # before dates, so descending, every legacy string comes after any date.
+        after = [
+            {"startTime": {"$lt": start_time}},
+            {"startTime": start_time, "id": {"$lt": entry_id}}
+        ]
+        if isinstance(start_time, datetime) and self.legacy_strings:
+            after.append({"startTime": {"$type": "string"}})
+        return {"$or": after}
+
+    def time_entry_filter(self, employee_id, start_date, end_date, statuses, after=None) -> Dict[str, Any]:
+        filters: Dict[str, Any] = {}
+        if employee_id:
+            filters["employeeId"] = employee_id
+        filters.update(timestamp_range("startTime", start_date, end_date, self.legacy_strings))
+        if statuses:
+            filters["status"] = {"$in": list(statuses)}
+        if after:
+            filters = {"$and": [filters, self.cursor_filter(*after)]}
+        return filters
+
+    async def find_time_entries(self, employee_id=None, start_date=None, end_date=None, statuses=None,
+                                after=None, limit=0, projection=None):
+        filters = self.time_entry_filter(employee_id, start_date, end_date, statuses, after)
+        cursor = self.db.time_entries.find(filters, projection or {"_id": 0}).sort(TIME_ENTRY_SORT)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(None)
+
+    async def iter_time_entries(self, employee_id=None, start_date=None, end_date=None, statuses=None,
+                                projection=None, ascending=False):
+        filters = self.time_entry_filter(employee_id, start_date, end_date, statuses)
+        order = 1 if ascending else -1
+        cursor = self.db.time_entries.find(filters, projection or {"_id": 0}).sort(
+            [("startTime", order), ("id", order)]
+        )
+        async for entry in cursor:
+            yield entry
+
+    async def find_open_entry(self, employee_id):
+        return await self.db.time_entries.find_one(
+            {"employeeId": employee_id, "status": {"$in": OPEN_STATUSES}}, {"_id": 0}
+        )
+
+    async def insert_time_entry(self, entry):
+        # The one_open_entry_per_employee partial unique index rejects a second
+        # open entry, so the insert itself is the "already clocked in" check.
+        if self.check_open_entry and await self.find_open_entry(entry["employeeId"]):
+            raise DuplicateOpenEntry(entry["employeeId"])
+        try:
+            await self.db.time_entries.insert_one(dict(entry))
+        except DuplicateKeyError:
+            raise DuplicateOpenEntry(entry["employeeId"])
+
+    async def update_time_entry(self, entry_id, fields):
+        try:
+            return await self.db.time_entries.find_one_and_update(
+                {"id": entry_id}, {"$set": fields}, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # Reopened while the employee has another open entry
+            raise DuplicateOpenEntry(entry_id)
+
+    async def delete_time_entry(self, entry_id):
+        return await self.db.time_entries.find_one_and_delete({"id": entry_id}, projection={"_id": 0})
+
+    async def clock_out(self, employee_id, now):
+        # Close the open time entry in a single round trip
+        return _without_id(await self.db.time_entries.find_one_and_update(
+            {"employeeId": employee_id, "status": {"$in": OPEN_STATUSES}},
+            {"$set": {"endTime": now, "status": "completed"}},
+            return_document=ReturnDocument.BEFORE
+        ))
+
+    async def start_break(self, employee_id, now):
+        # Append a break to the active time entry
+        return _without_id(await self.db.time_entries.find_one_and_update(
+            {"employeeId": employee_id, "status": "active"},
+            {
+                "$push": {"breaks": {"startTime": now, "endTime": None}},
+                "$set": {"status": "on_break"}
+            },
+            return_document=ReturnDocument.AFTER
+        ))
+
+    async def end_break(self, employee_id, now):
+        # Close the open break in place
+        return _without_id(await self.db.time_entries.find_one_and_update(
+            {"employeeId": employee_id, "status": "on_break"},
+            {"$set": {"breaks.$[open].endTime": now, "status": "active"}},
+            array_filters=[{"open.endTime": None}],
+            return_document=ReturnDocument.AFTER
+        ))
+
+
+# SQLite keeps each document as JSON, next to the columns it is queried and
+# sorted by. Timestamps are fixed-width ISO strings, so they sort in time order.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    id TEXT PRIMARY KEY,
+    document TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS employees (
+    id TEXT PRIMARY KEY,
+    is_active INTEGER NOT NULL,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS employees_active ON employees (is_active);
+CREATE TABLE IF NOT EXISTS time_entries (
+    id TEXT PRIMARY KEY,
+    employee_id TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    status TEXT NOT NULL,
+    document TEXT NOT NULL
+);
+-- at most one open entry per employee, as one_open_entry_per_employee in Mongo
+CREATE UNIQUE INDEX IF NOT EXISTS one_open_entry_per_employee
+    ON time_entries (employee_id) WHERE status IN ('active', 'on_break');
+-- listing newest first, and the keyset pagination of /api/time-entries/page
+CREATE INDEX IF NOT EXISTS start_time_id_desc ON time_entries (start_time DESC, id DESC);
+-- per-employee history
+CREATE INDEX IF NOT EXISTS employee_start_time ON time_entries (employee_id, start_time);
+"""
+
+EMPLOYEE_TIMES = ("createdAt",)
+TIME_ENTRY_TIMES = ("startTime", "endTime", "createdAt")
+
+
+def _open_entry_conflict(error: sqlite3.IntegrityError) -> bool:
+    # one_open_entry_per_employee is the only unique index on employee_id
+    return "time_entries.employee_id" in str(error)
+
+
+def sqlite_time(value: datetime) -> str:
+    return value.isoformat(timespec="milliseconds")
+
+
+def _encode(document: Dict[str, Any]) -> str:
+    def default(value):
+        if isinstance(value, datetime):
+            return sqlite_time(value)
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+    return json.dumps({key: value for key, value in document.items() if key != "_id"}, default=default)
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _decode_employee(raw: str) -> Dict[str, Any]:
+    employee = json.loads(raw)
+    for name in EMPLOYEE_TIMES:
+        if name in employee:
+            employee[name] = _parse_time(employee[name])
+    return employee
+
+
+def _decode_entry(raw: str) -> Dict[str, Any]:
+    entry = json.loads(raw)
+    for name in TIME_ENTRY_TIMES:
+        if name in entry:
+            entry[name] = _parse_time(entry[name])
+    entry["breaks"] = [
+        {**item, "startTime": _parse_time(item.get("startTime")), "endTime": _parse_time(item.get("endTime"))}
+        for item in entry.get("breaks") or []
+    ]
+    return entry
+
+
+def _entry_row(entry: Dict[str, Any]) -> Tuple[str, str, str, str, str]:
+    return (entry["id"], entry["employeeId"], sqlite_time(entry["startTime"]), entry["status"], _encode(entry))
+
+
+class SQLiteStorage(Storage):
+    backend = "sqlite"
+
+    def __init__(self, path: str, readers: int = 4, batch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="sqlite-reader")
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, opened on first use
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA busy_timeout = 5000")
+            connection.execute("PRAGMA synchronous = NORMAL")  # durable at checkpoints, safe in WAL mode
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    async def _write(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer, function, *args)
+
+    async def _read(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._readers, function, *args)
+
+    def _transaction(self, function, *args):
+        # Runs on the writer thread; IMMEDIATE takes the write lock up front
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = function(connection, *args)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    def _create_schema(self) -> None:
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.executescript(SQLITE_SCHEMA)
+
+    async def start(self) -> None:
+        await self._write(self._create_schema)
+
+    async def close(self) -> None:
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+    async def ping(self) -> float:
+        started = time.perf_counter()
+        await self._read(lambda: self._connection().execute("SELECT 1").fetchone())
+        return round((time.perf_counter() - started) * 1000, 3)
+
+    # Settings
+    async def get_settings(self):
+        def read():
+            row = self._connection().execute("SELECT document FROM settings WHERE id = 'default'").fetchone()
+            return json.loads(row[0]) if row else None
+        return await self._read(read)
+
+    async def insert_settings(self, settings):
+        def insert(connection):
+            connection.execute("INSERT INTO settings (id, document) VALUES ('default', ?)", (_encode(settings),))
+        await self._write(self._transaction, insert)
+
+    async def update_settings(self, fields):
+        def update(connection):
+            row = connection.execute("SELECT document FROM settings WHERE id = 'default'").fetchone()
+            if row:
+                document = _encode({**json.loads(row[0]), **fields})
+                connection.execute("UPDATE settings SET document = ? WHERE id = 'default'", (document,))
+        await self._write(self._transaction, update)
+
+    # Employees
+    async def list_employees(self, active_only=True, projection=None):
+        def read():
+            sql = "SELECT document FROM employees"
+            if active_only:
+                sql += " WHERE is_active = 1"
+            # insertion order, as Mongo's natural order
+            rows = self._connection().execute(sql + " ORDER BY rowid").fetchall()
+            return [_decode_employee(row[0]) for row in rows]
+        return await self._read(read)
+
+    async def get_employee(self, employee_id, active_only=True):
+        def read():
+            sql = "SELECT document FROM employees WHERE id = ?"
+            if active_only:
+                sql += " AND is_active = 1"
+            row = self._connection().execute(sql, (employee_id,)).fetchone()
+            return _decode_employee(row[0]) if row else None
+        return await self._read(read)
+
+    async def insert_employee(self, employee):
+        def insert(connection):
+            connection.execute(
+                "INSERT INTO employees (id, is_active, document) VALUES (?, ?, ?)",
+                (employee["id"], int(employee.get("isActive", True)), _encode(employee))
+            )
+        await self._write(self._transaction, insert)
+
+    async def update_employee(self, employee_id, fields, active_only=True):
+        def update(connection):
+            sql = "SELECT document FROM employees WHERE id = ?"
+            if active_only:
+                sql += " AND is_active = 1"
+            row = connection.execute(sql, (employee_id,)).fetchone()
+            if not row:
+                return None
+            employee = {**_decode_employee(row[0]), **fields}
+            connection.execute(
+                "UPDATE employees SET is_active = ?, document = ? WHERE id = ?",
+                (int(employee.get("isActive", True)), _encode(employee), employee_id)
+            )
+            return employee
+        return await self._write(self._transaction, update)
+
+    # Time entries
+    @staticmethod
+    def _entry_query(employee_id, start_date, end_date, statuses, after, ascending=False):
+        clauses, params = [], []
+        if employee_id:
+            clauses.append("employee_id = ?")
+            params.append(employee_id)
+        for operator, bound in ((">=", start_date), ("<=", end_date)):
+            if bound:
+                clauses.append(f"start_time {operator} ?")
+                params.append(sqlite_time(to_storage(bound)))
+        if statuses:
+            clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if after:
+            start_time, entry_id = after
+            operator = ">" if ascending else "<"
+            clauses.append(f"(start_time, id) {operator} (?, ?)")
+            params.extend([sqlite_time(to_storage(start_time)), entry_id])
+        order = "ASC" if ascending else "DESC"
+        sql = "SELECT document FROM time_entries"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return sql + f" ORDER BY start_time {order}, id {order}", params
+
+    def _select_entries(self, sql: str, params: List[Any], limit: int) -> List[Dict[str, Any]]:
+        if limit:
+            sql += " LIMIT ?"
+            params = [*params, limit]
+        return [_decode_entry(row[0]) for row in self._connection().execute(sql, params).fetchall()]
+
+    async def find_time_entries(self, employee_id=None, start_date=None, end_date=None, statuses=None,
+                                after=None, limit=0, projection=None):
+        sql, params = self._entry_query(employee_id, start_date, end_date, statuses, after)
+        return await self._read(self._select_entries, sql, params, limit)
+
+    async def iter_time_entries(self, employee_id=None, start_date=None, end_date=None, statuses=None,
+                                projection=None, ascending=False):
+        # Keyset pages, so no read transaction stays open between batches
+        after = None
+        while True:
+            sql, params = self._entry_query(employee_id, start_date, end_date, statuses, after, ascending)
+            batch = await self._read(self._select_entries, sql, params, self.batch_size)
+            for entry in batch:
+                yield entry
+            if len(batch) < self.batch_size:
+                return
+            after = (batch[-1]["startTime"], batch[-1]["id"])
+
+    def _open_entry(self, connection, employee_id: str) -> Optional[Dict[str, Any]]:
+        # Spelled as in one_open_entry_per_employee, so that index serves it
+        row = connection.execute(
+            "SELECT document FROM time_entries WHERE employee_id = ? AND status IN ('active', 'on_break')",
+            (employee_id,)
+        ).fetchone()
+        return _decode_entry(row[0]) if row else None
+
+    async def find_open_entry(self, employee_id):
+        return await self._read(lambda: self._open_entry(self._connection(), employee_id))
+
+    def _replace_entry(self, connection, entry: Dict[str, Any]) -> None:
+        connection.execute(
+            "UPDATE time_entries SET employee_id = ?, start_time = ?, status = ?, document = ? WHERE id = ?",
+            (*_entry_row(entry)[1:], entry["id"])
+        )
+
+    async def insert_time_entry(self, entry):
+        def insert(connection):
+            try:
+                connection.execute(
+                    "INSERT INTO time_entries (id, employee_id, start_time, status, document) VALUES (?, ?, ?, ?, ?)",
+                    _entry_row(entry)
+                )
+            except sqlite3.IntegrityError as exc:
+                if not _open_entry_conflict(exc):
+                    raise
+                raise DuplicateOpenEntry(entry["employeeId"])
+        await self._write(self._transaction, insert)
+
+    async def update_time_entry(self, entry_id, fields):
+        def update(connection):
+            row = connection.execute("SELECT document FROM time_entries WHERE id = ?", (entry_id,)).fetchone()
+            if not row:
+                return None
+            previous = _decode_entry(row[0])
+            try:
+                self._replace_entry(connection, {**previous, **fields})
+            except sqlite3.IntegrityError as exc:
+                if not _open_entry_conflict(exc):
+                    raise
+                raise DuplicateOpenEntry(previous["employeeId"])
+            return previous
+        return await self._write(self._transaction, update)
+
+    async def delete_time_entry(self, entry_id):
+        def delete(connection):
+            row = connection.execute("SELECT document FROM time_entries WHERE id = ?", (entry_id,)).fetchone()
+            if not row:
+                return None
+            connection.execute("DELETE FROM time_entries WHERE id = ?", (entry_id,))
+            return _decode_entry(row[0])
+        return await self._write(self._transaction, delete)
+
+    async def _transition(
+        self, employee_id: str, statuses: Sequence[str], change, before: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        # Read and write in one transaction on the writer thread, so taps of
+        # the same employee apply one after the other as Mongo's do
+        def apply(connection):
+            entry = self._open_entry(connection, employee_id)
+            if entry is None or entry["status"] not in statuses:
+                return None
+            changed = change(entry)
+            self._replace_entry(connection, changed)
+            return entry if before else changed
+        return await self._write(self._transaction, apply)
+
+    async def clock_out(self, employee_id, now):
+        return await self._transition(
+            employee_id, OPEN_STATUSES, lambda entry: {**entry, "endTime": now, "status": "completed"}, before=True
+        )
+
+    async def start_break(self, employee_id, now):
+        return await self._transition(employee_id, ["active"], lambda entry: {
+            **entry,
+            "breaks": [*entry["breaks"], {"startTime": now, "endTime": None}],
+            "status": "on_break",
+        })
+
+    async def end_break(self, employee_id, now):
+        return await self._transition(employee_id, ["on_break"], lambda entry: {
+            **entry,
+            "breaks": [
+                {**item, "endTime": now} if item.get("endTime") is None else item
+                for item in entry["breaks"]
+            ],
+            "status": "active",
+        })
@@ -0,0 +1,163 @@
+"""Idempotent ingestion of operations queued by offline kiosks.
+
+Every queued clock event carries a client-generated idempotency key. Keys
+are claimed by inserting a pending receipt whose ``_id`` is the key, so the
+unique ``_id`` index makes a retried or concurrently replayed operation lose
+the claim instead of being applied twice. Receipts then record the outcome,
+and expire after ``SYNC_RECEIPT_TTL``. A key that lost the claim is acked
+by the status of its receipt:
+
+- ``applied``: ``duplicate``, it was applied once already;
+- ``rejected``: ``rejected`` again, with the recorded error;
+- ``pending``: ``retry``, another request is applying it. So are the later
+  operations of the same employee, which must not be applied before it.
+
+A worker dying between claiming and applying leaves its receipts pending;
+they are claimed again once older than ``SYNC_CLAIM_LEASE``.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from clock_batch import CONFLICT
+
+SYNC_RECEIPTS = "sync_receipts"
+SYNC_RECEIPT_TTL = 30 * 24 * 3600  # seconds
+# A pending receipt older than this was left by a worker that died
+SYNC_CLAIM_LEASE = 5 * 60  # seconds
+
+DUPLICATE_KEY = 11000
+
+
+async def claim_keys(
+    db, keys: List[str], device_id: Optional[str]
+) -> Tuple[List[str], Dict[str, Dict[str, Any]]]:
+    """Insert pending receipts for ``keys``.
+
+    Returns the keys this call now owns, and the receipts of the others.
+    """
+    if not keys:
+        return [], {}
+    now = datetime.utcnow()
+    receipts = [
+        {"_id": key, "deviceId": device_id, "status": "pending", "receivedAt": now, "claimedAt": now}
+        for key in keys
+    ]
+    taken = set()
+    try:
+        await db[SYNC_RECEIPTS].insert_many(receipts, ordered=False)
+    except BulkWriteError as exc:
+        errors = exc.details.get("writeErrors", [])
+        if any(error["code"] != DUPLICATE_KEY for error in errors):
+            raise
+        taken = {keys[error["index"]] for error in errors}
+    if not taken:
+        return keys, {}
+
+    existing = {
+        receipt["_id"]: receipt
+        for receipt in await db[SYNC_RECEIPTS].find({"_id": {"$in": list(taken)}}).to_list(None)
+    }
+    stale = now - timedelta(seconds=SYNC_CLAIM_LEASE)
+    for key, receipt in list(existing.items()):
+        if receipt["status"] != "pending" or receipt.get("claimedAt", receipt["receivedAt"]) > stale:
+            continue
+        # Take over the lease, unless another request just did
+        result = await db[SYNC_RECEIPTS].update_one(
+            {"_id": key, "status": "pending", "claimedAt": receipt.get("claimedAt")},
+            {"$set": {"deviceId": device_id, "claimedAt": now}}
+        )
+        if result.modified_count:
+            taken.discard(key)
+            del existing[key]
+    # Expired in between: claimed again on the next sync
+    for key in taken - set(existing):
+        existing[key] = {"_id": key, "status": "pending"}
+    return [key for key in keys if key not in taken], existing
+
+
+async def ingest(
+    db,
+    operations: List[Dict[str, Any]],
+    device_id: Optional[str],
+    apply_events: Callable[[List[Dict[str, Any]]], Awaitable[Any]],
+) -> Dict[str, Any]:
+    """Apply queued clock events once each and return the ack map.
+
+    ``apply_events`` plans and executes clock events in order (see
+    ``clock_batch``) and returns the plan with one result per event.
+    """
+    acks: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+
+    # Keep the first occurrence of a key repeated within the batch
+    unique = []
+    seen = set()
+    for operation in operations:
+        if operation["key"] not in seen:
+            seen.add(operation["key"])
+            unique.append(operation)
+
+    owned, receipts = await claim_keys(db, [operation["key"] for operation in unique], device_id)
+    owned = set(owned)
+    claimed = []
+    released = []
+    waiting = set()  # employees with an operation still pending elsewhere
+    for operation in unique:
+        key = operation["key"]
+        if key in owned and operation["employeeId"] not in waiting:
+            claimed.append(operation)
+            continue
+        if key in owned:
+            released.append(key)
+        elif receipts[key]["status"] == "applied":
+            acks[key] = "duplicate"
+            continue
+        elif receipts[key]["status"] == "rejected":
+            acks[key] = "rejected"
+            errors[key] = receipts[key].get("error")
+            continue
+        acks[key] = "retry"
+        waiting.add(operation["employeeId"])
+    if released:
+        await db[SYNC_RECEIPTS].delete_many({"_id": {"$in": released}, "status": "pending"})
+    if not claimed:
+        return {"acks": acks, "errors": errors}
+
+    try:
+        plan = await apply_events([
+            {"employeeId": op["employeeId"], "action": op["action"], "timestamp": op.get("timestamp")}
+            for op in claimed
+        ])
+    except Exception:
+        await db[SYNC_RECEIPTS].delete_many(
+            {"_id": {"$in": [op["key"] for op in claimed]}, "status": "pending"}
+        )
+        raise
+
+    receipt_updates = []
+    for operation, result in zip(claimed, plan.results):
+        key = operation["key"]
+        if result["ok"]:
+            acks[key] = "applied"
+            receipt_updates.append(UpdateOne(
+                {"_id": key},
+                {"$set": {"status": "applied", "entryId": result["entryId"]}}
+            ))
+        elif result.get("code") == CONFLICT:
+            # Down to a concurrent writer, not the operation: released so
+            # the kiosk sends it again
+            acks[key] = "retry"
+            errors[key] = result["error"]
+            receipt_updates.append(DeleteOne({"_id": key}))
+        else:
+            acks[key] = "rejected"
+            errors[key] = result["error"]
+            receipt_updates.append(UpdateOne(
+                {"_id": key},
+                {"$set": {"status": "rejected", "error": result["error"]}}
+            ))
+    await db[SYNC_RECEIPTS].bulk_write(receipt_updates, ordered=False)
+    return {"acks": acks, "errors": errors}
@@ -0,0 +1,112 @@
+"""Time arithmetic shared by the stats, rollup and export code paths.
+
+Time entries store ``startTime``, ``endTime`` and break times as BSON dates
+(naive UTC, millisecond precision). Entries written before that stored ISO
+strings; until ``migrate_timestamps.py`` has converted them every reader
+accepts both, and range queries match both (see ``timestamp_range``).
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+# Statuses of a time entry that is still running; an employee has at most one.
+OPEN_STATUSES = ["active", "on_break"]
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """Return a naive UTC datetime for an ISO string or a datetime.
+
+    Entries written by the clock endpoints are naive UTC; entries created by
+    clients may carry an offset, which is normalised so both kinds compare.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def truncate_to_ms(dt: datetime) -> datetime:
+    return dt.replace(microsecond=dt.microsecond // 1000 * 1000)
+
+
+def utc_now() -> datetime:
+    """The current time as it will read back from Mongo."""
+    return truncate_to_ms(datetime.utcnow())
+
+
+def to_storage(value: Any) -> Optional[datetime]:
+    """Storage form of a timestamp given as an ISO string or a datetime."""
+    dt = parse_timestamp(value)
+    return truncate_to_ms(dt) if dt else None
+
+
+def storage_times(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a (partial) time entry with its timestamps in storage form."""
+    converted = dict(entry)
+    for name in ("startTime", "endTime"):
+        if name in converted:
+            converted[name] = to_storage(converted[name])
+    if converted.get("breaks") is not None:
+        converted["breaks"] = [
+            {**item, "startTime": to_storage(item.get("startTime")), "endTime": to_storage(item.get("endTime"))}
+            for item in converted["breaks"]
+        ]
+    return converted
+
+
+def timestamp_range(
+    field: str, start: Optional[str] = None, end: Optional[str] = None, legacy_strings: bool = True
+) -> Dict[str, Any]:
+    """Query for ``start <= field <= end`` on stored timestamps.
+
+    Mongo compares values of the same BSON type only, so while unmigrated
+    entries remain the range is also matched against the ISO strings, with
+    the bounds as given (the lexicographic comparison used so far). Raises
+    ``ValueError`` for bounds that are not ISO dates.
+    """
+    dates: Dict[str, Any] = {}
+    strings: Dict[str, Any] = {}
+    for operator, bound in (("$gte", start), ("$lte", end)):
+        if bound:
+            dates[operator] = to_storage(bound)
+            strings[operator] = bound
+    if not dates:
+        return {}
+    if not legacy_strings:
+        return {field: dates}
+    return {"$or": [{field: dates}, {field: strings}]}
+
+
+def break_seconds(entry: Dict[str, Any]) -> float:
+    """Total length of the closed breaks of an entry, in seconds."""
+    total = 0.0
+    for item in entry.get("breaks") or []:
+        start = parse_timestamp(item.get("startTime"))
+        end = parse_timestamp(item.get("endTime"))
+        if start and end and end > start:
+            total += (end - start).total_seconds()
+    return total
+
+
+def entry_seconds(entry: Dict[str, Any]) -> Tuple[float, float]:
+    """Return ``(worked, break)`` seconds for a time entry.
+
+    Worked time is the clocked span minus closed breaks and is only counted
+    once the entry has an end time; breaks are counted as soon as they close.
+    """
+    breaks = break_seconds(entry)
+    start = parse_timestamp(entry.get("startTime"))
+    end = parse_timestamp(entry.get("endTime"))
+    if not start or not end:
+        return 0.0, breaks
+    span = max(0.0, (end - start).total_seconds())
+    return max(0.0, span - breaks), breaks
+
+
+def entry_day(entry: Dict[str, Any]) -> str:
+    """UTC day (``YYYY-MM-DD``) an entry is attributed to: the day it started."""
+    return parse_timestamp(entry["startTime"]).date().isoformat()
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import requests
+import csv
+import io
 import json
 import time
 from datetime import datetime
@@ -86,7 +88,9 @@ class TimeTrackerAPITest(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         data = response.json()
         self.assertEqual(data["status"], "healthy")
-        print("✅ Health check successful")
+        self.assertGreater(data["database"]["pingMs"], 0)
+        self.assertIn("pool", data["database"])
+        print(f"✅ Health check successful (ping {data['database']['pingMs']} ms)")
     
     def test_02_admin_authentication(self):
         """Test admin authentication"""
@@ -427,6 +431,397 @@ class TimeTrackerAPITest(unittest.TestCase):
         print(f"  - Top Employees: {len(stats['topEmployees'])}")
         print(f"  - Daily Breakdown: {len(stats['dailyBreakdown'])} days")
 
+    def test_09_statistics_follow_entry_changes(self):
+        """Test statistics are updated by time entry creation and deletion"""
+        print("\n--- Testing Statistics Rollups ---")
+        
+        response = requests.post(f"{BACKEND_URL}/employees", json=self.test_employees[0])
+        self.assertEqual(response.status_code, 200)
+        employee_id = response.json()["id"]
+        self.employee_ids.append(employee_id)
+        
+        today = datetime.utcnow().date().isoformat()
+        
+        def today_hours():
+            response = requests.get(f"{BACKEND_URL}/stats")
+            self.assertEqual(response.status_code, 200)
+            return next(day["hours"] for day in response.json()["dailyBreakdown"] if day["date"] == today)
+        
+        hours_before = today_hours()
+        
+        # A completed two hour entry started at midnight today
+        response = requests.post(
+            f"{BACKEND_URL}/time-entries",
+            json={
+                "employeeId": employee_id,
+                "startTime": f"{today}T00:00:00",
+                "endTime": f"{today}T02:00:00",
+                "status": "completed"
+            }
+        )
+        self.assertEqual(response.status_code, 200)
+        entry_id = response.json()["id"]
+        self.assertAlmostEqual(today_hours(), hours_before + 2, delta=0.1)
+        print("✅ Created entry reflected in daily breakdown")
+        
+        response = requests.delete(f"{BACKEND_URL}/time-entries/{entry_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertAlmostEqual(today_hours(), hours_before, delta=0.1)
+        print("✅ Deleted entry removed from daily breakdown")
+
+    def test_10_time_entries_pagination_and_stream(self):
+        """Test keyset pagination and NDJSON streaming of time entries"""
+        print("\n--- Testing Time Entries Pagination ---")
+        
+        response = requests.post(f"{BACKEND_URL}/employees", json=self.test_employees[1])
+        self.assertEqual(response.status_code, 200)
+        employee_id = response.json()["id"]
+        self.employee_ids.append(employee_id)
+        
+        created_ids = set()
+        for day in ("2024-01-08", "2024-01-09", "2024-01-10"):
+            response = requests.post(
+                f"{BACKEND_URL}/time-entries",
+                json={
+                    "employeeId": employee_id,
+                    "startTime": f"{day}T09:00:00",
+                    "endTime": f"{day}T17:00:00",
+                    "status": "completed"
+                }
+            )
+            self.assertEqual(response.status_code, 200)
+            created_ids.add(response.json()["id"])
+        
+        # Walk the pages two entries at a time
+        seen = []
+        cursor = None
+        while True:
+            params = {"employee_id": employee_id, "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = requests.get(f"{BACKEND_URL}/time-entries/page", params=params)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            seen.extend(entry["id"] for entry in page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 3)
+        self.assertEqual(set(seen), created_ids)
+        print("✅ Pagination returned every entry exactly once")
+        
+        response = requests.get(f"{BACKEND_URL}/time-entries/page", params={"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+        print("✅ Invalid cursor rejected")
+        
+        response = requests.get(f"{BACKEND_URL}/time-entries/stream", params={"employee_id": employee_id})
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in response.text.splitlines() if line]
+        self.assertEqual([row["id"] for row in rows], seen)
+        print("✅ NDJSON stream matches paginated order")
+        
+        for entry_id in created_ids:
+            requests.delete(f"{BACKEND_URL}/time-entries/{entry_id}")
+
+    def test_11_export_time_entries_csv(self):
+        """Test the streamed CSV payroll export"""
+        print("\n--- Testing CSV Export ---")
+        
+        response = requests.post(f"{BACKEND_URL}/employees", json=self.test_employees[0])
+        self.assertEqual(response.status_code, 200)
+        employee = response.json()
+        self.employee_ids.append(employee["id"])
+        
+        response = requests.post(
+            f"{BACKEND_URL}/time-entries",
+            json={
+                "employeeId": employee["id"],
+                "startTime": "2024-02-05T08:00:00",
+                "endTime": "2024-02-05T17:00:00",
+                "breaks": [{"startTime": "2024-02-05T12:00:00", "endTime": "2024-02-05T13:00:00"}],
+                "status": "completed"
+            }
+        )
+        self.assertEqual(response.status_code, 200)
+        entry_id = response.json()["id"]
+        
+        response = requests.get(
+            f"{BACKEND_URL}/exports/time-entries",
+            params={"format": "csv", "employee_id": employee["id"]}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("text/csv", response.headers["content-type"])
+        rows = list(csv.reader(io.StringIO(response.content.decode("utf-8"))))
+        self.assertEqual(len(rows), 2)
+        row = dict(zip(rows[0], rows[1]))
+        self.assertEqual(row["Employé"], employee["name"])
+        self.assertEqual(float(row["Heures travaillées"]), 8.0)
+        self.assertEqual(float(row["Heures de pause"]), 1.0)
+        self.assertAlmostEqual(float(row["Coût"]), 8.0 * employee["hourlyRate"], places=2)
+        print("✅ CSV export computes worked hours, breaks and cost")
+        
+        requests.delete(f"{BACKEND_URL}/time-entries/{entry_id}")
+
+    def test_12_conditional_get(self):
+        """Test ETag / If-None-Match on the roster and settings"""
+        print("\n--- Testing Conditional GET ---")
+        
+        for path in ("employees", "settings"):
+            response = requests.get(f"{BACKEND_URL}/{path}")
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers.get("ETag")
+            self.assertIsNotNone(etag)
+            
+            response = requests.get(f"{BACKEND_URL}/{path}", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            print(f"✅ /{path} answered 304 for a current ETag")
+        
+        # A mutation changes the roster ETag
+        etag = requests.get(f"{BACKEND_URL}/employees").headers["ETag"]
+        response = requests.post(f"{BACKEND_URL}/employees", json=self.test_employees[2])
+        self.assertEqual(response.status_code, 200)
+        self.employee_ids.append(response.json()["id"])
+        
+        response = requests.get(f"{BACKEND_URL}/employees", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        print("✅ Roster ETag changed after creating an employee")
+
+    def test_13_clock_events_batch(self):
+        """Test batched clock events with per-event results"""
+        print("\n--- Testing Clock Events Batch ---")
+        
+        employee_ids = []
+        for employee_data in self.test_employees[:2]:
+            response = requests.post(f"{BACKEND_URL}/employees", json=employee_data)
+            self.assertEqual(response.status_code, 200)
+            employee_ids.append(response.json()["id"])
+        self.employee_ids.extend(employee_ids)
+        first, second = employee_ids
+        
+        response = requests.post(
+            f"{BACKEND_URL}/clock-events/batch",
+            json={"events": [
+                {"employeeId": first, "action": "clock_in"},
+                {"employeeId": second, "action": "clock_in"},
+                {"employeeId": first, "action": "clock_in"},
+                {"employeeId": first, "action": "start_break"},
+                {"employeeId": "unknown-employee", "action": "clock_in"},
+                {"employeeId": second, "action": "clock_out"}
+            ]}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["applied"], 4)
+        self.assertEqual(data["failed"], 2)
+        self.assertEqual(
+            [result["ok"] for result in data["results"]],
+            [True, True, False, True, False, True]
+        )
+        self.assertEqual(data["results"][2]["error"], "Employee already clocked in")
+        self.assertEqual(data["results"][4]["error"], "Employee not found")
+        print("✅ Batch applied valid events and reported the invalid ones")
+        
+        response = requests.get(f"{BACKEND_URL}/time-entries?employee_id={first}&status=on_break")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+        response = requests.get(f"{BACKEND_URL}/time-entries?employee_id={second}&status=completed")
+        self.assertEqual(len(response.json()), 1)
+        print("✅ Batch transitions persisted")
+        
+        requests.post(f"{BACKEND_URL}/clock-out/{first}")
+
+    def test_14_offline_sync_is_idempotent(self):
+        """Test replaying an offline queue twice applies it once"""
+        print("\n--- Testing Offline Sync ---")
+        
+        response = requests.post(f"{BACKEND_URL}/employees", json=self.test_employees[0])
+        self.assertEqual(response.status_code, 200)
+        employee_id = response.json()["id"]
+        self.employee_ids.append(employee_id)
+        
+        prefix = f"test-{employee_id}"
+        payload = {
+            "deviceId": "kiosk-test",
+            "operations": [
+                {"key": f"{prefix}-1", "employeeId": employee_id, "action": "clock_in",
+                 "timestamp": "2024-03-04T08:00:00"},
+                {"key": f"{prefix}-2", "employeeId": employee_id, "action": "clock_out",
+                 "timestamp": "2024-03-04T16:00:00"},
+                {"key": f"{prefix}-3", "employeeId": employee_id, "action": "clock_out",
+                 "timestamp": "2024-03-04T16:05:00"}
+            ]
+        }
+        
+        response = requests.post(f"{BACKEND_URL}/sync", json=payload)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["acks"][f"{prefix}-1"], "applied")
+        self.assertEqual(data["acks"][f"{prefix}-2"], "applied")
+        self.assertEqual(data["acks"][f"{prefix}-3"], "rejected")
+        self.assertIn(f"{prefix}-3", data["errors"])
+        print("✅ First sync applied the queue")
+        
+        response = requests.post(f"{BACKEND_URL}/sync", json=payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()["acks"].values()), {"duplicate"})
+        
+        response = requests.get(f"{BACKEND_URL}/time-entries?employee_id={employee_id}")
+        entries = response.json()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]["status"], "completed")
+        print("✅ Replayed sync was acknowledged without duplicates")
+        
+        requests.delete(f"{BACKEND_URL}/time-entries/{entries[0]['id']}")
+
+    def test_15_presence_board(self):
+        """Test the in-memory presence board follows clock taps"""
+        print("\n--- Testing Presence Board ---")
+        
+        response = requests.post(f"{BACKEND_URL}/employees", json=self.test_employees[1])
+        self.assertEqual(response.status_code, 200)
+        employee_id = response.json()["id"]
+        self.employee_ids.append(employee_id)
+        
+        response = requests.get(f"{BACKEND_URL}/presence/{employee_id}")
+        self.assertEqual(response.json()["status"], "out")
+        
+        requests.post(f"{BACKEND_URL}/clock-in/{employee_id}")
+        self.assertEqual(requests.get(f"{BACKEND_URL}/presence/{employee_id}").json()["status"], "active")
+        
+        requests.post(f"{BACKEND_URL}/start-break/{employee_id}")
+        self.assertEqual(requests.get(f"{BACKEND_URL}/presence/{employee_id}").json()["status"], "on_break")
+        
+        response = requests.get(f"{BACKEND_URL}/presence")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(employee_id, [state["employeeId"] for state in response.json()["present"]])
+        
+        requests.post(f"{BACKEND_URL}/clock-out/{employee_id}")
+        self.assertEqual(requests.get(f"{BACKEND_URL}/presence/{employee_id}").json()["status"], "out")
+        print("✅ Presence followed clock-in, break and clock-out")
+        
+        response = requests.get(f"{BACKEND_URL}/presence/check")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("consistent", response.json())
+        print("✅ Presence consistency check available")
+
+    def test_16_timesheet_report(self):
+        """Test worked, break, overtime and cost totals of the timesheet report"""
+        print("\n--- Testing Timesheet Report ---")
+        
+        response = requests.post(f"{BACKEND_URL}/employees", json=self.test_employees[0])
+        self.assertEqual(response.status_code, 200)
+        employee_id = response.json()["id"]
+        self.employee_ids.append(employee_id)
+        
+        # 11 hours on the clock with a one hour break, scheduled 08:00-17:00 with 30 minutes
+        response = requests.post(
+            f"{BACKEND_URL}/time-entries",
+            json={
+                "employeeId": employee_id,
+                "startTime": "2024-03-04T07:00:00",
+                "endTime": "2024-03-04T18:00:00",
+                "breaks": [{"startTime": "2024-03-04T12:00:00", "endTime": "2024-03-04T13:00:00"}],
+                "status": "completed"
+            }
+        )
+        self.assertEqual(response.status_code, 200)
+        
+        response = requests.get(f"{BACKEND_URL}/reports/timesheet", params={"employee_id": employee_id})
+        self.assertEqual(response.status_code, 200)
+        row = response.json()["employees"][0]
+        self.assertEqual(row["workedHours"], 10.0)
+        self.assertEqual(row["breakHours"], 1.0)
+        self.assertEqual(row["overtimeHours"], 1.5)
+        self.assertEqual(row["cost"], 255.0)
+        print("✅ Timesheet report totals computed")
+
+    def test_17_timestamps_normalised_to_utc(self):
+        """Test time entry timestamps are stored and returned as UTC"""
+        print("\n--- Testing Timestamp Storage ---")
+        
+        response = requests.post(f"{BACKEND_URL}/employees", json=self.test_employees[2])
+        self.assertEqual(response.status_code, 200)
+        employee_id = response.json()["id"]
+        self.employee_ids.append(employee_id)
+        
+        response = requests.post(
+            f"{BACKEND_URL}/time-entries",
+            json={
+                "employeeId": employee_id,
+                "startTime": "2024-04-02T09:00:00+02:00",
+                "endTime": "2024-04-02T17:30:00Z",
+                "status": "completed"
+            }
+        )
+        self.assertEqual(response.status_code, 200)
+        entry = response.json()
+        self.assertTrue(entry["startTime"].startswith("2024-04-02T07:00:00"))
+        self.assertTrue(entry["endTime"].startswith("2024-04-02T17:30:00"))
+        print("✅ Offsets normalised to UTC")
+        
+        response = requests.get(
+            f"{BACKEND_URL}/time-entries",
+            params={"employee_id": employee_id, "start_date": "2024-04-02", "end_date": "2024-04-03"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["id"] for item in response.json()], [entry["id"]])
+        print("✅ Date range query matches stored dates")
+        
+        response = requests.get(f"{BACKEND_URL}/time-entries", params={"start_date": "not-a-date"})
+        self.assertEqual(response.status_code, 400)
+        print("✅ Invalid date rejected")
+
+    def test_18_range_statistics(self):
+        """Test ranged statistics grouped by week and month"""
+        print("\n--- Testing Range Statistics ---")
+        
+        response = requests.post(f"{BACKEND_URL}/employees", json=self.test_employees[0])
+        self.assertEqual(response.status_code, 200)
+        employee_id = response.json()["id"]
+        self.employee_ids.append(employee_id)
+        
+        for day in ("2023-01-30", "2023-01-31", "2023-02-01"):
+            response = requests.post(
+                f"{BACKEND_URL}/time-entries",
+                json={
+                    "employeeId": employee_id,
+                    "startTime": f"{day}T08:00:00",
+                    "endTime": f"{day}T10:00:00",
+                    "status": "completed"
+                }
+            )
+            self.assertEqual(response.status_code, 200)
+        
+        params = {"from": "2023-01-30", "to": "2023-02-05", "employeeId": employee_id}
+        response = requests.get(f"{BACKEND_URL}/stats", params={**params, "groupBy": "month"})
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()
+        self.assertEqual([period["period"] for period in stats["periods"]], ["2023-01", "2023-02"])
+        self.assertEqual([period["hours"] for period in stats["periods"]], [4.0, 2.0])
+        self.assertEqual(stats["totals"]["entries"], 3)
+        print("✅ Monthly periods clipped to the range")
+        
+        # Served from the day cache the second time; an edit must still show
+        response = requests.post(
+            f"{BACKEND_URL}/time-entries",
+            json={
+                "employeeId": employee_id,
+                "startTime": "2023-02-01T14:00:00",
+                "endTime": "2023-02-01T15:00:00",
+                "status": "completed"
+            }
+        )
+        self.assertEqual(response.status_code, 200)
+        response = requests.get(f"{BACKEND_URL}/stats", params={**params, "groupBy": "week"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["totals"]["hours"], 7.0)
+        print("✅ Cached past days invalidated by edits")
+        
+        response = requests.get(f"{BACKEND_URL}/stats", params={"to": "2023-02-05"})
+        self.assertEqual(response.status_code, 400)
+        print("✅ Range without a start rejected")
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
\ No newline at end of file
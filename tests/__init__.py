@@ -0,0 +1,6 @@
+"""Backend tests; the backend modules import each other as top-level modules."""
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
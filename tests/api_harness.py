@@ -0,0 +1,303 @@
+"""In-process, concurrent harness for the backend API.
+
+Each ``ApiHarness`` loads its own copy of ``backend/server.py`` (own app,
+caches, broker and presence board) against its own store, and talks to it
+through ``httpx.AsyncClient`` over ``ASGITransport``: no uvicorn, no
+network, and no clean-up between tests since the store is thrown away.
+Harnesses don't share state, so scenarios can run side by side::
+
+    async with ApiHarness() as api:
+        employees = await api.seed_employees(50)
+        responses = await api.hammer("POST", f"/clock-in/{employees[0]['id']}", times=20)
+
+``TEST_STORAGE`` picks the store: ``sqlite`` (the default, a temporary
+file, nothing to install), ``mongo``, a database named
+``timetracker_test_<random>`` on ``MONGO_URL`` that is dropped afterwards,
+or ``mongomock``, the same in memory with the mongomock-motor package (no
+change streams, so the broker publishes in-process; no ``arrayFilters`` or
+``$lookup`` pipelines, so ending a break and the dashboard stats fail
+there). Batched clock events and offline sync need Mongo; their tests run
+on ``MONGO_STORAGE``.
+"""
+import asyncio
+import contextlib
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+from tests import BACKEND_DIR
+
+try:
+    import mongomock_motor
+except ImportError:  # mongomock storage unavailable
+    mongomock_motor = None
+
+TEST_STORAGE = os.environ.get('TEST_STORAGE', 'sqlite').lower()
+# Store for the Mongo-only features: the one under test if it is Mongo,
+# else mongomock when it is installed (None: those tests are skipped)
+MONGO_STORAGE = TEST_STORAGE if TEST_STORAGE.startswith("mongo") else ("mongomock" if mongomock_motor else None)
+
+
+def load_server(env: Dict[str, str], motor_client: Optional[type] = None):
+    """A fresh instance of the server module, configured from ``env``.
+
+    server.py reads its configuration at import time, so the variables are
+    set only while it executes; the sibling modules it imports are shared.
+    ``motor_client`` stands in for ``AsyncIOMotorClient`` the same way.
+    """
+    import motor.motor_asyncio
+
+    saved = {name: os.environ.get(name) for name in env}
+    saved_client = motor.motor_asyncio.AsyncIOMotorClient
+    os.environ.update(env)
+    if motor_client is not None:
+        motor.motor_asyncio.AsyncIOMotorClient = motor_client
+    try:
+        spec = importlib.util.spec_from_file_location(
+            f"server_{uuid.uuid4().hex}", BACKEND_DIR / "server.py"
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        motor.motor_asyncio.AsyncIOMotorClient = saved_client
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    # server.py logs at INFO, which would log every request
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return module
+
+
+async def _no_change_stream(db) -> None:
+    pass
+
+
+async def _recreate_partial_indexes(db) -> None:
+    # mongomock's create_indexes drops partialFilterExpression, which would
+    # apply one_open_entry_per_employee to completed entries; create_index keeps it
+    from indexes import INDEXES
+
+    for collection, models in INDEXES.items():
+        for model in models:
+            options = dict(model.document)
+            if "partialFilterExpression" not in options:
+                continue
+            keys = list(options.pop("key").items())
+            await db[collection].drop_index(options["name"])
+            await db[collection].create_index(keys, **options)
+
+
+class ApiHarness:
+    def __init__(self, storage: str = TEST_STORAGE, env: Optional[Dict[str, str]] = None):
+        self.storage = storage
+        self.env = dict(env or {})
+        self.server = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self._directory: Optional[str] = None
+        self._db_name: Optional[str] = None
+
+    async def __aenter__(self) -> "ApiHarness":
+        env = dict(self.env)
+        motor_client = None
+        if self.storage == "sqlite":
+            self._directory = tempfile.mkdtemp(prefix="timetracker-test-")
+            env.update(STORAGE_BACKEND="sqlite", SQLITE_PATH=os.path.join(self._directory, "test.sqlite3"))
+        elif self.storage in ("mongo", "mongomock"):
+            self._db_name = f"timetracker_test_{uuid.uuid4().hex[:12]}"
+            env.update(STORAGE_BACKEND="mongo", DB_NAME=self._db_name)
+            if self.storage == "mongomock":
+                if mongomock_motor is None:
+                    raise ValueError("The mongomock test storage needs the mongomock-motor package")
+                motor_client = mongomock_motor.AsyncMongoMockClient
+                env.setdefault("MONGO_URL", "mongodb://mongomock")
+        else:
+            raise ValueError(f"Unknown test storage: {self.storage}")
+        self.server = load_server(env, motor_client)
+        if self.storage == "mongomock":
+            self.server.broker.start = _no_change_stream
+        try:
+            await self.server.startup_event()
+            if self.storage == "mongomock":
+                await _recreate_partial_indexes(self.server.db)
+        except BaseException:
+            self._discard()
+            raise
+        transport = httpx.ASGITransport(app=self.server.app)
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test/api", timeout=30)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.client.aclose()
+        if self._db_name:
+            await self.server.client.drop_database(self._db_name)
+        await self.server.shutdown_event()
+        self._discard()
+
+    def _discard(self) -> None:
+        if self._directory:
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+    # Requests
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        return await self.client.request(method, path, **kwargs)
+
+    async def hammer(self, method: str, path: str, times: int = 20, **kwargs) -> List[httpx.Response]:
+        """Send the same request ``times`` times at once."""
+        return list(await asyncio.gather(
+            *(self.client.request(method, path, **kwargs) for _ in range(times))
+        ))
+
+    @contextlib.asynccontextmanager
+    async def event_stream(self, path: str = "/events") -> AsyncIterator["EventStream"]:
+        """Subscribe to a Server-Sent Events endpoint until the block exits.
+
+        httpx's ASGITransport waits for the whole body, which never comes, so
+        this drives the app over ASGI itself. The client reads one frame at a
+        time: until the test calls ``next_event``, the server is stuck sending
+        the frame before, like it would be on a slow connection.
+        """
+        stream = EventStream()
+        started = False
+
+        async def receive():
+            nonlocal started
+            if not started:
+                started = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await stream.closed.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                stream.status = message["status"]
+                stream.headers = {key.decode(): value.decode() for key, value in message["headers"]}
+                stream.opened.set()
+            elif message["type"] == "http.response.body" and message.get("body"):
+                await stream.frames.put(message["body"].decode())
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": f"/api{path}", "raw_path": f"/api{path}".encode(),
+            "root_path": "", "query_string": b"", "headers": [(b"host", b"test")],
+            "client": ("127.0.0.1", 50000), "server": ("test", 80),
+        }
+        task = asyncio.create_task(self.server.app(scope, receive, send))
+        try:
+            # Subscribed once the response has started
+            await asyncio.wait_for(stream.opened.wait(), timeout=5)
+            yield stream
+        finally:
+            stream.closed.set()
+            # Unblock a send waiting for the reader
+            while not stream.frames.empty():
+                stream.frames.get_nowait()
+            await asyncio.wait_for(task, timeout=5)
+
+    # Fixtures, written straight to the store rather than through the API
+    async def seed_employees(self, count: int, **fields) -> List[Dict[str, Any]]:
+        employees = [
+            self.server.Employee(
+                name=f"Employee {index}",
+                position="Test",
+                hourlyRate=10.0 + index % 20,
+                **fields
+            ).dict()
+            for index in range(count)
+        ]
+        if self.server.db is not None:
+            await self.server.db.employees.insert_many([dict(employee) for employee in employees])
+        else:
+            for employee in employees:
+                await self.server.storage.insert_employee(employee)
+        self.server.bump_version("employees")
+        return employees
+
+    async def seed_entries(
+        self, employees: Iterable[Dict[str, Any]], per_employee: int, days: int = 30,
+        now: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        """Completed 8-hour entries with a 30-minute break, one per day back from ``now``."""
+        now = now or datetime.utcnow().replace(microsecond=0) - timedelta(days=1)
+        entries = []
+        for employee in employees:
+            for index in range(per_employee):
+                start = now - timedelta(days=index % days, hours=9)
+                entries.append(self.server.TimeEntry(
+                    employeeId=employee["id"],
+                    startTime=start,
+                    endTime=start + timedelta(hours=8),
+                    breaks=[{
+                        "startTime": start + timedelta(hours=4),
+                        "endTime": start + timedelta(hours=4, minutes=30),
+                    }],
+                    status="completed",
+                    createdAt=start
+                ).dict())
+        if self.server.db is not None:
+            from rollups import rebuild_rollups
+
+            if entries:
+                await self.server.db.time_entries.insert_many([dict(entry) for entry in entries], ordered=False)
+            await rebuild_rollups(self.server.db)
+        else:
+            for entry in entries:
+                await self.server.storage.insert_time_entry(entry)
+        return entries
+
+
+class EventStream:
+    """The client end of ``ApiHarness.event_stream``."""
+
+    def __init__(self):
+        self.status: Optional[int] = None
+        self.headers: Dict[str, str] = {}
+        self.frames: "asyncio.Queue[str]" = asyncio.Queue(maxsize=1)
+        self.opened = asyncio.Event()
+        self.closed = asyncio.Event()
+
+    async def next_event(self, timeout: float = 5) -> Dict[str, Any]:
+        """The next event, as ``{"id": ..., "type": ..., **data}``; comments and retry hints are skipped."""
+        while True:
+            frame = await asyncio.wait_for(self.frames.get(), timeout)
+            fields = dict(
+                line.split(": ", 1) for line in frame.strip().splitlines() if not line.startswith(":")
+            )
+            if "event" in fields:
+                return {"id": int(fields["id"]), "type": fields["event"], **json.loads(fields.get("data", "{}"))}
+
+    async def no_event(self, wait: float = 0.2) -> bool:
+        """Whether nothing else arrives within ``wait`` seconds."""
+        try:
+            await self.next_event(timeout=wait)
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+
+async def run_scenarios(
+    scenarios: Iterable[Callable[[ApiHarness], Awaitable[Any]]], storage: str = TEST_STORAGE
+) -> List[Any]:
+    """Run each scenario in its own harness, all at once.
+
+    Returns the scenarios' results in order; the first failure is raised
+    once every scenario has finished.
+    """
+    async def run(scenario):
+        async with ApiHarness(storage) as api:
+            return await scenario(api)
+
+    results = await asyncio.gather(*(run(scenario) for scenario in scenarios), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
@@ -0,0 +1,547 @@
+"""API scenarios run in-process on throwaway stores (see api_harness.py).
+
+    python -m pytest tests
+    TEST_STORAGE=mongo python -m pytest tests    # against MONGO_URL
+"""
+import asyncio
+import unittest
+from collections import Counter
+from datetime import datetime
+
+from pymongo.errors import AutoReconnect
+
+from tests.api_harness import MONGO_STORAGE, ApiHarness, run_scenarios
+
+
+class ApiScenarioTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = await ApiHarness().__aenter__()
+
+    async def asyncTearDown(self):
+        await self.api.__aexit__(None, None, None)
+
+    async def test_admin_authentication(self):
+        response = await self.api.request("POST", "/auth/admin", json={"password": "admin123"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["authenticated"])
+        response = await self.api.request("POST", "/auth/admin", json={"password": "wrong_password"})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_settings_management(self):
+        update = {"companyName": "TimeTracker24 Test", "currency": "USD", "breakDuration": 45}
+        response = await self.api.request("PUT", "/settings", json=update)
+        self.assertEqual(response.status_code, 200)
+        settings = (await self.api.request("GET", "/settings")).json()
+        for field, value in update.items():
+            self.assertEqual(settings[field], value)
+        self.assertNotIn("adminPassword", settings)
+
+    async def test_employee_management(self):
+        response = await self.api.request(
+            "POST", "/employees", json={"name": "Jean Dupont", "position": "Développeur", "hourlyRate": 25.5}
+        )
+        self.assertEqual(response.status_code, 200)
+        employee_id = response.json()["id"]
+
+        response = await self.api.request("PUT", f"/employees/{employee_id}", json={"hourlyRate": 28.5})
+        self.assertEqual(response.json()["hourlyRate"], 28.5)
+        listed = (await self.api.request("GET", "/employees")).json()
+        self.assertEqual([employee["id"] for employee in listed], [employee_id])
+
+        response = await self.api.request("DELETE", f"/employees/{employee_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await self.api.request("GET", "/employees")).json(), [])
+        response = await self.api.request("POST", f"/clock-in/{employee_id}")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_clock_flow(self):
+        [employee] = await self.api.seed_employees(1)
+        employee_id = employee["id"]
+        for action, status in (
+            ("clock-in", "active"), ("start-break", "on_break"), ("end-break", "active"), ("clock-out", "completed")
+        ):
+            response = await self.api.request("POST", f"/{action}/{employee_id}")
+            self.assertEqual(response.status_code, 200, action)
+            self.assertEqual(response.json()["status"], status, action)
+        response = await self.api.request("POST", f"/clock-out/{employee_id}")
+        self.assertEqual(response.status_code, 400)
+
+        presence = (await self.api.request("GET", "/presence")).json()
+        self.assertNotIn(employee_id, {row["employeeId"] for row in presence["present"]})
+
+    async def test_stats_count_the_clocked_shift(self):
+        [employee] = await self.api.seed_employees(1)
+        for action in ("clock-in", "clock-out"):
+            await self.api.request("POST", f"/{action}/{employee['id']}")
+        stats = (await self.api.request("GET", "/stats")).json()
+        self.assertEqual((stats["totalEmployees"], stats["weekEmployees"]), (1, 1))
+        [entry] = (await self.api.request("GET", "/time-entries")).json()
+        day = entry["startTime"][:10]
+        response = await self.api.request("GET", "/stats", params={"from": day, "to": day, "employeeId": employee["id"]})
+        self.assertEqual(response.status_code, 200)
+        [period] = response.json()["periods"]
+        self.assertEqual(period["entries"], 1)
+
+    async def test_range_hours_match_the_dashboard(self):
+        [employee] = await self.api.seed_employees(1)
+        day = datetime.utcnow().date().isoformat()
+        break_ = {"startTime": f"{day}T04:00:00", "endTime": f"{day}T04:30:00"}
+        for entry in (
+            {"startTime": f"{day}T00:00:00", "endTime": f"{day}T03:00:00", "status": "completed"},
+            # Still open: none of its time counts yet, closed break included
+            {"startTime": f"{day}T03:30:00", "breaks": [break_], "status": "active"},
+        ):
+            response = await self.api.request("POST", "/time-entries", json={"employeeId": employee["id"], **entry})
+            self.assertEqual(response.status_code, 200)
+        dashboard = (await self.api.request("GET", "/stats")).json()
+        ranged = (await self.api.request("GET", "/stats", params={"from": day, "to": day})).json()
+        self.assertEqual(dashboard["weeklyHours"], 3.0)
+        self.assertEqual(ranged["totals"]["hours"], 3.0)
+
+    async def test_clock_out_from_a_break_records_the_break(self):
+        [employee] = await self.api.seed_employees(1)
+        recorded = []
+        record_entry_change = self.api.server.record_entry_change
+
+        async def recording(before, after):
+            recorded.append((before, after))
+            await record_entry_change(before, after)
+
+        self.api.server.record_entry_change = recording
+        for action in ("clock-in", "start-break", "clock-out"):
+            await self.api.request("POST", f"/{action}/{employee['id']}")
+        before, after = recorded[-1]
+        self.assertEqual((before["status"], before["endTime"]), ("on_break", None))
+        self.assertEqual(before["breaks"], after["breaks"])
+        self.assertEqual(after["status"], "completed")
+
+    async def test_pages_cover_seeded_entries(self):
+        employees = await self.api.seed_employees(20)
+        entries = await self.api.seed_entries(employees, per_employee=30)
+        seen = []
+        cursor = None
+        while True:
+            params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+            page = (await self.api.request("GET", "/time-entries/page", params=params)).json()
+            seen.extend(entry["id"] for entry in page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted(entry["id"] for entry in entries))
+
+        report = (await self.api.request("GET", "/reports/timesheet")).json()
+        self.assertEqual(report["totals"]["entries"], len(entries))
+
+
+class ClockTransitionTest(unittest.IsolatedAsyncioTestCase):
+    """Clock-out and breaks change the open entry in place and answer with the result."""
+
+    async def asyncSetUp(self):
+        self.api = await ApiHarness().__aenter__()
+        [employee] = await self.api.seed_employees(1)
+        self.employee_id = employee["id"]
+
+    async def asyncTearDown(self):
+        await self.api.__aexit__(None, None, None)
+
+    async def tap(self, action):
+        response = await self.api.request("POST", f"/{action}/{self.employee_id}")
+        self.assertEqual(response.status_code, 200, action)
+        return response.json()
+
+    async def test_breaks_are_appended_and_closed_one_at_a_time(self):
+        await self.tap("clock-in")
+        self.assertEqual([item["endTime"] for item in (await self.tap("start-break"))["breaks"]], [None])
+        first = (await self.tap("end-break"))["breaks"]
+        self.assertIsNotNone(first[0]["endTime"])
+        await self.tap("start-break")
+        breaks = (await self.tap("end-break"))["breaks"]
+        self.assertEqual(len(breaks), 2)
+        self.assertEqual(breaks[0], first[0])
+        self.assertIsNotNone(breaks[1]["endTime"])
+
+        closed = await self.tap("clock-out")
+        self.assertEqual((closed["status"], closed["breaks"]), ("completed", breaks))
+        self.assertIsNotNone(closed["endTime"])
+        [stored] = (await self.api.request("GET", "/time-entries")).json()
+        self.assertEqual(stored, closed)
+
+    async def test_a_correction_during_a_tap_is_kept(self):
+        entry = await self.tap("clock-in")
+        correction = self.api.request("PUT", f"/time-entries/{entry['id']}", json={"notes": "badge forgotten"})
+        await asyncio.gather(correction, self.tap("start-break"))
+        [stored] = (await self.api.request("GET", "/time-entries")).json()
+        self.assertEqual((stored["notes"], stored["status"], len(stored["breaks"])), ("badge forgotten", "on_break", 1))
+
+
+class ClockRaceTest(unittest.IsolatedAsyncioTestCase):
+    """The same employee tapping many times at once, as a double-tapped kiosk does."""
+
+    async def asyncSetUp(self):
+        self.api = await ApiHarness().__aenter__()
+        [employee] = await self.api.seed_employees(1)
+        self.employee_id = employee["id"]
+
+    async def asyncTearDown(self):
+        await self.api.__aexit__(None, None, None)
+
+    async def assertOneSucceeds(self, method, path, times=20, **kwargs):
+        responses = await self.api.hammer(method, path, times=times, **kwargs)
+        statuses = Counter(response.status_code for response in responses)
+        self.assertEqual(statuses, Counter({200: 1, 400: times - 1}), path)
+
+    async def open_entries(self):
+        entries = (await self.api.request("GET", "/time-entries", params={"employee_id": self.employee_id})).json()
+        return [entry for entry in entries if entry["status"] != "completed"]
+
+    async def test_concurrent_clock_in(self):
+        await self.assertOneSucceeds("POST", f"/clock-in/{self.employee_id}")
+        self.assertEqual(len(await self.open_entries()), 1)
+
+    async def test_concurrent_manual_entries(self):
+        await self.assertOneSucceeds(
+            "POST", "/time-entries", json={"employeeId": self.employee_id, "startTime": "2024-01-15T08:00:00"}
+        )
+        self.assertEqual(len(await self.open_entries()), 1)
+
+    async def test_concurrent_breaks_and_clock_out(self):
+        await self.api.request("POST", f"/clock-in/{self.employee_id}")
+        await self.assertOneSucceeds("POST", f"/start-break/{self.employee_id}")
+        await self.assertOneSucceeds("POST", f"/end-break/{self.employee_id}")
+        await self.assertOneSucceeds("POST", f"/clock-out/{self.employee_id}")
+        [entry] = (await self.api.request("GET", "/time-entries")).json()
+        self.assertEqual(entry["status"], "completed")
+        self.assertEqual(len(entry["breaks"]), 1)
+
+    async def test_reopening_an_entry_keeps_one_open_entry(self):
+        await self.api.request("POST", f"/clock-in/{self.employee_id}")
+        closed = (await self.api.request("POST", f"/clock-out/{self.employee_id}")).json()
+        await self.api.request("POST", f"/clock-in/{self.employee_id}")
+        response = await self.api.request("PUT", f"/time-entries/{closed['id']}", json={"status": "active"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(await self.open_entries()), 1)
+
+    async def test_mixed_taps_leave_one_open_entry(self):
+        paths = [f"/{action}/{self.employee_id}" for action in ("clock-in", "start-break", "end-break")] * 10
+        await asyncio.gather(*(self.api.request("POST", path) for path in paths))
+        self.assertLessEqual(len(await self.open_entries()), 1)
+
+
+@unittest.skipUnless(MONGO_STORAGE, "needs MongoDB or the mongomock-motor package")
+class FastResponseTest(unittest.IsolatedAsyncioTestCase):
+    """FAST_RESPONSES encodes documents as read; they must match the models' output."""
+
+    async def asyncSetUp(self):
+        self.api = await ApiHarness(MONGO_STORAGE, env={"FAST_RESPONSES": "true"}).__aenter__()
+
+    async def asyncTearDown(self):
+        await self.api.__aexit__(None, None, None)
+
+    async def test_legacy_entries_are_defaulted(self):
+        # Written before breaks/status existed, with an ISO string timestamp
+        await self.api.server.db.time_entries.insert_one(
+            {"id": "legacy", "employeeId": "employee-1", "startTime": "2024-01-15T08:00:00+01:00"}
+        )
+        [entry] = (await self.api.request("GET", "/time-entries")).json()
+        self.assertEqual(entry["startTime"], "2024-01-15T07:00:00")
+        self.assertEqual((entry["breaks"], entry["status"], entry["endTime"]), ([], "active", None))
+
+    async def test_legacy_employees_are_defaulted(self):
+        # Written before rates and schedules existed
+        await self.api.server.db.employees.insert_one({
+            "id": "legacy", "name": "Jean Dupont", "position": "Développeur", "isActive": True,
+            "createdAt": "2024-01-15T08:00:00+01:00",
+        })
+        [employee] = (await self.api.request("GET", "/employees")).json()
+        self.assertEqual(
+            {name: employee[name] for name in ("hourlyRate", "breakDuration", "startTime", "email", "createdAt")},
+            {"hourlyRate": 0.0, "breakDuration": 30, "startTime": "08:00", "email": None,
+             "createdAt": "2024-01-15T07:00:00"}
+        )
+
+
+@unittest.skipUnless(MONGO_STORAGE, "needs MongoDB or the mongomock-motor package")
+class ClockBatchTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = await ApiHarness(MONGO_STORAGE).__aenter__()
+        [employee] = await self.api.seed_employees(1)
+        self.employee_id = employee["id"]
+
+    async def asyncTearDown(self):
+        await self.api.__aexit__(None, None, None)
+
+    async def test_clock_out_then_in_within_a_batch(self):
+        await self.api.request("POST", f"/clock-in/{self.employee_id}")
+        events = [{"employeeId": self.employee_id, "action": action} for action in ("clock_out", "clock_in")]
+        response = (await self.api.request("POST", "/clock-events/batch", json={"events": events})).json()
+        self.assertEqual((response["applied"], response["failed"]), (2, 0), response["results"])
+        entries = (await self.api.request("GET", "/time-entries")).json()
+        self.assertEqual(sorted(entry["status"] for entry in entries), ["active", "completed"])
+
+
+@unittest.skipUnless(MONGO_STORAGE, "needs MongoDB or the mongomock-motor package")
+class ClockEventLogTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = await ApiHarness(MONGO_STORAGE).__aenter__()
+        [employee] = await self.api.seed_employees(1)
+        self.employee_id = employee["id"]
+
+    async def asyncTearDown(self):
+        await self.api.__aexit__(None, None, None)
+
+    async def test_changes_the_log_cannot_record_are_undone(self):
+        await self.api.request("POST", f"/clock-in/{self.employee_id}")
+
+        async def unavailable(db, changes):
+            raise AutoReconnect("clock_events unreachable")
+
+        self.api.server.append_events = unavailable
+        response = await self.api.request("POST", f"/clock-out/{self.employee_id}")
+        self.assertEqual(response.status_code, 503)
+        [entry] = (await self.api.request("GET", "/time-entries")).json()
+        self.assertEqual(entry["status"], "active")
+        self.assertEqual(self.api.server.presence.get(self.employee_id)["status"], "active")
+
+
+@unittest.skipUnless(MONGO_STORAGE, "needs MongoDB or the mongomock-motor package")
+class SyncTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_sync_is_idempotent(self):
+        async with ApiHarness(MONGO_STORAGE) as api:
+            [employee] = await api.seed_employees(1)
+            operations = [
+                {"key": f"op-{action}", "employeeId": employee["id"], "action": action,
+                 "timestamp": timestamp}
+                for action, timestamp in (
+                    ("clock_in", "2024-01-15T08:00:00Z"), ("clock_out", "2024-01-15T16:00:00Z")
+                )
+            ]
+            sync = {"deviceId": "kiosk-1", "operations": operations}
+            await api.hammer("POST", "/sync", times=10, json=sync)
+            # Batches may split the keys between them, but each applies once;
+            # keys another batch was still applying are acked "retry"
+            for _ in range(5):
+                acks = (await api.request("POST", "/sync", json=sync)).json()["acks"]
+                if "retry" not in acks.values():
+                    break
+            self.assertEqual(acks, {"op-clock_in": "duplicate", "op-clock_out": "duplicate"})
+            [entry] = (await api.request("GET", "/time-entries")).json()
+            self.assertEqual(entry["status"], "completed")
+
+
+class CacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = await ApiHarness().__aenter__()
+
+    async def asyncTearDown(self):
+        await self.api.__aexit__(None, None, None)
+
+    async def revalidate(self, path, etag):
+        # A poll carrying the last ETag: 304, or 200 with the new body
+        return await self.api.request("GET", path, headers={"If-None-Match": etag})
+
+    async def test_unchanged_resources_revalidate_with_304(self):
+        await self.api.seed_employees(3)
+        for path in ("/employees", "/settings"):
+            response = await self.api.request("GET", path)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers["ETag"]
+            self.assertEqual(response.headers["Cache-Control"], "no-cache")
+
+            response = await self.revalidate(path, etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers["ETag"], etag)
+            self.assertEqual(response.content, b"")
+            response = await self.revalidate(path, f'"other", {etag}')
+            self.assertEqual(response.status_code, 304)
+
+    async def test_rendered_body_is_reused(self):
+        await self.api.seed_employees(3)
+        before = self.api.server.rendered_cache.stats()["hits"]
+        responses = [await self.api.request("GET", "/employees") for _ in range(3)]
+        self.assertEqual({response.content for response in responses}, {responses[0].content})
+        stats = (await self.api.request("GET", "/cache/stats")).json()
+        self.assertEqual(stats["rendered"]["hits"] - before, 2)
+
+    async def test_employee_writes_change_the_etag(self):
+        response = await self.api.request("GET", "/employees")
+        etag = response.headers["ETag"]
+        created = (await self.api.request(
+            "POST", "/employees", json={"name": "Jean Dupont", "position": "Développeur", "hourlyRate": 25.5}
+        )).json()
+        employee_id = created["id"]
+
+        for method, body, check in (
+            (None, None, lambda listed: [employee["id"] for employee in listed] == [employee_id]),
+            ("PUT", {"hourlyRate": 28.5}, lambda listed: listed[0]["hourlyRate"] == 28.5),
+            ("DELETE", None, lambda listed: listed == []),
+        ):
+            if method:
+                response = await self.api.request(method, f"/employees/{employee_id}", json=body)
+                self.assertEqual(response.status_code, 200)
+            response = await self.revalidate("/employees", etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etag)
+            self.assertTrue(check(response.json()))
+            etag = response.headers["ETag"]
+
+    async def test_settings_update_changes_the_etag(self):
+        etag = (await self.api.request("GET", "/settings")).headers["ETag"]
+        response = await self.api.request("PUT", "/settings", json={"currency": "USD"})
+        self.assertEqual(response.status_code, 200)
+        response = await self.revalidate("/settings", etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(response.json()["currency"], "USD")
+
+    async def test_identical_content_keeps_the_etag(self):
+        # The ETag digests the body, so a write that changes nothing visible
+        # (or another worker rendering the same roster) yields the same tag
+        [employee] = await self.api.seed_employees(1)
+        etag = (await self.api.request("GET", "/employees")).headers["ETag"]
+        await self.api.request("PUT", f"/employees/{employee['id']}", json={"name": employee["name"]})
+        response = await self.revalidate("/employees", etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class EventStreamTest(unittest.IsolatedAsyncioTestCase):
+    async def test_clock_deltas_are_streamed(self):
+        async with ApiHarness() as api:
+            [employee] = await api.seed_employees(1)
+            employee_id = employee["id"]
+            async with api.event_stream() as stream:
+                self.assertEqual(stream.status, 200)
+                self.assertTrue(stream.headers["content-type"].startswith("text/event-stream"))
+                self.assertEqual(api.server.broker.subscriber_count, 1)
+                for action in ("clock-in", "start-break", "clock-out"):
+                    response = await api.request("POST", f"/{action}/{employee_id}")
+                    self.assertEqual(response.status_code, 200)
+                events = [await stream.next_event() for _ in range(3)]
+                self.assertEqual([event["type"] for event in events], ["clock_in", "start_break", "clock_out"])
+                self.assertEqual([event["status"] for event in events], ["active", "on_break", "completed"])
+                self.assertEqual({event["employeeId"] for event in events}, {employee_id})
+                self.assertEqual(len({event["entryId"] for event in events}), 1)
+                self.assertEqual(sorted(event["id"] for event in events), [event["id"] for event in events])
+
+                response = await api.request(
+                    "POST", "/employees", json={"name": "Jean Dupont", "position": "Développeur", "hourlyRate": 25.5}
+                )
+                event = await stream.next_event()
+                self.assertEqual((event["type"], event["employeeId"]), ("employee_created", response.json()["id"]))
+            self.assertEqual(api.server.broker.subscriber_count, 0)
+
+    async def test_slow_subscriber_is_told_to_resync(self):
+        async with ApiHarness(env={"EVENT_QUEUE_SIZE": "4"}) as api:
+            employees = await api.seed_employees(8)
+            async with api.event_stream() as stream:
+                # The client reads nothing meanwhile; the writes mustn't wait for it
+                for employee in employees:
+                    response = await api.request("POST", f"/clock-in/{employee['id']}")
+                    self.assertEqual(response.status_code, 200)
+
+                # The delta the server was already sending, then one resync
+                # in place of the four queued and everything after them
+                event = await stream.next_event()
+                self.assertEqual((event["type"], event["employeeId"]), ("clock_in", employees[0]["id"]))
+                self.assertEqual((await stream.next_event())["type"], "resync")
+                self.assertTrue(await stream.no_event())
+
+                # Once drained, deltas flow again
+                await api.request("POST", f"/start-break/{employees[0]['id']}")
+                event = await stream.next_event()
+                self.assertEqual((event["type"], event["employeeId"]), ("start_break", employees[0]["id"]))
+
+    async def test_each_subscriber_gets_every_delta(self):
+        async with ApiHarness() as api:
+            [employee] = await api.seed_employees(1)
+            async with api.event_stream() as first, api.event_stream() as second:
+                self.assertEqual(api.server.broker.subscriber_count, 2)
+                await api.request("POST", f"/clock-in/{employee['id']}")
+                for stream in (first, second):
+                    self.assertEqual((await stream.next_event())["type"], "clock_in")
+            self.assertEqual(api.server.broker.subscriber_count, 0)
+
+
+class MetricsTest(unittest.IsolatedAsyncioTestCase):
+    # The registry is per process, shared by every harness: compare deltas
+    async def asyncSetUp(self):
+        self.api = await ApiHarness().__aenter__()
+
+    async def asyncTearDown(self):
+        await self.api.__aexit__(None, None, None)
+
+    async def scrape(self):
+        response = await self.api.request("GET", "http://test/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        samples = {}
+        for line in response.text.splitlines():
+            if line and not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+        return response.text, samples
+
+    async def test_requests_are_counted_per_route_template(self):
+        employees = await self.api.seed_employees(2)
+        route = 'method="POST",route="/api/clock-in/{employee_id}"'
+        _, before = await self.scrape()
+        for employee in employees:
+            await self.api.request("POST", f"/clock-in/{employee['id']}")
+        await self.api.request("POST", "/clock-in/unknown")
+        await self.api.request("GET", "/no-such-route")
+        text, after = await self.scrape()
+
+        def delta(sample):
+            return after.get(sample, 0) - before.get(sample, 0)
+
+        self.assertEqual(delta(f'http_requests_total{{{route},status="200"}}'), 2)
+        self.assertEqual(delta(f'http_requests_total{{{route},status="404"}}'), 1)
+        self.assertEqual(delta('http_requests_total{method="GET",route="unmatched",status="404"}'), 1)
+        self.assertEqual(delta(f'http_request_duration_seconds_count{{{route}}}'), 3)
+        self.assertEqual(after[f'http_requests_in_flight{{{route}}}'], 0)
+        for employee in employees:
+            self.assertNotIn(employee["id"], text)
+        # The scrapes themselves aren't recorded
+        self.assertNotIn('route="/metrics"', text)
+
+    async def test_latency_histogram_is_cumulative(self):
+        await self.api.request("GET", "/health")
+        text, samples = await self.scrape()
+        self.assertIn("# TYPE http_request_duration_seconds histogram", text)
+        route = 'method="GET",route="/api/health"'
+        buckets = [
+            value for sample, value in samples.items()
+            if sample.startswith(f"http_request_duration_seconds_bucket{{{route},")
+        ]
+        self.assertEqual(len(buckets), 12)
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(samples[f'http_request_duration_seconds_bucket{{{route},le="+Inf"}}'],
+                         samples[f'http_request_duration_seconds_count{{{route}}}'])
+        self.assertGreater(samples[f'http_request_duration_seconds_sum{{{route}}}'], 0)
+
+    async def test_clock_events_are_counted_by_action(self):
+        [employee] = await self.api.seed_employees(1)
+        _, before = await self.scrape()
+        for action in ("clock-in", "start-break", "clock-out"):
+            await self.api.request("POST", f"/{action}/{employee['id']}")
+        # Refused transitions apply no event
+        await self.api.request("POST", f"/clock-out/{employee['id']}")
+        _, after = await self.scrape()
+        for action in ("clock_in", "start_break", "clock_out"):
+            sample = f'timetracker_clock_events_total{{action="{action}",source="tap"}}'
+            self.assertEqual(after[sample] - before.get(sample, 0), 1)
+
+
+class IsolationTest(unittest.IsolatedAsyncioTestCase):
+    async def test_scenarios_run_side_by_side(self):
+        async def scenario(api, employees):
+            seeded = await api.seed_employees(employees)
+            await asyncio.gather(*(api.request("POST", f"/clock-in/{employee['id']}") for employee in seeded))
+            return len((await api.request("GET", "/employees")).json())
+
+        sizes = [1, 5, 10, 20]
+        counts = await run_scenarios([lambda api, size=size: scenario(api, size) for size in sizes])
+        self.assertEqual(counts, sizes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Planning batched clock events against the open entries loaded up front."""
+import unittest
+from collections import defaultdict
+from datetime import datetime
+from types import SimpleNamespace
+
+from pymongo import InsertOne, UpdateOne
+
+from clock_batch import apply_clock_plan, plan_clock_events
+
+START = datetime(2024, 1, 15, 8)
+
+
+def new_entry(employee_id, start_time):
+    return {"id": f"new-{employee_id}", "employeeId": employee_id, "startTime": start_time,
+            "endTime": None, "breaks": [], "status": "active"}
+
+
+def plan(events, open_entries=None):
+    return plan_clock_events(
+        [{"employeeId": employee_id, "action": action, "timestamp": timestamp}
+         for employee_id, action, timestamp in events],
+        {"employee-1", "employee-2"}, open_entries or {}, new_entry
+    )
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.writes = []
+
+    async def bulk_write(self, operations, ordered=True):
+        self.writes.append([type(operation).__name__ for operation in operations])
+        return SimpleNamespace(matched_count=sum(isinstance(operation, UpdateOne) for operation in operations))
+
+
+class RecordingDatabase(defaultdict):
+    def __init__(self):
+        super().__init__(RecordingCollection)
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+class PlanClockEventsTest(unittest.TestCase):
+    def setUp(self):
+        self.open_entry = {"id": "entry-1", "employeeId": "employee-1", "startTime": START, "endTime": None,
+                           "breaks": [], "status": "active"}
+
+    def test_one_operation_per_entry(self):
+        result = plan([
+            ("employee-1", "start_break", "2024-01-15T12:00:00"),
+            ("employee-1", "end_break", "2024-01-15T12:30:00"),
+            ("employee-1", "clock_out", "2024-01-15T16:00:00"),
+            ("employee-2", "clock_in", "2024-01-15T09:00:00"),
+            ("employee-2", "clock_out", "2024-01-15T17:00:00"),
+        ], {"employee-1": self.open_entry})
+        self.assertTrue(all(event["ok"] for event in result.results))
+        update, insert = result.operations
+        self.assertIsInstance(update, UpdateOne)
+        self.assertEqual(update._filter, {"id": "entry-1", "status": "active", "breaks": []})
+        self.assertEqual(update._doc["$set"]["status"], "completed")
+        self.assertIsInstance(insert, InsertOne)
+        self.assertEqual(insert._doc["status"], "completed")
+
+    def test_closing_updates_come_before_inserts(self):
+        result = plan([
+            ("employee-1", "clock_out", "2024-01-15T16:00:00"),
+            ("employee-1", "clock_in", "2024-01-15T16:05:00"),
+        ], {"employee-1": self.open_entry})
+        self.assertTrue(all(event["ok"] for event in result.results))
+        update, insert = result.operations
+        self.assertIsInstance(update, UpdateOne)
+        self.assertEqual(update._doc["$set"]["status"], "completed")
+        self.assertIsInstance(insert, InsertOne)
+        self.assertEqual(insert._doc["status"], "active")
+
+    def test_timestamps_going_backwards_are_rejected(self):
+        result = plan([
+            ("employee-1", "clock_out", "2024-01-15T07:00:00"),
+            ("employee-1", "start_break", "2024-01-15T12:00:00"),
+            ("employee-1", "end_break", "2024-01-15T11:00:00"),
+        ], {"employee-1": self.open_entry})
+        self.assertEqual([event["ok"] for event in result.results], [False, True, False])
+        self.assertEqual(result.after["entry-1"]["status"], "on_break")
+
+
+
+class ApplyClockPlanTest(unittest.IsolatedAsyncioTestCase):
+    async def test_entries_are_closed_before_new_ones_are_opened(self):
+        open_entry = {"id": "entry-1", "employeeId": "employee-1", "startTime": START, "endTime": None,
+                      "breaks": [], "status": "active"}
+        result = plan([
+            ("employee-1", "clock_out", "2024-01-15T16:00:00"),
+            ("employee-1", "clock_in", "2024-01-15T16:05:00"),
+        ], {"employee-1": open_entry})
+        db = RecordingDatabase()
+        changes = await apply_clock_plan(db, result)
+        # An unordered bulk runs its inserts first, so each kind has its own
+        self.assertEqual(db.time_entries.writes, [["UpdateOne"], ["InsertOne"]])
+        self.assertEqual(len(changes), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Events derived from time entry changes, folding them back into entries, and rebuilds."""
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from pymongo import InsertOne
+from pymongo.errors import AutoReconnect
+
+import event_store
+from event_store import EVENTS_COLLECTION, append_events, entry_event, fold, rebuild_employee, undo_changes
+from indexes import OPEN_ENTRY_INDEX
+from timesheet import OPEN_STATUSES
+
+try:
+    import mongomock_motor
+except ImportError:
+    mongomock_motor = None
+
+START = datetime(2024, 1, 15, 8)
+
+
+def at(hour: int, minute: int = 0) -> datetime:
+    return START.replace(hour=hour, minute=minute)
+
+
+class EntryEventTest(unittest.TestCase):
+    def setUp(self):
+        self.clocked_in = {
+            "id": "entry-1", "employeeId": "employee-1", "startTime": START, "endTime": None,
+            "breaks": [], "status": "active", "notes": None, "createdAt": START,
+        }
+        self.on_break = {**self.clocked_in, "status": "on_break", "breaks": [{"startTime": at(12), "endTime": None}]}
+        self.back = {**self.on_break, "status": "active", "breaks": [{"startTime": at(12), "endTime": at(12, 30)}]}
+        self.clocked_out = {**self.back, "status": "completed", "endTime": at(16)}
+
+    def test_a_shift_of_taps(self):
+        images = [None, self.clocked_in, self.on_break, self.back, self.clocked_out]
+        events = [entry_event(before, after) for before, after in zip(images, images[1:])]
+        self.assertEqual(
+            [(event["type"], event["at"]) for event in events],
+            [("entry_created", START), ("break_started", at(12)), ("break_ended", at(12, 30)),
+             ("clocked_out", at(16))]
+        )
+        self.assertEqual(events[3]["changes"], {"status": "completed", "endTime": at(16)})
+
+        entries = {}
+        for event in events:
+            fold(entries, event)
+        self.assertEqual(entries, {"entry-1": self.clocked_out})
+
+    def test_corrections_keep_only_the_changed_fields(self):
+        corrected = {**self.clocked_out, "endTime": at(17), "notes": "forgot to clock out"}
+        event = entry_event(self.clocked_out, corrected)
+        self.assertEqual(event["type"], "entry_corrected")
+        self.assertEqual(event["changes"], {"endTime": at(17), "notes": "forgot to clock out"})
+        # Removing a break is a correction, not the end of one
+        self.assertEqual(entry_event(self.on_break, {**self.on_break, "status": "active", "breaks": []})["type"],
+                         "entry_corrected")
+        self.assertIsNone(entry_event(self.clocked_out, dict(self.clocked_out)))
+
+    def test_deletion_leaves_a_tombstone(self):
+        entries = {}
+        fold(entries, entry_event(None, self.clocked_out))
+        fold(entries, entry_event(self.clocked_out, None))
+        self.assertEqual(entries, {"entry-1": None})
+
+
+
+class DriverCollection:
+    """A mongomock collection whose unordered bulk writes run their inserts
+    first, as pymongo's do; ``lost_inserts`` inserts are acknowledged with
+    a connection error, as if the reply had been lost."""
+
+    def __init__(self, collection, lost_inserts=0):
+        self._collection = collection
+        self.lost_inserts = lost_inserts
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, operations, ordered=True):
+        if not ordered:
+            operations = sorted(operations, key=lambda operation: not isinstance(operation, InsertOne))
+        return await self._collection.bulk_write(operations, ordered=ordered)
+
+    async def insert_many(self, documents, ordered=True):
+        result = await self._collection.insert_many(documents, ordered=ordered)
+        if self.lost_inserts:
+            self.lost_inserts -= 1
+            raise AutoReconnect("connection closed")
+        return result
+
+
+class DriverDatabase:
+    def __init__(self, db):
+        self._db = db
+        self._collections = {}
+
+    def __getattr__(self, name):
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = DriverCollection(self._db[name])
+        return self._collections[name]
+
+
+@unittest.skipUnless(mongomock_motor, "needs the mongomock-motor package")
+class EventLogTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = DriverDatabase(mongomock_motor.AsyncMongoMockClient()["event_store_test"])
+        await self.db.time_entries.create_index(
+            "employeeId", name=OPEN_ENTRY_INDEX, unique=True,
+            partialFilterExpression={"status": {"$in": OPEN_STATUSES}},
+        )
+        self.clocked_in = {"id": "entry-1", "employeeId": "employee-1", "startTime": START, "endTime": None,
+                           "breaks": [], "status": "active"}
+        self.clocked_out = {**self.clocked_in, "status": "completed", "endTime": at(16)}
+        self.next_shift = {**self.clocked_in, "id": "entry-2", "startTime": at(16, 5)}
+
+    async def entries(self):
+        return {entry["id"]: entry["status"] for entry in await self.db.time_entries.find().to_list(None)}
+
+    async def test_rebuild_closes_before_it_opens(self):
+        for change in ((None, self.clocked_in), (self.clocked_in, self.clocked_out), (None, self.next_shift)):
+            await append_events(self.db, [change])
+        # The clock-out and the next clock-in never reached time_entries
+        await self.db.time_entries.insert_one(dict(self.clocked_in))
+        self.assertEqual(await rebuild_employee(self.db, "employee-1"), 2)
+        self.assertEqual(await self.entries(), {"entry-1": "completed", "entry-2": "active"})
+
+    async def test_retried_appends_log_each_event_once(self):
+        self.db[EVENTS_COLLECTION].lost_inserts = 1
+        with mock.patch.object(event_store, "APPEND_RETRY_DELAY", 0):
+            logged = await append_events(self.db, [(None, self.clocked_in), (self.clocked_in, self.clocked_out)])
+        self.assertEqual(logged, 2)
+        events = await self.db[EVENTS_COLLECTION].find().sort("sequence").to_list(None)
+        self.assertEqual([event["type"] for event in events], ["entry_created", "clocked_out"])
+
+    async def test_undo_reopens_after_removing_the_next_entry(self):
+        await self.db.time_entries.insert_many([dict(self.clocked_out), dict(self.next_shift)])
+        changes = [(self.clocked_in, self.clocked_out), (None, self.next_shift)]
+        self.assertEqual(await undo_changes(self.db, changes), changes[::-1])
+        self.assertEqual(await self.entries(), {"entry-1": "active"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""The tap journal on its own, applying taps through a stand-in for sync.ingest."""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from journal import TapJournal
+
+
+class RecordingApplier:
+    def __init__(self, outcomes=None, default="applied"):
+        self.batches = []
+        self.outcomes = outcomes or {}
+        self.default = default
+
+    async def __call__(self, records):
+        self.batches.append(records)
+        acks = {record["key"]: self.outcomes.get(record["key"], self.default) for record in records}
+        return {"acks": acks, "errors": {}}
+
+
+async def settled(journal):
+    while journal.backlog:
+        await asyncio.sleep(0.01)
+
+
+class TapJournalTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="journal-test-")
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def segments(self):
+        return sorted(os.listdir(self.directory))
+
+    async def test_taps_are_applied_and_segments_removed(self):
+        journal = TapJournal(self.directory, segment_bytes=1024)
+        applier = RecordingApplier()
+        await journal.start(applier)
+        records = await asyncio.gather(*(
+            journal.append(f"employee-{index}", "clock_in", "2024-01-15T08:00:00") for index in range(50)
+        ))
+        await asyncio.wait_for(settled(journal), 5)
+        await journal.stop()
+
+        applied = [record["key"] for batch in applier.batches for record in batch]
+        self.assertEqual(applied, [record["key"] for record in records])
+        self.assertEqual(journal.backlog, 0)
+        self.assertEqual(self.segments(), [])
+
+    async def test_start_replays_what_was_left(self):
+        with open(os.path.join(self.directory, "taps-000000000003.log"), "wb") as segment:
+            for key in ("first", "second"):
+                segment.write(json.dumps({
+                    "key": key, "employeeId": "employee-1", "action": "clock_in", "timestamp": None
+                }).encode() + b"\n")
+            segment.write(b'{"key": "torn", "empl')  # crashed mid-write, never acknowledged
+        journal = TapJournal(self.directory)
+        applier = RecordingApplier(outcomes={"first": "duplicate"})
+        await journal.start(applier)
+        await asyncio.wait_for(settled(journal), 5)
+
+        self.assertEqual([[record["key"] for record in batch] for batch in applier.batches], [["first", "second"]])
+        self.assertEqual(self.segments(), ["taps-000000000004.log"])
+        await journal.stop()
+        self.assertEqual(self.segments(), [])
+
+    async def test_conflicts_are_retried_until_settled(self):
+        journal = TapJournal(self.directory, retry_delay=0)
+        applier = RecordingApplier(default="retry")
+        await journal.start(applier)
+        record = await journal.append("employee-1", "clock_out", "2024-01-15T16:00:00")
+        while len(applier.batches) < 3:
+            await asyncio.sleep(0.01)
+        applier.outcomes[record["key"]] = "applied"
+        await asyncio.wait_for(settled(journal), 5)
+        await journal.stop()
+        self.assertEqual(self.segments(), [])
+
+    async def test_stop_leaves_the_backlog_for_the_next_start(self):
+        journal = TapJournal(self.directory, retry_delay=0.01)
+        await journal.start(RecordingApplier(default="retry"))
+        record = await journal.append("employee-1", "clock_in", "2024-01-15T08:00:00")
+        await journal.stop()
+        self.assertEqual(journal.backlog, 1)
+
+        journal = TapJournal(self.directory)
+        applier = RecordingApplier()
+        await journal.start(applier)
+        await asyncio.wait_for(settled(journal), 5)
+        await journal.stop()
+        self.assertEqual([[tap["key"] for tap in batch] for batch in applier.batches], [[record["key"]]])
+        self.assertEqual(self.segments(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
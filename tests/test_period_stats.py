@@ -0,0 +1,57 @@
+"""The per-day summaries behind ranged /api/stats, shared by several workers."""
+import unittest
+from datetime import date
+from unittest import mock
+
+import period_stats
+from period_stats import STATS_CACHE, DailyStatsCache, summary_id
+from rollups import ROLLUP_COLLECTION
+
+try:
+    import mongomock_motor
+except ImportError:
+    mongomock_motor = None
+
+DAY = date(2024, 1, 15)
+TODAY = date(2024, 2, 1)
+
+
+@unittest.skipUnless(mongomock_motor, "needs the mongomock-motor package")
+class DailyStatsCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.db = mongomock_motor.AsyncMongoMockClient()["period_stats_test"]
+        await self.db[ROLLUP_COLLECTION].insert_one({
+            "employeeId": "employee-1", "day": DAY.isoformat(), "workedSeconds": 27000.0,
+            "breakSeconds": 1800.0, "elapsedSeconds": 28800.0, "entryCount": 1,
+        })
+
+    async def stored(self):
+        return await self.db[STATS_CACHE].find_one({"_id": summary_id(DAY.isoformat(), None)})
+
+    async def test_invalidation_by_another_worker_wins_over_a_slower_write(self):
+        reader, editor = DailyStatsCache(ttl=60), DailyStatsCache(ttl=60)
+        compute = period_stats.compute_summaries
+
+        async def edited_meanwhile(db, days, employee_id):
+            summaries = await compute(db, days, employee_id)
+            await editor.invalidate(db, [("employee-1", DAY.isoformat())], TODAY)
+            return summaries
+
+        with mock.patch.object(period_stats, "compute_summaries", edited_meanwhile):
+            await reader.summaries(self.db, [DAY], None, TODAY)
+        self.assertTrue((await self.stored())["stale"])
+        self.assertIsNone(reader.memory.get((DAY.isoformat(), None)))
+
+        # The next read recomputes it and stores it over the new generation
+        fresh = DailyStatsCache(ttl=60)
+        summaries = await fresh.summaries(self.db, [DAY], None, TODAY)
+        self.assertEqual(summaries[DAY.isoformat()]["elapsedSeconds"], 28800.0)
+        stored = await self.stored()
+        self.assertEqual((stored.get("stale"), stored["generation"]), (None, 1))
+        other = DailyStatsCache(ttl=60)
+        self.assertEqual(await other.summaries(self.db, [DAY], None, TODAY), summaries)
+        self.assertEqual((other.stored_hits, other.computed), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+"""The presence board on its own, loaded from a stand-in for storage.py."""
+import asyncio
+import unittest
+from datetime import datetime
+
+from presence import PresenceIndex
+
+START = datetime(2024, 1, 15, 8)
+
+
+class SlowStorage:
+    """Returns ``entries`` once ``release`` is set, like a slow query."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.reading = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def find_time_entries(self, statuses=None, projection=None):
+        self.reading.set()
+        await self.release.wait()
+        return list(self.entries)
+
+
+def open_entry(employee_id, entry_id, status="active"):
+    return {"id": entry_id, "employeeId": employee_id, "status": status, "startTime": START, "breaks": []}
+
+
+def delta(employee_id, entry_id, status):
+    return {"type": "entry_updated", "employeeId": employee_id, "entryId": entry_id, "status": status, "since": START}
+
+
+class PresenceIndexTest(unittest.IsolatedAsyncioTestCase):
+    async def test_taps_during_a_warm_are_kept(self):
+        # Read before employee-2 clocked in and employee-1 clocked out
+        storage = SlowStorage([open_entry("employee-1", "entry-1")])
+        presence = PresenceIndex()
+        warming = asyncio.create_task(presence.warm(storage))
+        await storage.reading.wait()
+        presence.apply(delta("employee-2", "entry-2", "active"))
+        presence.apply(delta("employee-1", "entry-1", "completed"))
+        storage.release.set()
+        await warming
+        self.assertEqual([row["employeeId"] for row in presence.board()], ["employee-2"])
+
+    async def test_repair_keeps_taps_made_during_the_check(self):
+        presence = PresenceIndex()
+        presence.apply(delta("employee-3", "entry-3", "active"))  # stale: the store has no open entry
+        storage = SlowStorage([open_entry("employee-1", "entry-1")])
+        checking = asyncio.create_task(presence.check(storage, repair=True))
+        await storage.reading.wait()
+        presence.apply(delta("employee-1", "entry-1", "on_break"))
+        storage.release.set()
+        report = await checking
+        self.assertEqual((report["stale"], report["repaired"]), (["employee-3"], True))
+        self.assertEqual(presence.get("employee-1")["status"], "on_break")
+        self.assertIsNone(presence.get("employee-3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Acks of offline sync batches, applied through a stand-in for the clock batch."""
+import unittest
+from types import SimpleNamespace
+
+from clock_batch import CONFLICT
+from sync import SYNC_RECEIPTS, ingest
+
+try:
+    import mongomock_motor
+except ImportError:
+    mongomock_motor = None
+
+
+def operation(key, action="clock_in"):
+    return {"key": key, "employeeId": "employee-1", "action": action, "timestamp": "2024-01-15T08:00:00"}
+
+
+class PlannedEvents:
+    """Results by event index: ok, or ``(error, code)``."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = outcomes
+        self.calls = 0
+
+    async def __call__(self, events):
+        self.calls += 1
+        results = []
+        for index, outcome in enumerate(self.outcomes[:len(events)]):
+            if outcome == "ok":
+                results.append({"ok": True, "entryId": f"entry-{index}"})
+            else:
+                error, code = outcome
+                results.append({"ok": False, "error": error, **({"code": code} if code else {})})
+        return SimpleNamespace(results=results)
+
+
+@unittest.skipUnless(mongomock_motor, "needs the mongomock-motor package")
+class IngestTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.db = mongomock_motor.AsyncMongoMockClient()["sync_test"]
+
+    async def test_conflicts_are_released_for_a_retry(self):
+        apply_events = PlannedEvents(
+            "ok", ("Conflicting concurrent update", CONFLICT), ("No active break found for employee", None)
+        )
+        operations = [operation("a"), operation("b", "clock_out"), operation("c", "end_break")]
+        response = await ingest(self.db, operations, "kiosk-1", apply_events)
+        self.assertEqual(response["acks"], {"a": "applied", "b": "retry", "c": "rejected"})
+
+        receipts = {receipt["_id"]: receipt["status"] for receipt in await self.db[SYNC_RECEIPTS].find().to_list(None)}
+        self.assertEqual(receipts, {"a": "applied", "c": "rejected"})
+
+        # Only the conflicting key is applied again
+        response = await ingest(self.db, operations, "kiosk-1", PlannedEvents("ok"))
+        self.assertEqual(response["acks"], {"a": "duplicate", "b": "applied", "c": "rejected"})
+
+
+if __name__ == "__main__":
+    unittest.main()